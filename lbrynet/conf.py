@@ -156,6 +156,20 @@ ADJUSTABLE_SETTINGS = {
     'api_host': (str, 'localhost'),
 
     'api_port': (int, 5279),
+    'blob_cache_size': (int, 10000),  # number of blob objects kept in memory
+    # store blob files nested this many directories deep (ab/cd/<hash> for 2)
+    # existing blobs are moved in the background when this is changed
+    'blob_dir_shard_depth': (int, 0),
+    # evict hosted blobs once the blob store is larger than blob_quota_bytes or holds more than
+    # blob_quota_count blobs (0 for no limit), in the order chosen by blob_eviction_policy:
+    # lru_upload, least_available or lowest_earning
+    'blob_eviction_policy': (str, 'lru_upload'),
+    'blob_quota_bytes': (int, 0),
+    'blob_quota_count': (int, 0),
+    # re-hash stored blobs which haven't been verified for this many seconds, reading at most
+    # blob_scrub_rate bytes/second (0 to turn the integrity checks off)
+    'blob_scrub_interval': (int, 7 * 24 * 60 * 60),
+    'blob_scrub_rate': (int, 1 * MB),
     'cache_time': (int, 150),
     'check_ui_requirements': (bool, True),
     'data_dir': (str, default_data_dir),
@@ -163,6 +177,8 @@ ADJUSTABLE_SETTINGS = {
     'default_ui_branch': (str, 'master'),
     'delete_blobs_on_remove': (bool, True),
     'dht_node_port': (int, 4444),
+    # save the DHT node's ID, contacts and stored peers on shutdown, so it can rejoin quickly
+    'dht_persist_state': (bool, False),
     'download_directory': (str, default_download_directory),
     'download_timeout': (int, 180),
     'host_ui': (bool, True),
@@ -191,7 +207,11 @@ ADJUSTABLE_SETTINGS = {
     'min_info_rate': (float, .02),  # points/1000 infos
     'min_valuable_hash_rate': (float, .05),  # points/1000 infos
     'min_valuable_info_rate': (float, .05),  # points/1000 infos
+    'packed_blob_segment_size': (int, 1024 * MB),
     'peer_port': (int, 3333),
+    # how new peers to download from are chosen: ucb, which prefers peers which were fast, cheap
+    # and reliable before while still trying others, or random
+    'peer_selection_policy': (str, 'ucb'),
     'pointtrader_server': (str, 'http://127.0.0.1:2424'),
     'reflector_port': (int, 5566),
     'reflect_uploads': (bool, True),
@@ -206,6 +226,8 @@ ADJUSTABLE_SETTINGS = {
     'startup_scripts': (list, []),
     'ui_branch': (str, 'master'),
     'use_auth_http': (bool, False),
+    # store blobs appended to large segment files rather than one file per blob
+    'use_packed_blob_store': (bool, False),
     'use_upnp': (bool, True),
     'wallet': (str, LBRYUM_WALLET),
 }
@@ -2,7 +2,6 @@ import logging
 import random
 import time
 
-from twisted.internet import defer
 from twisted.internet.task import LoopingCall
 from decimal import Decimal
 
@@ -48,44 +47,44 @@ class BlobAvailabilityTracker(object):
         return d
 
     def get_availability_for_blobs(self, blobs, timeout=None):
-        dl = [self.get_blob_availability(blob, timeout) for blob in blobs if blob]
-        d = defer.DeferredList(dl)
-        d.addCallback(lambda results: [val for success, val in results if success])
+        def _get_peer_counts(peers):
+            return [
+                {blob: sum(1 for peer in peers[blob] if peer.is_available())}
+                for blob in blobs if blob in peers
+            ]
+
+        blobs = [blob for blob in blobs if blob]
+        d = self._peer_finder.find_peers_for_blobs(blobs, timeout)
+        d.addCallback(_get_peer_counts)
         return d
 
     @property
     def last_mean_availability(self):
         return max(Decimal(0.01), self._last_mean_availability)
 
-    def _update_peers_for_blob(self, blob):
-        def _save_peer_info(blob_hash, peers):
-            v = {blob_hash: peers}
+    def _update_peers_for_blobs(self, blobs):
+        def _save_peer_info(peers):
+            v = {
+                blob_hash: [[c.host, c.port, c.is_available()] for c in blob_peers]
+                for blob_hash, blob_peers in peers.iteritems()
+            }
             self.availability.update(v)
             return v
 
-        d = self._peer_finder.find_peers_for_blob(blob)
-        d.addCallback(lambda r: [[c.host, c.port, c.is_available()] for c in r])
-        d.addCallback(lambda peers: _save_peer_info(blob, peers))
+        # the blobs are looked up in one batch, which shares the DHT nodes it finds between them
+        d = self._peer_finder.find_peers_for_blobs(blobs)
+        d.addCallback(_save_peer_info)
         return d
 
     def _get_most_popular(self):
-        dl = []
-        for (hash, _) in self._dht_node.get_most_popular_hashes(10):
-            encoded = hash.encode('hex')
-            dl.append(self._update_peers_for_blob(encoded))
-        return defer.DeferredList(dl)
+        hashes = self._dht_node.get_most_popular_hashes(10)
+        return self._update_peers_for_blobs([hash.encode('hex') for (hash, _) in hashes])
 
     def _update_most_popular(self):
         d = self._get_most_popular()
         d.addCallback(lambda _: self._set_mean_peers())
 
     def _update_mine(self):
-        def _get_peers(blobs):
-            dl = []
-            for hash in blobs:
-                dl.append(self._update_peers_for_blob(hash))
-            return defer.DeferredList(dl)
-
         def sample(blobs):
             return random.sample(blobs, min(len(blobs), 10))
 
@@ -97,7 +96,7 @@ class BlobAvailabilityTracker(object):
         # so taking a sample should get about the same effect as querying the entire
         # list of blobs
         d.addCallback(sample)
-        d.addCallback(_get_peers)
+        d.addCallback(self._update_peers_for_blobs)
         d.addCallback(lambda _: self._set_mean_peers())
         d.addCallback(lambda _: log.debug('<== Done updating peers for my blobs. Took %s seconds',
                                           time.time() - start))
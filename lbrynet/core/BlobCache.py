@@ -0,0 +1,119 @@
+import logging
+import weakref
+from collections import OrderedDict
+
+
+log = logging.getLogger(__name__)
+
+
+def blob_is_idle(blob):
+    return not blob.writers and not blob.readers
+
+
+class LRUBlobCache(object):
+    """A size bounded, dict-like cache of HashBlob objects keyed by blob hash
+
+    The least recently used blobs are evicted once more than max_size blobs are cached, skipping
+    over blobs which are currently being read or written. Evicted blobs which are still referenced
+    elsewhere (by a downloader, for instance) are tracked weakly, so asking for one of them again
+    returns the same object rather than a second instance for the same hash.
+    """
+
+    def __init__(self, max_size, is_evictable=blob_is_idle):
+        assert max_size > 0
+        self.max_size = max_size
+        self.is_evictable = is_evictable
+        self._blobs = OrderedDict()
+        self._evicted = weakref.WeakValueDictionary()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, blob_hash, default=None):
+        blob = self._blobs.pop(blob_hash, None)
+        if blob is None:
+            blob = self._evicted.pop(blob_hash, None)
+        if blob is None:
+            self.misses += 1
+            return default
+        self.hits += 1
+        self._blobs[blob_hash] = blob
+        self._evict()
+        return blob
+
+    def peek(self, blob_hash, default=None):
+        """Get a blob without counting the lookup or changing its recency"""
+        blob = self._blobs.get(blob_hash)
+        if blob is None:
+            blob = self._evicted.get(blob_hash, default)
+        return blob
+
+    def pop(self, blob_hash, default=None):
+        blob = self._blobs.pop(blob_hash, None)
+        if blob is None:
+            blob = self._evicted.pop(blob_hash, default)
+        return blob
+
+    def get_stats(self):
+        return {
+            'size': len(self._blobs),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+    def iterkeys(self):
+        return iter(self._blobs.keys())
+
+    def itervalues(self):
+        return iter(self._blobs.values())
+
+    def iteritems(self):
+        return iter(self._blobs.items())
+
+    def _evict(self):
+        while len(self._blobs) > self.max_size:
+            blob_hash = self._get_least_recently_used_evictable()
+            if blob_hash is None:
+                log.debug("Blob cache is over its limit (%i > %i), all other blobs are in use",
+                          len(self._blobs), self.max_size)
+                return
+            self._evicted[blob_hash] = self._blobs.pop(blob_hash)
+            self.evictions += 1
+
+    def _get_least_recently_used_evictable(self):
+        # walk from the least recently used end, so only blobs in use are skipped over. Never
+        # evict the most recently used blob, it has just been handed out
+        newest = next(reversed(self._blobs))
+        for blob_hash, blob in self._blobs.iteritems():
+            if blob_hash == newest:
+                return None
+            if self.is_evictable(blob):
+                return blob_hash
+        return None
+
+    def __getitem__(self, blob_hash):
+        blob = self.get(blob_hash)
+        if blob is None:
+            raise KeyError(blob_hash)
+        return blob
+
+    def __setitem__(self, blob_hash, blob):
+        self._blobs.pop(blob_hash, None)
+        self._evicted.pop(blob_hash, None)
+        self._blobs[blob_hash] = blob
+        self._evict()
+
+    def __delitem__(self, blob_hash):
+        if self.pop(blob_hash) is None:
+            raise KeyError(blob_hash)
+
+    def __contains__(self, blob_hash):
+        return blob_hash in self._blobs or blob_hash in self._evicted
+
+    def __len__(self):
+        return len(self._blobs)
+
+    def __iter__(self):
+        return self.iterkeys()
@@ -1,15 +1,22 @@
+import collections
 import logging
 import os
 import time
-import sqlite3
 
 from twisted.internet import threads, defer
 from twisted.python.failure import Failure
 from twisted.enterprise import adbapi
+from lbrynet import conf
+from lbrynet.core.BlobCache import LRUBlobCache, blob_is_idle
 from lbrynet.core.HashBlob import BlobFile, TempBlob, BlobFileCreator, TempBlobCreator
+from lbrynet.core.HashBlob import PackedBlob, PackedBlobCreator
+from lbrynet.core.HashBlob import get_blob_file_path, make_blob_file_dir
+from lbrynet.core.BlobSegmentStore import BlobSegmentStore
+from lbrynet.core.BlobScrubber import BlobScrubber, hash_blob_data
 from lbrynet.core.server.DHTHashAnnouncer import DHTHashSupplier
 from lbrynet.core.Error import NoSuchBlobError
 from lbrynet.core.sqlite_helpers import rerun_if_locked
+from lbrynet.core.utils import is_valid_blobhash, is_valid_hashcharacter
 
 
 log = logging.getLogger(__name__)
@@ -69,6 +76,18 @@ class BlobManager(DHTHashSupplier):
     def add_blob_to_upload_history(self, blob_hash, host, rate):
         pass
 
+    def get_cache_stats(self):
+        pass
+
+    def get_scrubber_status(self):
+        pass
+
+    def get_stored_blob_lengths(self):
+        pass
+
+    def get_blob_upload_stats(self):
+        pass
+
     def _immediate_announce(self, blob_hashes):
         if self.hash_announcer:
             return self.hash_announcer.immediate_announce(blob_hashes)
@@ -79,79 +98,236 @@ class BlobManager(DHTHashSupplier):
 #       care what kind of Blob it has?
 class DiskBlobManager(BlobManager):
     """This class stores blobs on the hard disk"""
-    def __init__(self, hash_announcer, blob_dir, db_dir):
+    # seconds to collect blob completions, deletions and verifications before writing them
+    # to the database in a single transaction
+    DB_WRITE_INTERVAL = 0.1
+    MAX_SHARD_DEPTH = 3
+    # number of blob files moved to the configured directory layout per reactor iteration,
+    # and the seconds between those iterations
+    MIGRATION_BATCH_SIZE = 100
+    MIGRATION_INTERVAL = 0.1
+    # where blob files which failed an integrity check are moved to, relative to blob_dir
+    QUARANTINE_DIR = 'quarantine'
+
+    def __init__(self, hash_announcer, blob_dir, db_dir, cache_size=None, shard_depth=None,
+                 scrub_rate=None, scrub_interval=None):
         BlobManager.__init__(self, hash_announcer)
         self.blob_dir = blob_dir
+        self.shard_depth = (
+            shard_depth if shard_depth is not None else conf.settings['blob_dir_shard_depth'])
+        assert 0 <= self.shard_depth <= self.MAX_SHARD_DEPTH
         self.db_file = os.path.join(db_dir, "blobs.db")
         self.db_conn = None
         self.blob_type = BlobFile
         self.blob_creator_type = BlobFileCreator
-        # TODO: consider using an LRU for blobs as there could potentially
-        #       be thousands of blobs loaded up, many stale
-        self.blobs = {}
+        cache_size = cache_size if cache_size is not None else conf.settings['blob_cache_size']
+        self.blobs = LRUBlobCache(cache_size)
+        # hashes of the blobs which are complete on disk, so that availability can be
+        # answered without touching the file system
+        self.verified_blob_hashes = set()
         self.blob_hashes_to_delete = {} # {blob_hash: being_deleted (True/False)}
         self._next_manage_call = None
+        # blob files which are not yet in the configured directory layout
+        self._blobs_to_migrate = {}  # {blob_hash: shard_depth the file is currently at}
+        self._migration_queue = collections.deque()
+        self._next_migrate_call = None
+        # write-behind queue of database changes
+        self._pending_completed_blobs = {}  # {blob_hash: (length, next_announce_time, timestamp)}
+        self._pending_deleted_blobs = set()
+        # {blob_hash: (timestamp, length, next_announce_time)}
+        self._pending_verified_timestamps = {}
+        self._pending_db_write_deferreds = []
+        self._next_db_write_call = None
+        scrub_rate = scrub_rate if scrub_rate is not None else conf.settings['blob_scrub_rate']
+        scrub_interval = (
+            scrub_interval if scrub_interval is not None
+            else conf.settings['blob_scrub_interval'])
+        self.scrubber = BlobScrubber(self, scrub_rate, scrub_interval)
 
     def setup(self):
         log.info("Setting up the DiskBlobManager. blob_dir: %s, db_file: %s", str(self.blob_dir),
                  str(self.db_file))
         d = self._open_db()
+        d.addCallback(lambda _: self._load_verified_blob_hashes())
         d.addCallback(lambda _: self._manage())
+        d.addCallback(lambda _: self._migrate_blob_files())
+        d.addCallback(lambda _: self.scrubber.start())
         return d
 
     def stop(self):
         log.info("Stopping the DiskBlobManager")
+        self.scrubber.stop()
         if self._next_manage_call is not None and self._next_manage_call.active():
             self._next_manage_call.cancel()
             self._next_manage_call = None
-        self.db_conn = None
-        return defer.succeed(True)
+        if self._next_migrate_call is not None and self._next_migrate_call.active():
+            self._next_migrate_call.cancel()
+            self._next_migrate_call = None
+        d = self._flush_db_writes()
+
+        def close_db(_):
+            self.db_conn = None
+            return True
+
+        d.addBoth(close_db)
+        return d
 
     def get_blob(self, blob_hash, length=None):
         """Return a blob identified by blob_hash, which may be a new blob or a
         blob that is already on the hard disk
         """
         assert length is None or isinstance(length, int)
-        if blob_hash in self.blobs:
-            return defer.succeed(self.blobs[blob_hash])
+        blob = self.blobs.get(blob_hash)
+        if blob is not None:
+            return defer.succeed(blob)
         return self._make_new_blob(blob_hash, length)
 
     def get_blob_creator(self):
-        return self.blob_creator_type(self, self.blob_dir)
+        return self.blob_creator_type(self, self.blob_dir, self.shard_depth)
+
+    def get_cache_stats(self):
+        return self.blobs.get_stats()
+
+    def get_scrubber_status(self):
+        return self.scrubber.get_status()
+
+    def get_stored_blob_lengths(self):
+        """Get {blob_hash: length} for every blob which is stored"""
+
+        def get_lengths(rows):
+            lengths = {
+                blob_hash: length for blob_hash, length in rows
+                if blob_hash in self.verified_blob_hashes and length is not None
+            }
+            for blob_hash, (length, _, _) in self._pending_completed_blobs.iteritems():
+                if blob_hash in self.verified_blob_hashes:
+                    lengths[blob_hash] = length
+            # blobs which were found on disk but never added to the database
+            missing = [b for b in self.verified_blob_hashes if b not in lengths]
+            if not missing:
+                return lengths
+            d = threads.deferToThread(self._get_blob_file_sizes, missing)
+            d.addCallback(lengths.update)
+            d.addCallback(lambda _: lengths)
+            return d
+
+        d = self._get_blob_lengths()
+        d.addCallback(get_lengths)
+        return d
+
+    def get_blob_upload_stats(self):
+        """Get {blob_hash: (time of the last upload, sum of the upload payment rates)} for the
+        blobs which have been uploaded to peers
+        """
+        d = self._get_blob_upload_stats()
+        d.addCallback(lambda rows: {blob_hash: (ts, rate) for blob_hash, ts, rate in rows})
+        return d
+
+    def _get_blob_file_sizes(self, blob_hashes):
+        sizes = {}
+        for blob_hash in blob_hashes:
+            shard_depth = self._blobs_to_migrate.get(blob_hash, self.shard_depth)
+            try:
+                sizes[blob_hash] = os.path.getsize(
+                    get_blob_file_path(self.blob_dir, blob_hash, shard_depth))
+            except OSError:
+                pass
+        return sizes
+
+    def get_blob_hashes_to_scrub(self, verified_before):
+        """Get the hashes of the blobs which were last verified before the given time, least
+        recently verified first
+        """
+
+        def get_blob_hashes(rows):
+            last_verified = dict(rows)
+            blob_hashes = [
+                blob_hash for blob_hash in self.verified_blob_hashes
+                if (last_verified.get(blob_hash) or 0) < verified_before
+            ]
+            blob_hashes.sort(key=lambda blob_hash: last_verified.get(blob_hash) or 0)
+            return blob_hashes
+
+        d = self._get_blob_verified_timestamps()
+        d.addCallback(get_blob_hashes)
+        return d
+
+    @defer.inlineCallbacks
+    def scrub_blob(self, blob_hash):
+        """Re-hash a stored blob and quarantine it if its data no longer matches its hash
+
+        Returns a deferred which fires with (bytes read, whether the blob was corrupt)
+        """
+        if blob_hash not in self.verified_blob_hashes or blob_hash in self.blob_hashes_to_delete:
+            defer.returnValue((0, False))
+        blob = yield self.get_blob(blob_hash)
+        read_handle = blob.open_for_reading()
+        if read_handle is None:
+            defer.returnValue((0, False))
+        try:
+            computed_hash, length = yield threads.deferToThread(hash_blob_data, read_handle)
+        except (EnvironmentError, ValueError) as err:
+            # it may only be temporarily unreadable, it will be checked again
+            log.warning("Failed to read blob %s for an integrity check: %s", blob_hash, err)
+            defer.returnValue((0, False))
+        finally:
+            blob.close_read_handle(read_handle)
+        if blob_hash not in self.verified_blob_hashes or blob_hash in self.blob_hashes_to_delete:
+            # deleted while it was being checked
+            defer.returnValue((length, False))
+        if computed_hash == blob_hash:
+            yield self._update_blob_verified_timestamp(blob_hash, time.time(), length)
+            defer.returnValue((length, False))
+        log.warning("Blob %s is corrupt (its data hashes to %s), quarantining it",
+                    blob_hash, computed_hash)
+        yield self._quarantine_blob(blob)
+        defer.returnValue((length, True))
 
     def _make_new_blob(self, blob_hash, length=None):
         log.debug('Making a new blob for %s', blob_hash)
-        blob = self.blob_type(self.blob_dir, blob_hash, length)
+        shard_depth = self._blobs_to_migrate.get(blob_hash, self.shard_depth)
+        blob = self.blob_type(self.blob_dir, blob_hash, length, shard_depth)
         self.blobs[blob_hash] = blob
         return defer.succeed(blob)
 
     def blob_completed(self, blob, next_announce_time=None):
         if next_announce_time is None:
             next_announce_time = self.get_next_announce_time()
+        self.verified_blob_hashes.add(blob.blob_hash)
         d = self._add_completed_blob(blob.blob_hash, blob.length, next_announce_time)
         d.addCallback(lambda _: self._immediate_announce([blob.blob_hash]))
         return d
 
     def completed_blobs(self, blobhashes_to_check):
-        return self._completed_blobs(blobhashes_to_check)
+        return defer.succeed(
+            [b for b in blobhashes_to_check if b in self.verified_blob_hashes])
 
     def hashes_to_announce(self):
-        return self._get_blobs_to_announce()
+        d = self._get_blobs_to_announce()
+        # a row may outlive the data it describes, only announce blobs which can be served
+        d.addCallback(lambda blob_hashes: [
+            blob_hash for blob_hash in blob_hashes if blob_hash in self.verified_blob_hashes])
+        return d
 
     def creator_finished(self, blob_creator):
         log.debug("blob_creator.blob_hash: %s", blob_creator.blob_hash)
         assert blob_creator.blob_hash is not None
         assert blob_creator.blob_hash not in self.blobs
         assert blob_creator.length is not None
-        new_blob = self.blob_type(self.blob_dir, blob_creator.blob_hash, blob_creator.length)
+        new_blob = self._make_created_blob(blob_creator)
         self.blobs[blob_creator.blob_hash] = new_blob
         self._immediate_announce([blob_creator.blob_hash])
         next_announce_time = self.get_next_announce_time()
         d = self.blob_completed(new_blob, next_announce_time)
         return d
 
+    def _make_created_blob(self, blob_creator):
+        return self.blob_type(self.blob_dir, blob_creator.blob_hash, blob_creator.length,
+                              self.shard_depth)
+
     def delete_blobs(self, blob_hashes):
         for blob_hash in blob_hashes:
+            self.verified_blob_hashes.discard(blob_hash)
             if not blob_hash in self.blob_hashes_to_delete:
                 self.blob_hashes_to_delete[blob_hash] = False
 
@@ -173,6 +349,122 @@ class DiskBlobManager(BlobManager):
         d = self._add_blob_to_upload_history(blob_hash, host, rate)
         return d
 
+    def _scan_blob_dir(self):
+        """Find the blob files in blob_dir and in any shard directories beneath it
+
+        Returns {blob_hash: shard_depth}, preferring the configured shard depth if a blob was
+        found at more than one
+        """
+        found = {}
+        for dir_path, dir_names, file_names in os.walk(self.blob_dir):
+            rel_path = os.path.relpath(dir_path, self.blob_dir)
+            shards = [] if rel_path == os.curdir else rel_path.split(os.sep)
+            depth = len(shards)
+            dir_names[:] = [
+                n for n in dir_names
+                if depth < self.MAX_SHARD_DEPTH and len(n) == 2 and
+                all(is_valid_hashcharacter(c) for c in n)
+            ]
+            prefix = "".join(shards)
+            for file_name in file_names:
+                if is_valid_blobhash(file_name) and file_name.startswith(prefix):
+                    if found.get(file_name) != self.shard_depth:
+                        found[file_name] = depth
+        return found
+
+    def _load_verified_blob_hashes(self):
+
+        def set_verified_blob_hashes(blob_depths):
+            # blobs which were completed or deleted while the scan was running
+            # have already updated verified_blob_hashes, don't clobber them
+            blob_hashes = set(blob_depths)
+            blob_hashes.difference_update(self.blob_hashes_to_delete)
+            self.verified_blob_hashes.update(blob_hashes)
+            log.info("Found %i blobs in %s", len(blob_hashes), self.blob_dir)
+            for blob_hash in blob_hashes:
+                if blob_depths[blob_hash] != self.shard_depth:
+                    self._blobs_to_migrate[blob_hash] = blob_depths[blob_hash]
+                    self._migration_queue.append(blob_hash)
+
+        d = threads.deferToThread(self._scan_blob_dir)
+        d.addCallback(set_verified_blob_hashes)
+        return d
+
+    def _migrate_blob_files(self):
+        """Move a batch of blob files into the configured directory layout
+
+        Blobs which are being read, written or deleted are put back at the end of the queue.
+        The renames happen in the reactor thread so that a blob is never looked up at a path it
+        is in the middle of being moved away from.
+        """
+        from twisted.internet import reactor
+
+        self._next_migrate_call = None
+        if not self._migration_queue:
+            return
+        for _ in range(min(self.MIGRATION_BATCH_SIZE, len(self._migration_queue))):
+            blob_hash = self._migration_queue.popleft()
+            if blob_hash not in self._blobs_to_migrate:
+                continue
+            blob = self.blobs.peek(blob_hash)
+            if blob_hash in self.blob_hashes_to_delete or (blob and not blob_is_idle(blob)):
+                self._migration_queue.append(blob_hash)
+                continue
+            self._move_blob_file(blob_hash, blob)
+        if self._migration_queue:
+            self._next_migrate_call = reactor.callLater(self.MIGRATION_INTERVAL,
+                                                        self._migrate_blob_files)
+        else:
+            log.info("Finished moving blob files to a shard depth of %i", self.shard_depth)
+
+    def _move_blob_file(self, blob_hash, blob=None):
+        old_path = get_blob_file_path(self.blob_dir, blob_hash, self._blobs_to_migrate[blob_hash])
+        new_path = get_blob_file_path(self.blob_dir, blob_hash, self.shard_depth)
+        try:
+            if not os.path.isfile(old_path):
+                # the blob was deleted before it could be moved
+                del self._blobs_to_migrate[blob_hash]
+                return False
+            make_blob_file_dir(new_path)
+            if os.path.isfile(new_path):
+                os.remove(old_path)
+            else:
+                os.rename(old_path, new_path)
+        except (IOError, OSError) as err:
+            # leave it where it is, it remains readable at its old location
+            log.warning("Failed to move blob %s to %s: %s", blob_hash, new_path, err)
+            return False
+        del self._blobs_to_migrate[blob_hash]
+        if blob is not None:
+            blob.file_path = new_path
+        return True
+
+    def _quarantine_blob(self, blob):
+        """Stop serving and announcing a corrupt blob and move its data out of the way, so that
+        it can be downloaded again
+        """
+        self.verified_blob_hashes.discard(blob.blob_hash)
+        if self.blobs.peek(blob.blob_hash) is blob:
+            self.blobs.pop(blob.blob_hash)
+        self._blobs_to_migrate.pop(blob.blob_hash, None)
+        blob.invalidate()
+        d = self._delete_blobs_from_db([blob.blob_hash])
+        d.addCallback(lambda _: self._quarantine_blob_data(blob))
+        return d
+
+    def _quarantine_blob_data(self, blob):
+
+        def move_blob_file():
+            quarantine_path = os.path.join(self.blob_dir, self.QUARANTINE_DIR, blob.blob_hash)
+            make_blob_file_dir(quarantine_path)
+            if os.path.isfile(blob.file_path):
+                os.rename(blob.file_path, quarantine_path)
+            return quarantine_path
+
+        d = threads.deferToThread(move_blob_file)
+        d.addCallback(lambda path: log.info("Moved blob %s to %s", blob.blob_hash, path))
+        return d
+
     def _manage(self):
         from twisted.internet import reactor
 
@@ -187,6 +479,7 @@ class DiskBlobManager(BlobManager):
 
         def remove_from_list(b_h):
             del self.blob_hashes_to_delete[b_h]
+            self._blobs_to_migrate.pop(b_h, None)
             return b_h
 
         def set_not_deleting(err, b_h):
@@ -258,27 +551,106 @@ class DiskBlobManager(BlobManager):
 
         return self.db_conn.runInteraction(create_tables)
 
-    @rerun_if_locked
+    def _queue_db_write(self):
+        from twisted.internet import reactor
+
+        d = defer.Deferred()
+        self._pending_db_write_deferreds.append(d)
+        if self._next_db_write_call is None:
+            self._next_db_write_call = reactor.callLater(self.DB_WRITE_INTERVAL,
+                                                         self._write_pending_to_db)
+        return d
+
     def _add_completed_blob(self, blob_hash, length, next_announce_time):
         log.debug("Adding a completed blob. blob_hash=%s, length=%s", blob_hash, str(length))
-        d = self.db_conn.runQuery(
-            "insert into blobs (blob_hash, blob_length, next_announce_time) values (?, ?, ?)",
-            (blob_hash, length, next_announce_time)
-        )
-        d.addErrback(lambda err: err.trap(sqlite3.IntegrityError))
-        return d
+        self._pending_deleted_blobs.discard(blob_hash)
+        self._pending_completed_blobs[blob_hash] = (length, next_announce_time, time.time())
+        return self._queue_db_write()
 
-    @defer.inlineCallbacks
-    def _completed_blobs(self, blobhashes_to_check):
-        """Returns of the blobhashes_to_check, which are valid"""
-        blobs = yield defer.DeferredList([self.get_blob(b) for b in blobhashes_to_check])
-        blob_hashes = [b.blob_hash for success, b in blobs if success and b.verified]
-        defer.returnValue(blob_hashes)
+    def _update_blob_verified_timestamp(self, blob_hash, timestamp, length=None):
+        # given the length, a blob file which has no row (one found in blob_dir) is added
+        next_announce_time = self.get_next_announce_time() if length is not None else None
+        self._pending_verified_timestamps[blob_hash] = (timestamp, length, next_announce_time)
+        return self._queue_db_write()
+
+    def _delete_blobs_from_db(self, blob_hashes):
+        for blob_hash in blob_hashes:
+            self._pending_completed_blobs.pop(blob_hash, None)
+            self._pending_verified_timestamps.pop(blob_hash, None)
+            self._pending_deleted_blobs.add(blob_hash)
+        return self._queue_db_write()
+
+    def _flush_db_writes(self):
+        if self._next_db_write_call is not None and self._next_db_write_call.active():
+            self._next_db_write_call.cancel()
+        return self._write_pending_to_db()
+
+    def _take_pending_db_writes(self):
+        """Return the queued database changes as {change: [statement parameters]} and
+        clear the queue
+        """
+        changes = {
+            'completed': [
+                (blob_hash, length, timestamp, next_announce_time)
+                for blob_hash, (length, next_announce_time, timestamp)
+                in self._pending_completed_blobs.iteritems()
+            ],
+            'deleted': [(blob_hash,) for blob_hash in self._pending_deleted_blobs],
+            'found': [
+                (blob_hash, length, timestamp, next_announce_time)
+                for blob_hash, (timestamp, length, next_announce_time)
+                in self._pending_verified_timestamps.iteritems() if length is not None
+            ],
+            'verified': [
+                (timestamp, blob_hash)
+                for blob_hash, (timestamp, _, _) in self._pending_verified_timestamps.iteritems()
+            ],
+        }
+        self._pending_completed_blobs = {}
+        self._pending_deleted_blobs = set()
+        self._pending_verified_timestamps = {}
+        return changes
+
+    def _write_pending_to_db(self):
+        self._next_db_write_call = None
+        changes = self._take_pending_db_writes()
+        waiting = self._pending_db_write_deferreds
+        self._pending_db_write_deferreds = []
+
+        if not any(changes.itervalues()) or self.db_conn is None:
+            d = defer.succeed(True)
+        else:
+            log.debug("Writing %s blob changes to the db",
+                      ", ".join("%i %s" % (len(v), k) for k, v in changes.iteritems()))
+            d = self._run_db_writes(changes)
+
+        def notify_waiting(result):
+            for waiting_d in waiting:
+                waiting_d.callback(result)
+            return result
+
+        def notify_waiting_err(err):
+            log.warning("Failed to write blob changes to the db: %s", err.getErrorMessage())
+            for waiting_d in waiting:
+                waiting_d.errback(err)
+
+        d.addCallbacks(notify_waiting, notify_waiting_err)
+        return d
 
     @rerun_if_locked
-    def _update_blob_verified_timestamp(self, blob, timestamp):
-        return self.db_conn.runQuery("update blobs set last_verified_time = ? where blob_hash = ?",
-                                     (blob, timestamp))
+    def _run_db_writes(self, changes):
+        return self.db_conn.runInteraction(self._write_db_changes, changes)
+
+    def _write_db_changes(self, transaction, changes):
+        transaction.executemany(
+            "insert or ignore into blobs (blob_hash, blob_length, last_verified_time, " +
+            "    next_announce_time) values (?, ?, ?, ?)", changes['completed'])
+        transaction.executemany(
+            "insert or ignore into blobs (blob_hash, blob_length, last_verified_time, " +
+            "    next_announce_time) values (?, ?, ?, ?)", changes['found'])
+        transaction.executemany(
+            "update blobs set last_verified_time = ? where blob_hash = ?", changes['verified'])
+        transaction.executemany("delete from blobs where blob_hash = ?", changes['deleted'])
 
     @rerun_if_locked
     def _get_blobs_to_announce(self):
@@ -300,27 +672,27 @@ class DiskBlobManager(BlobManager):
         return self.db_conn.runInteraction(get_and_update)
 
     @rerun_if_locked
-    def _delete_blobs_from_db(self, blob_hashes):
+    def _get_blob_lengths(self):
+        return self.db_conn.runQuery("select blob_hash, blob_length from blobs")
 
-        def delete_blobs(transaction):
-            for b in blob_hashes:
-                transaction.execute("delete from blobs where blob_hash = ?", (b,))
+    @rerun_if_locked
+    def _get_blob_upload_stats(self):
+        return self.db_conn.runQuery("select blob, max(ts), sum(rate) from upload group by blob")
 
-        return self.db_conn.runInteraction(delete_blobs)
+    @rerun_if_locked
+    def _get_blob_verified_timestamps(self):
+        return self.db_conn.runQuery("select blob_hash, last_verified_time from blobs")
 
     @rerun_if_locked
     def _get_all_verified_blob_hashes(self):
         d = self.db_conn.runQuery("select blob_hash from blobs")
 
         def get_verified_blobs(blobs):
-            verified_blobs = []
-            for blob_hash, in blobs:
-                file_path = os.path.join(self.blob_dir, blob_hash)
-                if os.path.isfile(file_path):
-                    verified_blobs.append(blob_hash)
-            return verified_blobs
-
-        d.addCallback(lambda blobs: threads.deferToThread(get_verified_blobs, blobs))
+            blob_hashes = set(blob_hash for blob_hash, in blobs)
+            blob_hashes.update(self._pending_completed_blobs)
+            return [b for b in blob_hashes if b in self.verified_blob_hashes]
+
+        d.addCallback(get_verified_blobs)
         return d
 
     @rerun_if_locked
@@ -340,6 +712,386 @@ class DiskBlobManager(BlobManager):
         return d
 
 
+class PackedBlobManager(DiskBlobManager):
+    """This class stores blobs on the hard disk, appended to large segment files
+
+    The segment and offset of every blob is kept in the packed_blobs table of the blob database.
+    Deleting a blob only removes it from the index, the space it took is reclaimed by periodically
+    compacting segments which are mostly made up of deleted blobs.
+
+    Blob files left in blob_dir by a DiskBlobManager are copied into segments in the background,
+    and are served from their files until they have been.
+    """
+    COMPACTION_INTERVAL = 60 * 60
+    # compact segments when at least this fraction of their bytes belongs to deleted blobs
+    COMPACTION_THRESHOLD = 0.5
+    # blob files are copied into segments in a thread, this many at a time
+    MIGRATION_BATCH_SIZE = 10
+
+    def __init__(self, hash_announcer, blob_dir, db_dir, cache_size=None, segment_size=None,
+                 scrub_rate=None, scrub_interval=None):
+        DiskBlobManager.__init__(self, hash_announcer, blob_dir, db_dir, cache_size,
+                                 shard_depth=0, scrub_rate=scrub_rate,
+                                 scrub_interval=scrub_interval)
+        segment_size = (
+            segment_size if segment_size is not None
+            else conf.settings['packed_blob_segment_size'])
+        self.segment_store = BlobSegmentStore(blob_dir, segment_size)
+        self.blob_type = PackedBlob
+        self.blob_creator_type = PackedBlobCreator
+        self._pending_blob_locations = {}  # {blob_hash: (segment, offset, length)}
+        self._next_compaction_call = None
+        self._compacting = False
+        # fires once the batch of blob files being copied into segments has been indexed
+        self._migration_deferred = None
+
+    def setup(self):
+        log.info("Setting up the PackedBlobManager. blob_dir: %s, db_file: %s",
+                 str(self.blob_dir), str(self.db_file))
+        d = threads.deferToThread(self.segment_store.open)
+        d.addCallback(lambda _: self._open_db())
+        d.addCallback(lambda _: self._load_verified_blob_hashes())
+        d.addCallback(lambda _: self._manage())
+        d.addCallback(lambda _: self._migrate_blob_files())
+        d.addCallback(lambda _: self._schedule_compaction())
+        d.addCallback(lambda _: self.scrubber.start())
+        return d
+
+    def stop(self):
+        if self._next_compaction_call is not None and self._next_compaction_call.active():
+            self._next_compaction_call.cancel()
+            self._next_compaction_call = None
+        # the files which are left are found again at the next setup
+        self._migration_queue.clear()
+        if self._migration_deferred is not None:
+            d = self._migration_deferred
+            d.addCallback(lambda _: DiskBlobManager.stop(self))
+        else:
+            d = DiskBlobManager.stop(self)
+
+        def close_segments(result):
+            self.segment_store.close()
+            return result
+
+        d.addCallback(close_segments)
+        return d
+
+    def get_blob_creator(self):
+        return self.blob_creator_type(self, self.segment_store)
+
+    def blob_completed(self, blob, next_announce_time=None):
+        assert blob.location is not None
+        segment, offset = blob.location
+        self._pending_blob_locations[blob.blob_hash] = (segment, offset, blob.length)
+        return DiskBlobManager.blob_completed(self, blob, next_announce_time)
+
+    def compact(self):
+        """Copy the remaining blobs out of segments which are mostly made up of deleted
+        blobs, and remove those segments
+
+        Returns a deferred which fires with the number of segments removed
+        """
+        if self._compacting:
+            return defer.succeed(0)
+        self._compacting = True
+        d = self._compact()
+
+        def set_not_compacting(result):
+            self._compacting = False
+            return result
+
+        d.addBoth(set_not_compacting)
+        return d
+
+    def _make_new_blob(self, blob_hash, length=None):
+        if blob_hash in self._blobs_to_migrate:
+            # not copied into a segment yet, serve it from its file
+            blob = BlobFile(self.blob_dir, blob_hash, length, self._blobs_to_migrate[blob_hash])
+            self.blobs[blob_hash] = blob
+            return defer.succeed(blob)
+
+        def make_blob(location):
+            # another lookup for the same blob may have finished first
+            blob = self.blobs.peek(blob_hash)
+            if blob is None:
+                if location is not None:
+                    segment, offset, length_in_segment = location
+                    blob = self.blob_type(self.segment_store, blob_hash, length_in_segment,
+                                          (segment, offset))
+                else:
+                    blob = self.blob_type(self.segment_store, blob_hash, length)
+            self.blobs[blob_hash] = blob
+            return blob
+
+        d = self._get_blob_location(blob_hash)
+        d.addCallback(make_blob)
+        return d
+
+    def _make_created_blob(self, blob_creator):
+        return self.blob_type(self.segment_store, blob_creator.blob_hash, blob_creator.length,
+                              blob_creator.location)
+
+    def _quarantine_blob_data(self, blob):
+        if isinstance(blob, BlobFile):
+            return DiskBlobManager._quarantine_blob_data(self, blob)
+        # dropping the blob from the index is enough, the corrupt data is removed along with
+        # its segment by a later compaction
+        return defer.succeed(True)
+
+    def _load_verified_blob_hashes(self):
+
+        def set_verified_blob_hashes(rows):
+            blob_hashes = set(blob_hash for blob_hash, in rows)
+            blob_hashes.difference_update(self.blob_hashes_to_delete)
+            self.verified_blob_hashes.update(blob_hashes)
+            log.info("Found %i blobs in %s", len(blob_hashes), self.blob_dir)
+            return threads.deferToThread(self._scan_blob_dir)
+
+        def queue_blob_files(blob_depths):
+            blob_hashes = set(blob_depths)
+            # left over from a migration which was interrupted after the blob was indexed
+            leftovers = [
+                get_blob_file_path(self.blob_dir, blob_hash, blob_depths[blob_hash])
+                for blob_hash in blob_hashes if blob_hash in self.verified_blob_hashes
+            ]
+            blob_hashes.difference_update(self.verified_blob_hashes)
+            blob_hashes.difference_update(self.blob_hashes_to_delete)
+            if blob_hashes:
+                log.info("Found %i blob files in %s to copy into segments",
+                         len(blob_hashes), self.blob_dir)
+            self.verified_blob_hashes.update(blob_hashes)
+            for blob_hash in blob_hashes:
+                self._blobs_to_migrate[blob_hash] = blob_depths[blob_hash]
+                self._migration_queue.append(blob_hash)
+            if leftovers:
+                return threads.deferToThread(self._remove_blob_files, leftovers)
+
+        d = self.db_conn.runQuery("select blob_hash from packed_blobs")
+        d.addCallback(set_verified_blob_hashes)
+        d.addCallback(queue_blob_files)
+        return d
+
+    def _migrate_blob_files(self):
+        """Copy a batch of blob files into segments in a thread, index them, and then remove
+        the files
+
+        Blobs which are being read, written or deleted are put back at the end of the queue.
+        A file is only removed once its location in a segment has been written to the database.
+        """
+        from twisted.internet import reactor
+
+        self._next_migrate_call = None
+        batch = []
+        for _ in range(min(self.MIGRATION_BATCH_SIZE, len(self._migration_queue))):
+            blob_hash = self._migration_queue.popleft()
+            if blob_hash not in self._blobs_to_migrate:
+                continue
+            if blob_hash in self.blob_hashes_to_delete or not self._blob_file_is_idle(blob_hash):
+                self._migration_queue.append(blob_hash)
+                continue
+            batch.append((blob_hash, self._blobs_to_migrate[blob_hash]))
+        if not batch and not self._migration_queue:
+            return
+
+        def schedule_next_batch(result):
+            self._migration_deferred = None
+            if self._migration_queue:
+                self._next_migrate_call = reactor.callLater(self.MIGRATION_INTERVAL,
+                                                            self._migrate_blob_files)
+            else:
+                log.info("Finished copying blob files into segments")
+            return result
+
+        d = threads.deferToThread(self._copy_blob_files_into_segments, batch)
+        d.addCallback(self._index_copied_blob_files)
+        d.addErrback(lambda err: log.warning("Failed to copy blob files into segments: %s",
+                                             err.getErrorMessage()))
+        d.addCallback(schedule_next_batch)
+        self._migration_deferred = d
+
+    def _blob_file_is_idle(self, blob_hash):
+        blob = self.blobs.peek(blob_hash)
+        return blob is None or blob_is_idle(blob)
+
+    def _copy_blob_files_into_segments(self, batch):
+        copied = []
+        for blob_hash, shard_depth in batch:
+            file_path = get_blob_file_path(self.blob_dir, blob_hash, shard_depth)
+            try:
+                with open(file_path, 'rb') as blob_file:
+                    data = blob_file.read()
+            except (IOError, OSError) as err:
+                # most likely deleted since it was found, otherwise it stays a file until the
+                # next setup
+                log.warning("Failed to read blob file %s: %s", file_path, err)
+                copied.append((blob_hash, None, None, None))
+                continue
+            segment, offset = self.segment_store.append(data)
+            copied.append((blob_hash, segment, offset, len(data)))
+        return copied
+
+    def _index_copied_blob_files(self, copied):
+        to_remove = []
+        for blob_hash, segment, offset, length in copied:
+            shard_depth = self._blobs_to_migrate.pop(blob_hash, None)
+            if segment is None or shard_depth is None:
+                continue
+            if (blob_hash not in self.verified_blob_hashes or
+                    blob_hash in self.blob_hashes_to_delete or
+                    not self._blob_file_is_idle(blob_hash)):
+                # leave the file where it is, the copy is reclaimed by compaction
+                if blob_hash in self.verified_blob_hashes:
+                    self._blobs_to_migrate[blob_hash] = shard_depth
+                    self._migration_queue.append(blob_hash)
+                continue
+            self.blobs.pop(blob_hash)
+            self._pending_blob_locations[blob_hash] = (segment, offset, length)
+            to_remove.append(get_blob_file_path(self.blob_dir, blob_hash, shard_depth))
+        if not to_remove:
+            return defer.succeed(True)
+        d = self._queue_db_write()
+        d.addCallback(lambda _: threads.deferToThread(self._remove_blob_files, to_remove))
+        return d
+
+    def _remove_blob_files(self, file_paths):
+        for file_path in file_paths:
+            try:
+                os.remove(file_path)
+            except OSError as err:
+                log.warning("Failed to remove blob file %s: %s", file_path, err)
+
+    def _schedule_compaction(self):
+        from twisted.internet import reactor
+
+        def compact():
+            d = self.compact()
+            d.addErrback(lambda err: log.warning("Failed to compact blob segments: %s",
+                                                 err.getErrorMessage()))
+            d.addCallback(lambda _: self._schedule_compaction())
+
+        self._next_compaction_call = reactor.callLater(self.COMPACTION_INTERVAL, compact)
+
+    @defer.inlineCallbacks
+    def _compact(self):
+        live_bytes = yield self.db_conn.runQuery(
+            "select segment, sum(length) from packed_blobs group by segment")
+        live_bytes = dict(live_bytes)
+        segment_sizes = yield threads.deferToThread(self.segment_store.get_segment_sizes)
+        removed = 0
+        for segment, size in sorted(segment_sizes.iteritems()):
+            dead_bytes = size - live_bytes.get(segment, 0)
+            if not size or float(dead_bytes) / size < self.COMPACTION_THRESHOLD:
+                continue
+            was_removed = yield self._compact_segment(segment)
+            if was_removed:
+                removed += 1
+        defer.returnValue(removed)
+
+    @defer.inlineCallbacks
+    def _compact_segment(self, segment):
+        rows = yield self.db_conn.runQuery(
+            "select blob_hash, offset, length from packed_blobs where segment = ?", (segment,))
+        rows = [r for r in rows if r[0] in self.verified_blob_hashes]
+        moved = yield threads.deferToThread(self._copy_blobs_out_of_segment, segment, rows)
+        yield self._move_blob_locations(segment, moved)
+        for blob_hash, new_segment, new_offset in moved:
+            blob = self.blobs.peek(blob_hash)
+            if blob is not None and blob.location is not None:
+                blob.location = (new_segment, new_offset)
+        pending_segments = set(s for s, _, _ in self._pending_blob_locations.itervalues())
+        if segment in pending_segments:
+            # a blob in this segment was completed while it was being compacted, keep it
+            # around until the next compaction
+            defer.returnValue(False)
+        try:
+            yield threads.deferToThread(self.segment_store.remove_segment, segment)
+        except (IOError, OSError) as err:
+            log.warning("Failed to remove segment %i: %s", segment, err)
+            defer.returnValue(False)
+        log.info("Compacted blob segment %i, moved %i blobs", segment, len(moved))
+        defer.returnValue(True)
+
+    def _copy_blobs_out_of_segment(self, segment, rows):
+        moved = []
+        for blob_hash, offset, length in rows:
+            data = self.segment_store.read(segment, offset, length)
+            new_segment, new_offset = self.segment_store.append(data)
+            moved.append((blob_hash, new_segment, new_offset))
+        return moved
+
+    ######### database calls #########
+
+    def _open_db(self):
+        d = DiskBlobManager._open_db(self)
+
+        def create_tables(transaction):
+            transaction.execute("create table if not exists packed_blobs (" +
+                                "    blob_hash text primary key, " +
+                                "    segment integer, " +
+                                "    offset integer, " +
+                                "    length integer)")
+            transaction.execute("create index if not exists packed_blobs_segment " +
+                                "on packed_blobs (segment)")
+
+        d.addCallback(lambda _: self.db_conn.runInteraction(create_tables))
+        return d
+
+    def _get_blob_file_sizes(self, blob_hashes):
+        # every other stored blob is in the index
+        return DiskBlobManager._get_blob_file_sizes(
+            self, [b for b in blob_hashes if b in self._blobs_to_migrate])
+
+    def _get_blob_location(self, blob_hash):
+        if blob_hash not in self.verified_blob_hashes:
+            return defer.succeed(None)
+        if blob_hash in self._pending_blob_locations:
+            return defer.succeed(self._pending_blob_locations[blob_hash])
+        d = self._get_indexed_blob_location(blob_hash)
+        d.addCallback(lambda rows: rows[0] if rows else None)
+        return d
+
+    @rerun_if_locked
+    def _get_blob_lengths(self):
+        return self.db_conn.runQuery("select blob_hash, length from packed_blobs")
+
+    @rerun_if_locked
+    def _get_indexed_blob_location(self, blob_hash):
+        return self.db_conn.runQuery(
+            "select segment, offset, length from packed_blobs where blob_hash = ?", (blob_hash,))
+
+    @rerun_if_locked
+    def _move_blob_locations(self, old_segment, moved):
+
+        def move_locations(transaction):
+            transaction.executemany(
+                "update packed_blobs set segment = ?, offset = ? " +
+                "where blob_hash = ? and segment = ?",
+                [(s, o, blob_hash, old_segment) for blob_hash, s, o in moved])
+
+        return self.db_conn.runInteraction(move_locations)
+
+    def _delete_blobs_from_db(self, blob_hashes):
+        for blob_hash in blob_hashes:
+            self._pending_blob_locations.pop(blob_hash, None)
+        return DiskBlobManager._delete_blobs_from_db(self, blob_hashes)
+
+    def _take_pending_db_writes(self):
+        changes = DiskBlobManager._take_pending_db_writes(self)
+        changes['indexed'] = [
+            (blob_hash, segment, offset, length)
+            for blob_hash, (segment, offset, length) in self._pending_blob_locations.iteritems()
+        ]
+        self._pending_blob_locations = {}
+        return changes
+
+    def _write_db_changes(self, transaction, changes):
+        DiskBlobManager._write_db_changes(self, transaction, changes)
+        transaction.executemany(
+            "insert or replace into packed_blobs values (?, ?, ?, ?)", changes['indexed'])
+        transaction.executemany(
+            "delete from packed_blobs where blob_hash = ?", changes['deleted'])
+
+
 # TODO: Having different managers for different blobs breaks the
 #       abstraction of a HashBlob. Why should the management of blobs
 #       care what kind of Blob it has?
@@ -0,0 +1,198 @@
+import logging
+
+from twisted.internet import defer
+from twisted.internet.task import LoopingCall
+from lbrynet import conf
+from lbrynet.core.BlobCache import blob_is_idle
+
+
+log = logging.getLogger(__name__)
+
+
+class EvictionPolicy(object):
+    """Decides which stored blobs are evicted first when the blob store is over its quota"""
+    name = None
+
+    def order_for_eviction(self, blob_hashes, blob_lengths):
+        """Return a deferred which fires with blob_hashes sorted so that the blobs to evict
+        first come first
+        """
+        pass
+
+
+class LRUUploadEvictionPolicy(EvictionPolicy):
+    """Evict the blobs which were least recently uploaded to a peer, those never uploaded
+    first"""
+    name = 'lru_upload'
+
+    def __init__(self, blob_manager):
+        self.blob_manager = blob_manager
+
+    def order_for_eviction(self, blob_hashes, blob_lengths):
+
+        def order(upload_stats):
+            return sorted(blob_hashes, key=lambda h: upload_stats.get(h, (0, 0))[0])
+
+        d = self.blob_manager.get_blob_upload_stats()
+        d.addCallback(order)
+        return d
+
+
+class LeastAvailableEvictionPolicy(EvictionPolicy):
+    """Evict the blobs which the availability tracker has seen the fewest peers for first"""
+    name = 'least_available'
+
+    def __init__(self, blob_tracker):
+        self.blob_tracker = blob_tracker
+
+    def order_for_eviction(self, blob_hashes, blob_lengths):
+        availability = self.blob_tracker.availability
+        return defer.succeed(
+            sorted(blob_hashes, key=lambda h: len(availability.get(h, []))))
+
+
+class LowestEarningEvictionPolicy(EvictionPolicy):
+    """Evict the blobs which have earned the least from uploads first"""
+    name = 'lowest_earning'
+
+    def __init__(self, blob_manager):
+        self.blob_manager = blob_manager
+
+    def order_for_eviction(self, blob_hashes, blob_lengths):
+
+        def order(upload_stats):
+            def earned(blob_hash):
+                # upload rates are in points/megabyte
+                total_rate = upload_stats.get(blob_hash, (0, 0))[1]
+                return total_rate * blob_lengths.get(blob_hash, 0) / 2 ** 20
+
+            return sorted(blob_hashes, key=earned)
+
+        d = self.blob_manager.get_blob_upload_stats()
+        d.addCallback(order)
+        return d
+
+
+EVICTION_POLICIES = [
+    LRUUploadEvictionPolicy,
+    LeastAvailableEvictionPolicy,
+    LowestEarningEvictionPolicy,
+]
+
+
+def get_eviction_policy(name, blob_manager, blob_tracker):
+    if name == LRUUploadEvictionPolicy.name:
+        return LRUUploadEvictionPolicy(blob_manager)
+    if name == LeastAvailableEvictionPolicy.name:
+        return LeastAvailableEvictionPolicy(blob_tracker)
+    if name == LowestEarningEvictionPolicy.name:
+        return LowestEarningEvictionPolicy(blob_manager)
+    raise ValueError("Unknown blob eviction policy: %s (expected one of %s)" %
+                     (name, ", ".join(p.name for p in EVICTION_POLICIES)))
+
+
+class BlobQuota(object):
+    """Keeps the blob store within a size and blob count limit by evicting blobs
+
+    Blobs returned by any of the protected blob sources (the blobs of the streams being managed
+    by the file manager, for instance) and blobs which are being read or written are never
+    evicted. A limit of 0 means no limit.
+    """
+    CHECK_INTERVAL = 60
+
+    def __init__(self, blob_manager, eviction_policy, max_bytes=None, max_blobs=None):
+        self.blob_manager = blob_manager
+        self.eviction_policy = eviction_policy
+        self.max_bytes = max_bytes if max_bytes is not None else conf.settings['blob_quota_bytes']
+        self.max_blobs = max_blobs if max_blobs is not None else conf.settings['blob_quota_count']
+        self.blobs_evicted = 0
+        self.bytes_evicted = 0
+        self._protected_blob_sources = []
+        self._usage = (0, 0)
+        self._check = LoopingCall(self._enforce)
+
+    def start(self):
+        log.info("Starting %s", self)
+        self._check.start(self.CHECK_INTERVAL, now=False)
+
+    def stop(self):
+        log.info("Stopping %s", self)
+        if self._check.running:
+            self._check.stop()
+
+    def add_protected_blobs_source(self, get_blob_hashes):
+        """Never evict the blobs returned by get_blob_hashes
+
+        get_blob_hashes is called before every eviction and returns a deferred which fires with
+        an iterable of blob hashes
+        """
+        self._protected_blob_sources.append(get_blob_hashes)
+
+    def get_status(self):
+        stored_bytes, stored_blobs = self._usage
+        return {
+            'policy': self.eviction_policy.name,
+            'max_bytes': self.max_bytes,
+            'max_blobs': self.max_blobs,
+            'stored_bytes': stored_bytes,
+            'stored_blobs': stored_blobs,
+            'blobs_evicted': self.blobs_evicted,
+            'bytes_evicted': self.bytes_evicted,
+        }
+
+    def is_over_quota(self, stored_bytes, stored_blobs):
+        return (
+            (self.max_bytes > 0 and stored_bytes > self.max_bytes) or
+            (self.max_blobs > 0 and stored_blobs > self.max_blobs)
+        )
+
+    @defer.inlineCallbacks
+    def enforce(self):
+        """Evict blobs until the blob store is within its quota
+
+        Returns a deferred which fires with the hashes of the evicted blobs
+        """
+        blob_lengths = yield self.blob_manager.get_stored_blob_lengths()
+        stored_bytes, stored_blobs = sum(blob_lengths.itervalues()), len(blob_lengths)
+        self._usage = (stored_bytes, stored_blobs)
+        if not self.is_over_quota(stored_bytes, stored_blobs):
+            defer.returnValue([])
+        protected = yield self._get_protected_blob_hashes()
+        candidates = []
+        for blob_hash in blob_lengths:
+            blob = self.blob_manager.blobs.peek(blob_hash)
+            if blob_hash not in protected and (blob is None or blob_is_idle(blob)):
+                candidates.append(blob_hash)
+        ordered = yield self.eviction_policy.order_for_eviction(candidates, blob_lengths)
+        to_evict = []
+        for blob_hash in ordered:
+            if not self.is_over_quota(stored_bytes, stored_blobs):
+                break
+            to_evict.append(blob_hash)
+            stored_bytes -= blob_lengths[blob_hash]
+            stored_blobs -= 1
+        if self.is_over_quota(stored_bytes, stored_blobs):
+            log.warning("The blob store can't be brought within its quota, the remaining %i "
+                        "blobs (%i bytes) are in use or protected", stored_blobs, stored_bytes)
+        if to_evict:
+            log.info("Evicting %i blobs to stay within the blob store quota", len(to_evict))
+            self.blobs_evicted += len(to_evict)
+            self.bytes_evicted += sum(blob_lengths[blob_hash] for blob_hash in to_evict)
+            self._usage = (stored_bytes, stored_blobs)
+            self.blob_manager.delete_blobs(to_evict)
+        defer.returnValue(to_evict)
+
+    @defer.inlineCallbacks
+    def _get_protected_blob_hashes(self):
+        protected = set()
+        for get_blob_hashes in self._protected_blob_sources:
+            blob_hashes = yield get_blob_hashes()
+            protected.update(blob_hashes)
+        defer.returnValue(protected)
+
+    def _enforce(self):
+        d = self.enforce()
+        # keep checking even if this check failed
+        d.addErrback(lambda err: log.warning("Failed to enforce the blob store quota: %s",
+                                             err.getErrorMessage()))
+        return d
@@ -0,0 +1,140 @@
+import collections
+import logging
+import time
+
+from lbrynet.core.cryptoutils import get_lbry_hash_obj
+
+
+log = logging.getLogger(__name__)
+
+
+def hash_blob_data(read_handle, read_size=2 ** 16):
+    """Hash everything readable from read_handle, returns (blob hash, length)
+
+    This blocks, run it in a thread
+    """
+    hashsum = get_lbry_hash_obj()
+    length = 0
+    data = read_handle.read(read_size)
+    while data:
+        hashsum.update(data)
+        length += len(data)
+        data = read_handle.read(read_size)
+    return hashsum.hexdigest(), length
+
+
+class BlobScrubber(object):
+    """Periodically re-hashes stored blobs to find those whose data has been corrupted
+
+    Blobs which haven't been verified for longer than interval seconds are checked one at a time,
+    least recently verified first, reading at most rate bytes per second on average. The hashing
+    itself is done by the blob manager in the reactor's thread pool. A rate of 0 pauses the
+    scrubber.
+    """
+    # seconds to wait after starting up before the first check, and between looking for
+    # blobs which are due to be checked
+    STARTUP_DELAY = 60
+    IDLE_DELAY = 10 * 60
+    # number of the most recently found corrupt blobs whose hashes are kept for get_status
+    MAX_CORRUPT_BLOB_HASHES = 100
+
+    def __init__(self, blob_manager, rate, interval):
+        self.blob_manager = blob_manager
+        self.rate = rate
+        self.interval = interval
+        self.blobs_checked = 0
+        self.bytes_checked = 0
+        self.corrupt_blobs_found = 0
+        self.corrupt_blob_hashes = collections.deque(maxlen=self.MAX_CORRUPT_BLOB_HASHES)
+        self._blobs_to_check = collections.deque()
+        self._checking = False
+        self._stopped = True
+        self._next_call = None
+
+    def start(self):
+        self._stopped = False
+        self._schedule(self.STARTUP_DELAY)
+
+    def stop(self):
+        self._stopped = True
+        self._blobs_to_check = collections.deque()
+        self._cancel_next_call()
+
+    def set_rate(self, rate):
+        assert rate >= 0
+        was_paused = not self.rate
+        self.rate = rate
+        if was_paused and self.rate and not self._stopped and not self._checking:
+            self._schedule(0)
+
+    def set_interval(self, interval):
+        assert interval > 0
+        self.interval = interval
+
+    def get_status(self):
+        return {
+            'rate': self.rate,
+            'interval': self.interval,
+            'checking': self._checking,
+            'blobs_checked': self.blobs_checked,
+            'bytes_checked': self.bytes_checked,
+            'blobs_remaining': len(self._blobs_to_check),
+            'corrupt_blobs_found': self.corrupt_blobs_found,
+            'corrupt_blobs': list(self.corrupt_blob_hashes),
+        }
+
+    def _schedule(self, delay):
+        from twisted.internet import reactor
+
+        self._cancel_next_call()
+        self._next_call = reactor.callLater(delay, self._check_next_blob)
+
+    def _cancel_next_call(self):
+        if self._next_call is not None and self._next_call.active():
+            self._next_call.cancel()
+        self._next_call = None
+
+    def _check_next_blob(self):
+        self._next_call = None
+        if self._stopped or not self.rate:
+            return
+        if not self._blobs_to_check:
+            d = self.blob_manager.get_blob_hashes_to_scrub(time.time() - self.interval)
+            d.addCallback(self._set_blobs_to_check)
+            d.addErrback(self._log_error)
+            return
+        blob_hash = self._blobs_to_check.popleft()
+        self._checking = True
+        started = time.time()
+
+        def check_finished(result):
+            self._checking = False
+            bytes_read, is_corrupt = result
+            self.blobs_checked += 1
+            self.bytes_checked += bytes_read
+            if is_corrupt:
+                self.corrupt_blobs_found += 1
+                self.corrupt_blob_hashes.append(blob_hash)
+            if not self._stopped and self.rate:
+                # sleep off the time it should have taken to read the blob at the rate limit
+                self._schedule(max(0, float(bytes_read) / self.rate - (time.time() - started)))
+
+        d = self.blob_manager.scrub_blob(blob_hash)
+        d.addCallback(check_finished)
+        d.addErrback(self._log_error)
+
+    def _set_blobs_to_check(self, blob_hashes):
+        if self._stopped:
+            return
+        self._blobs_to_check = collections.deque(blob_hashes)
+        if blob_hashes:
+            log.info("Checking the integrity of %i blobs", len(blob_hashes))
+            self._schedule(0)
+        else:
+            self._schedule(self.IDLE_DELAY)
+
+    def _log_error(self, err):
+        self._checking = False
+        log.warning("Blob integrity check failed: %s", err.getErrorMessage())
+        if not self._stopped:
+            self._schedule(self.IDLE_DELAY)
@@ -0,0 +1,126 @@
+import logging
+import mmap
+import os
+import threading
+
+
+log = logging.getLogger(__name__)
+
+
+class SegmentReadHandle(object):
+    """A read only, file like view of one blob inside a memory mapped segment file"""
+
+    def __init__(self, segment_map, offset, length):
+        self._map = segment_map
+        self._position = offset
+        self._end = offset + length
+
+    def read(self, size=-1):
+        if self._map is None:
+            raise ValueError("I/O operation on closed file")
+        if size < 0 or self._position + size > self._end:
+            size = self._end - self._position
+        data = self._map[self._position:self._position + size]
+        self._position += size
+        return data
+
+    def close(self):
+        # the map itself is shared with other readers, it is released once none reference it
+        self._map = None
+
+
+class BlobSegmentStore(object):
+    """Stores blobs by appending them to large segment files
+
+    Blobs are appended to the active segment until it would grow past segment_size, after which
+    a new segment is started. Segments are never modified in place; space taken by deleted blobs
+    is reclaimed by copying the remaining blobs into the active segment and removing the old one.
+    Blobs are read through a memory map of their segment, so serving one needs no open/close.
+
+    Appends and reads block and are meant to be run in a thread.
+    """
+    SEGMENT_FILE_EXTENSION = '.blobs'
+
+    def __init__(self, segment_dir, segment_size):
+        self.segment_dir = segment_dir
+        self.segment_size = segment_size
+        self.active_segment = None
+        self._active_handle = None
+        self._active_size = 0
+        self._append_lock = threading.Lock()
+        self._maps = {}  # {segment: mmap}
+        self._map_lock = threading.Lock()
+
+    def segment_path(self, segment):
+        return os.path.join(self.segment_dir, "%08i%s" % (segment, self.SEGMENT_FILE_EXTENSION))
+
+    def get_segments(self):
+        segments = []
+        for file_name in os.listdir(self.segment_dir):
+            name, ext = os.path.splitext(file_name)
+            if ext == self.SEGMENT_FILE_EXTENSION and name.isdigit():
+                segments.append(int(name))
+        return sorted(segments)
+
+    def get_segment_sizes(self):
+        """Return {segment: size in bytes} of the segments which are no longer appended to"""
+        return {
+            segment: os.path.getsize(self.segment_path(segment))
+            for segment in self.get_segments() if segment != self.active_segment
+        }
+
+    def open(self):
+        segments = self.get_segments()
+        self._open_segment(segments[-1] if segments else 0)
+
+    def close(self):
+        with self._append_lock:
+            if self._active_handle is not None:
+                self._active_handle.close()
+                self._active_handle = None
+        with self._map_lock:
+            self._maps = {}
+
+    def append(self, data):
+        """Append a blob to the active segment, returns (segment, offset)"""
+        with self._append_lock:
+            if self._active_size and self._active_size + len(data) > self.segment_size:
+                self._active_handle.close()
+                self._open_segment(self.active_segment + 1)
+            offset = self._active_size
+            self._active_handle.write(data)
+            self._active_handle.flush()
+            self._active_size += len(data)
+            return self.active_segment, offset
+
+    def read(self, segment, offset, length):
+        return self._get_map(segment, offset + length)[offset:offset + length]
+
+    def open_for_reading(self, segment, offset, length):
+        return SegmentReadHandle(self._get_map(segment, offset + length), offset, length)
+
+    def remove_segment(self, segment):
+        assert segment != self.active_segment, "Can't remove the segment being appended to"
+        with self._map_lock:
+            # readers still holding the old map keep working until they are closed
+            self._maps.pop(segment, None)
+        os.remove(self.segment_path(segment))
+
+    def _open_segment(self, segment):
+        self.active_segment = segment
+        self._active_handle = open(self.segment_path(segment), 'ab')
+        self._active_handle.seek(0, os.SEEK_END)
+        self._active_size = self._active_handle.tell()
+        log.debug("Appending blobs to segment %i at offset %i", segment, self._active_size)
+
+    def _get_map(self, segment, end):
+        with self._map_lock:
+            segment_map = self._maps.get(segment)
+            if segment_map is None or len(segment_map) < end:
+                # the active segment has grown since it was mapped
+                with open(self.segment_path(segment), 'rb') as segment_file:
+                    segment_map = mmap.mmap(segment_file.fileno(), 0, access=mmap.ACCESS_READ)
+                self._maps[segment] = segment_map
+            if len(segment_map) < end:
+                raise IOError("Segment %i is shorter than expected" % segment)
+            return segment_map
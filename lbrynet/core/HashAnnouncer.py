@@ -14,5 +14,11 @@ class DummyHashAnnouncer(object):
     def hash_queue_size(self):
         return 0
 
+    def get_hash_announce_duration(self):
+        return None
+
+    def add_priority_hashes_source(self, *args):
+        pass
+
     def immediate_announce(self, *args):
         pass
@@ -17,6 +17,27 @@ from lbrynet.core.utils import is_valid_blobhash
 log = logging.getLogger(__name__)
 
 
+def get_blob_file_path(blob_dir, blob_hash, shard_depth=0):
+    """Return the path of a blob file in blob_dir
+
+    With a shard_depth greater than 0 the file is nested in shard_depth directories, each
+    named after the next two characters of the blob hash (ab/cd/abcd... for a depth of 2)
+    """
+    shards = [blob_hash[i:i + 2] for i in range(0, 2 * shard_depth, 2)]
+    return os.path.join(blob_dir, *(shards + [blob_hash]))
+
+
+def make_blob_file_dir(file_path):
+    dir_name = os.path.dirname(file_path)
+    if not os.path.isdir(dir_name):
+        try:
+            os.makedirs(dir_name)
+        except OSError:
+            # another writer may have created it first
+            if not os.path.isdir(dir_name):
+                raise
+
+
 class HashBlobReader(object):
     implements(interfaces.IConsumer)
 
@@ -117,6 +138,10 @@ class HashBlob(object):
             return True
         return False
 
+    def invalidate(self):
+        """Mark the blob as unverified after its stored data was found to be corrupt"""
+        self._verified = False
+
     def read(self, write_func):
 
         def close_self(*args):
@@ -207,10 +232,10 @@ class HashBlob(object):
 class BlobFile(HashBlob):
     """A HashBlob which will be saved to the hard disk of the downloader"""
 
-    def __init__(self, blob_dir, *args):
-        HashBlob.__init__(self, *args)
+    def __init__(self, blob_dir, blob_hash, length=None, shard_depth=0):
+        HashBlob.__init__(self, blob_hash, length)
         self.blob_dir = blob_dir
-        self.file_path = os.path.join(blob_dir, self.blob_hash)
+        self.file_path = get_blob_file_path(blob_dir, self.blob_hash, shard_depth)
         self.setting_verified_blob_lock = threading.Lock()
         self.moved_verified_blob = False
         if os.path.isfile(self.file_path):
@@ -222,10 +247,17 @@ class BlobFile(HashBlob):
             # this call.
             self._verified = True
 
+    def invalidate(self):
+        HashBlob.invalidate(self)
+        self.moved_verified_blob = False
+
     def open_for_writing(self, peer):
         if not peer in self.writers:
             log.debug("Opening %s to be written by %s", str(self), str(peer))
-            write_file = tempfile.NamedTemporaryFile(delete=False, dir=self.blob_dir)
+            # keep the temporary file next to the final one so moving it into place is a rename
+            make_blob_file_dir(self.file_path)
+            write_file = tempfile.NamedTemporaryFile(delete=False,
+                                                     dir=os.path.dirname(self.file_path))
             finished_deferred = defer.Deferred()
             writer = HashBlobWriter(write_file, self.get_length, self.writer_finished)
 
@@ -346,6 +378,85 @@ class TempBlob(HashBlob):
             return defer.fail(Failure(DownloadCanceledError()))
 
 
+class PackedBlob(HashBlob):
+    """A HashBlob which is stored in a segment file along with many other blobs"""
+    def __init__(self, segment_store, blob_hash, length=None, location=None):
+        HashBlob.__init__(self, blob_hash, length)
+        self.segment_store = segment_store
+        self.location = location  # (segment, offset)
+        self.saving_verified_blob = False
+        if self.location is not None:
+            self._verified = True
+
+    def invalidate(self):
+        HashBlob.invalidate(self)
+        self.location = None
+        self.saving_verified_blob = False
+
+    def open_for_writing(self, peer):
+        if not peer in self.writers:
+            log.debug("Opening %s to be written by %s", str(self), str(peer))
+            finished_deferred = defer.Deferred()
+            writer = HashBlobWriter(StringIO(), self.get_length, self.writer_finished)
+
+            self.writers[peer] = (writer, finished_deferred)
+            return finished_deferred, writer.write, writer.cancel
+        log.warning("Tried to download the same file twice simultaneously from the same peer")
+        return None, None, None
+
+    def open_for_reading(self):
+        if self._verified is True and self.location is not None:
+            segment, offset = self.location
+            try:
+                read_handle = self.segment_store.open_for_reading(segment, offset, self.length)
+                self.readers += 1
+                return read_handle
+            except (EnvironmentError, ValueError):
+                log.exception('Failed to read %s from segment %i', str(self), segment)
+        return None
+
+    def delete(self):
+        if not self.writers and not self.readers:
+            # the space is reclaimed when the segment is compacted
+            self._verified = False
+            self.location = None
+            self.saving_verified_blob = False
+            return defer.succeed(True)
+        else:
+            return defer.fail(Failure(
+                ValueError("Blob is currently being read or written and cannot be deleted")))
+
+    def close_read_handle(self, file_handle):
+        if file_handle is not None:
+            file_handle.close()
+            self.readers -= 1
+
+    def _close_writer(self, writer):
+        if writer.write_handle is not None:
+            writer.write_handle.close()
+            writer.write_handle = None
+
+    def _save_verified_blob(self, writer):
+        if self.saving_verified_blob:
+            return defer.fail(Failure(DownloadCanceledError()))
+        self.saving_verified_blob = True
+        data = writer.write_handle.getvalue()
+        writer.write_handle.close()
+        writer.write_handle = None
+
+        def set_location(location):
+            self.location = location
+            return True
+
+        def set_not_saving(err):
+            self.saving_verified_blob = False
+            return err
+
+        d = threads.deferToThread(self.segment_store.append, data)
+        d.addCallbacks(set_location, set_not_saving)
+        return d
+
+
 class HashBlobCreator(object):
     def __init__(self, blob_manager):
         self.blob_manager = blob_manager
@@ -384,16 +495,19 @@ class HashBlobCreator(object):
 
 
 class BlobFileCreator(HashBlobCreator):
-    def __init__(self, blob_manager, blob_dir):
+    def __init__(self, blob_manager, blob_dir, shard_depth=0):
         HashBlobCreator.__init__(self, blob_manager)
         self.blob_dir = blob_dir
+        self.shard_depth = shard_depth
         self.out_file = tempfile.NamedTemporaryFile(delete=False, dir=self.blob_dir)
 
     def _close(self):
         temp_file_name = self.out_file.name
         self.out_file.close()
         if self.blob_hash is not None:
-            shutil.move(temp_file_name, os.path.join(self.blob_dir, self.blob_hash))
+            file_path = get_blob_file_path(self.blob_dir, self.blob_hash, self.shard_depth)
+            make_blob_file_dir(file_path)
+            shutil.move(temp_file_name, file_path)
         else:
             os.remove(temp_file_name)
         return defer.succeed(True)
@@ -402,6 +516,30 @@ class BlobFileCreator(HashBlobCreator):
         self.out_file.write(data)
 
 
+class PackedBlobCreator(HashBlobCreator):
+    def __init__(self, blob_manager, segment_store):
+        HashBlobCreator.__init__(self, blob_manager)
+        self.segment_store = segment_store
+        self.location = None
+        self.data_buffer = StringIO()
+
+    def _close(self):
+        if self.blob_hash is None:
+            return defer.succeed(True)
+
+        def set_location(location):
+            self.location = location
+            self.data_buffer.close()
+            return True
+
+        d = threads.deferToThread(self.segment_store.append, self.data_buffer.getvalue())
+        d.addCallback(set_location)
+        return d
+
+    def _write(self, data):
+        self.data_buffer.write(data)
+
+
 class TempBlobCreator(HashBlobCreator):
     def __init__(self, blob_manager):
         HashBlobCreator.__init__(self, blob_manager)
@@ -0,0 +1,135 @@
+"""Reading and writing the JSON messages peers exchange before blob data
+
+Originally a message is a bare JSON object, and the receiver finds its end by
+decoding it. Peers which both support it switch to framed messages, which are
+a four byte big-endian length followed by that many bytes of JSON, so the end
+of a message is known before any of it is decoded. A client asks for framing
+by adding FRAMING_QUERY to its first request, and a server which supports it
+answers with FRAMING_QUERY in its response; every message after those two is
+framed. Peers which don't know about framing ignore the unknown key.
+"""
+
+import json
+import re
+import struct
+
+FRAMING_QUERY = 'message_framing'
+FRAMING_VERSION = 1
+
+_HEADER = struct.Struct('>I')
+_decoder = json.JSONDecoder()
+# the characters which matter for finding the end of an unframed message
+_UNFRAMED_TOKENS = re.compile(r'[{}"\\]')
+
+
+def frame_message(message):
+    """Prefix an encoded message with its length"""
+    return _HEADER.pack(len(message)) + message
+
+
+def decode_unframed(data):
+    """Decode the JSON object at the start of data
+
+    Returns the object and the data after it, or (None, None) if data doesn't
+    start with a whole JSON object yet
+    """
+    start = len(data) - len(data.lstrip())
+    try:
+        message, end = _decoder.raw_decode(data, start)
+    except ValueError:
+        return None, None
+    return message, data[end:]
+
+
+class MessageBuffer(object):
+    """Collects received data until it holds a whole message
+
+    The received chunks are only joined once, when they make up a whole
+    message. The end of a framed message is known from its header. The end of an
+    unframed message is found by following the depth of the braces outside of
+    strings in each chunk as it arrives, so the message is only decoded once
+    its outermost brace has been closed.
+    """
+
+    def __init__(self):
+        self.framed = False
+        self._chunks = []
+        self._size = 0
+        self._message_size = None
+        self._reset_scan()
+
+    def __len__(self):
+        return self._size
+
+    def write(self, data):
+        if not self.framed and self._message_end is None:
+            self._scan(data, self._size)
+        self._chunks.append(data)
+        self._size += len(data)
+
+    def clear(self):
+        self._chunks = []
+        self._size = 0
+        self._message_size = None
+        self._reset_scan()
+
+    def get_message(self):
+        """Take the first whole message out of the buffer
+
+        Returns the decoded message and the data received after it, or
+        (None, None) if there isn't a whole message yet. Raises ValueError if a
+        whole message isn't valid JSON.
+        """
+        if self.framed:
+            return self._get_framed_message()
+        if self._message_end is None:
+            return None, None
+        data = ''.join(self._chunks)
+        end = self._message_end
+        self.clear()
+        return json.loads(data[:end]), data[end:]
+
+    def _reset_scan(self):
+        self._depth = 0
+        self._in_string = False
+        # the offset of the character escaped by a backslash in a string
+        self._escaped_offset = None
+        # the offset just past the closing brace of the first unframed message
+        self._message_end = None
+
+    def _scan(self, data, offset):
+        for match in _UNFRAMED_TOKENS.finditer(data):
+            position = offset + match.start()
+            if self._escaped_offset is not None:
+                escaped = position == self._escaped_offset
+                self._escaped_offset = None
+                if escaped:
+                    continue
+            token = match.group()
+            if self._in_string:
+                if token == '\\':
+                    self._escaped_offset = position + 1
+                elif token == '"':
+                    self._in_string = False
+            elif token == '"':
+                self._in_string = True
+            elif token == '{':
+                self._depth += 1
+            elif token == '}' and self._depth > 0:
+                self._depth -= 1
+                if self._depth == 0:
+                    self._message_end = position + 1
+                    return
+
+    def _get_framed_message(self):
+        if self._message_size is None:
+            if self._size < _HEADER.size:
+                return None, None
+            self._chunks = [''.join(self._chunks)]
+            self._message_size, = _HEADER.unpack_from(self._chunks[0])
+        end = _HEADER.size + self._message_size
+        if self._size < end:
+            return None, None
+        data = ''.join(self._chunks)
+        self.clear()
+        return json.loads(data[_HEADER.size:end]), data[end:]
@@ -1,9 +1,13 @@
 import datetime
+import time
 from collections import defaultdict
 from lbrynet.core import utils
 
 # Do not create this object except through PeerManager
 class Peer(object):
+    # weight of the newest measurement in the moving averages of the peer's performance
+    SMOOTHING = 0.3
+
     def __init__(self, host, port):
         self.host = host
         self.port = port
@@ -15,6 +19,21 @@ class Peer(object):
         self.success_count = 0
         self.score = 0
         self.stats = defaultdict(float)  # {string stat_type, float count}
+        # when this peer was last looked up or reported on
+        self.last_active = time.time()
+        # moving averages of the rate blobs are downloaded from this peer at (bytes/second) and of
+        # the time it takes to respond to a request (seconds), None until they're measured
+        self.download_rate = None
+        self.response_time = None
+        # number of blobs downloaded from this peer, and of requests and connections to it
+        # which failed
+        self.downloads = 0
+        self.failures = 0
+        # the last data payment rate this peer accepted (points/megabyte)
+        self.payment_rate = None
+
+    def _mark_active(self):
+        self.last_active = time.time()
 
     def is_available(self):
         if self.attempt_connection_at is None or utils.today() > self.attempt_connection_at:
@@ -22,21 +41,55 @@ class Peer(object):
         return False
 
     def report_up(self):
+        self._mark_active()
         self.down_count = 0
         self.attempt_connection_at = None
 
     def report_success(self):
+        self._mark_active()
         self.success_count += 1
 
     def report_down(self):
+        self._mark_active()
         self.down_count += 1
+        self.failures += 1
         timeout_time = datetime.timedelta(seconds=60 * self.down_count)
         self.attempt_connection_at = utils.today() + timeout_time
 
+    def report_failure(self):
+        self._mark_active()
+        self.failures += 1
+
+    def report_download(self, num_bytes, seconds):
+        self._mark_active()
+        self.downloads += 1
+        self.download_rate = self._smooth(self.download_rate, num_bytes / max(seconds, 0.001))
+
+    def report_response_time(self, seconds):
+        self._mark_active()
+        self.response_time = self._smooth(self.response_time, seconds)
+
+    def report_payment_rate(self, rate):
+        self._mark_active()
+        self.payment_rate = rate
+
+    def get_failure_rate(self):
+        attempts = self.downloads + self.failures
+        if not attempts:
+            return 0.0
+        return 1.0 * self.failures / attempts
+
+    def _smooth(self, average, measurement):
+        if average is None:
+            return float(measurement)
+        return average + self.SMOOTHING * (measurement - average)
+
     def update_score(self, score_change):
+        self._mark_active()
         self.score += score_change
 
     def update_stats(self, stat_type, count):
+        self._mark_active()
         self.stats[stat_type] += count
 
     def __str__(self):
@@ -15,5 +15,8 @@ class DummyPeerFinder(object):
     def find_peers_for_blob(self, blob_hash):
         return defer.succeed([])
 
+    def find_peers_for_blobs(self, blob_hashes, timeout=None):
+        return defer.succeed({blob_hash: [] for blob_hash in blob_hashes})
+
     def get_most_popular_hashes(self, num_to_return):
         return []
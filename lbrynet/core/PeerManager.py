@@ -1,14 +1,65 @@
+import time
+
 from lbrynet.core.Peer import Peer
 
 
 class PeerManager(object):
-    def __init__(self):
-        self.peers = []
+    # peers which haven't been looked up or reported on for this many seconds are forgotten
+    PEER_TTL = 60 * 60
+    # seconds between checks for peers to forget
+    EXPIRE_INTERVAL = 60
+
+    def __init__(self, peer_ttl=None):
+        self.peer_ttl = peer_ttl if peer_ttl is not None else self.PEER_TTL
+        self.peers = {}  # {(host, port): Peer}
+        self.peers_expired = 0
+        self._last_expire = time.time()
 
     def get_peer(self, host, port):
-        for peer in self.peers:
-            if peer.host == host and peer.port == port:
-                return peer
-        peer = Peer(host, port)
-        self.peers.append(peer)
+        now = time.time()
+        if now - self._last_expire >= self.EXPIRE_INTERVAL:
+            self._expire_peers(now)
+        peer = self.peers.get((host, port))
+        if peer is None:
+            peer = Peer(host, port)
+            self.peers[(host, port)] = peer
+        peer.last_active = now
         return peer
+
+    def get_status(self):
+        return {
+            'known_peers': len(self.peers),
+            'peers_expired': self.peers_expired,
+        }
+
+    def get_peer_stats(self):
+        """Get a snapshot of the state of every known peer, best scoring first"""
+        stats = []
+        for peer in self.peers.itervalues():
+            stats.append({
+                'host': peer.host,
+                'port': peer.port,
+                'score': peer.score,
+                'success_count': peer.success_count,
+                'down_count': peer.down_count,
+                'is_available': peer.is_available(),
+                'last_active': peer.last_active,
+                'stats': dict(peer.stats),
+                'download_rate': peer.download_rate,
+                'response_time': peer.response_time,
+                'failure_rate': peer.get_failure_rate(),
+                'payment_rate': peer.payment_rate,
+            })
+        stats.sort(key=lambda s: s['score'], reverse=True)
+        return stats
+
+    def _expire_peers(self, now):
+        # this goes over every peer, but only once per EXPIRE_INTERVAL no matter how many
+        # peers are looked up in between. Peers still being backed off from are kept so that
+        # they aren't retried early.
+        self._last_expire = now
+        expired = [address for address, peer in self.peers.iteritems()
+                   if now - peer.last_active >= self.peer_ttl and peer.is_available()]
+        for address in expired:
+            del self.peers[address]
+        self.peers_expired += len(expired)
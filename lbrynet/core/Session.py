@@ -1,7 +1,10 @@
 import logging
 import miniupnpc
-from lbrynet.core.BlobManager import DiskBlobManager, TempBlobManager
+import os
+from lbrynet import conf
+from lbrynet.core.BlobManager import DiskBlobManager, PackedBlobManager, TempBlobManager
 from lbrynet.dht import node
+from lbrynet.dht.datastore import SQLiteDataStore
 from lbrynet.core.PeerManager import PeerManager
 from lbrynet.core.RateLimiter import RateLimiter
 from lbrynet.core.client.DHTPeerFinder import DHTPeerFinder
@@ -10,6 +13,7 @@ from lbrynet.core.server.DHTHashAnnouncer import DHTHashAnnouncer
 from lbrynet.core.utils import generate_id
 from lbrynet.core.PaymentRateManager import BasePaymentRateManager, NegotiatedPaymentRateManager
 from lbrynet.core.BlobAvailability import BlobAvailabilityTracker
+from lbrynet.core.BlobQuota import BlobQuota, get_eviction_policy
 from twisted.internet import threads, defer
 
 log = logging.getLogger(__name__)
@@ -118,6 +122,8 @@ class Session(object):
         self.blob_tracker = None
         self.blob_tracker_class = blob_tracker_class or BlobAvailabilityTracker
 
+        self.blob_quota = None
+
         self.peer_port = peer_port
 
         self.use_upnp = use_upnp
@@ -173,6 +179,8 @@ class Session(object):
         ds = []
         if self.blob_manager is not None:
             ds.append(defer.maybeDeferred(self.blob_tracker.stop))
+        if self.blob_quota is not None:
+            ds.append(defer.maybeDeferred(self.blob_quota.stop))
         if self.dht_node is not None:
             ds.append(defer.maybeDeferred(self.dht_node.stop))
         if self.rate_limiter is not None:
@@ -272,10 +280,14 @@ class Session(object):
             d.addCallback(lambda h: (h, port))  # match host to port
             ds.append(d)
 
+        dht_node_kwargs = {}
+        if conf.settings['dht_persist_state'] and self.db_dir is not None:
+            dht_node_kwargs['dataStore'] = SQLiteDataStore(os.path.join(self.db_dir, "dht.sqlite"))
         self.dht_node = self.dht_node_class(
             udpPort=self.dht_node_port,
             lbryid=self.lbryid,
-            externalIP=self.external_ip
+            externalIP=self.external_ip,
+            **dht_node_kwargs
         )
         self.peer_finder = DHTPeerFinder(self.dht_node, self.peer_manager)
         if self.hash_announcer is None:
@@ -295,6 +307,10 @@ class Session(object):
         if self.blob_manager is None:
             if self.blob_dir is None:
                 self.blob_manager = TempBlobManager(self.hash_announcer)
+            elif conf.settings['use_packed_blob_store']:
+                self.blob_manager = PackedBlobManager(self.hash_announcer,
+                                                      self.blob_dir,
+                                                      self.db_dir)
             else:
                 self.blob_manager = DiskBlobManager(self.hash_announcer,
                                                     self.blob_dir,
@@ -309,6 +325,11 @@ class Session(object):
                 self.base_payment_rate_manager,
                 self.blob_tracker,
                 self.is_generous)
+        if self.blob_quota is None and isinstance(self.blob_manager, DiskBlobManager):
+            eviction_policy = get_eviction_policy(conf.settings['blob_eviction_policy'],
+                                                  self.blob_manager, self.blob_tracker)
+            # started by the owner of the session once it has protected the blobs it needs
+            self.blob_quota = BlobQuota(self.blob_manager, eviction_policy)
 
         self.rate_limiter.start()
         d1 = self.blob_manager.setup()
@@ -212,6 +212,7 @@ class RequestHelper(object):
             return
         if reason.check(NoResponseError):
             self.requestor._incompatible_peers.append(self.peer)
+        self.peer.report_failure()
         log.warning("A request of type '%s' failed. Reason: %s, Error type: %s",
                     request_type, reason.getErrorMessage(), reason.type)
         self.update_local_score(-10.0)
@@ -394,6 +395,7 @@ class PriceRequest(RequestHelper):
         if offer.is_accepted:
             log.info("Offered rate %f/mb accepted by %s", offer.rate, self.peer.host)
             self.protocol_prices[self.protocol] = offer.rate
+            self.peer.report_payment_rate(offer.rate)
             return True
         elif offer.is_too_low:
             log.debug("Offered rate %f/mb rejected by %s", offer.rate, self.peer.host)
@@ -547,11 +549,15 @@ class DownloadRequest(RequestHelper):
         self.peer.update_stats('blobs_downloaded', 1)
         self.peer.update_score(5.0)
         self.requestor.blob_manager.blob_completed(blob)
+        connection_manager = self.requestor._download_manager.connection_manager
+        if connection_manager is not None:
+            connection_manager.blob_downloaded(blob)
         return arg
 
     def _download_failed(self, reason):
         if not reason.check(DownloadCanceledError, PriceDisagreementError):
             self.update_local_score(-10.0)
+            self.peer.report_failure()
         return reason
 
 
@@ -1,5 +1,6 @@
 import json
 import logging
+import time
 from decimal import Decimal
 from twisted.internet import error, defer
 from twisted.internet.protocol import Protocol, ClientFactory
@@ -10,6 +11,8 @@ from lbrynet.core import utils
 from lbrynet.core.Error import ConnectionClosedBeforeResponseError, NoResponseError
 from lbrynet.core.Error import DownloadCanceledError, MisbehavingPeerError
 from lbrynet.core.Error import RequestCanceledError
+from lbrynet.core.MessageFraming import FRAMING_QUERY, FRAMING_VERSION, MessageBuffer
+from lbrynet.core.MessageFraming import frame_message
 from lbrynet.interfaces import IRequestSender, IRateLimited
 from zope.interface import implements
 
@@ -27,6 +30,8 @@ class ClientProtocol(Protocol, TimeoutMixin):
     implements(IRequestSender, IRateLimited)
     ######### Protocol #########
     PROTOCOL_TIMEOUT = 30
+    PIPELINING_QUERY = 'blob_request_pipelining'
+    PIPELINING_VERSION = 1
 
     def connectionMade(self):
         log.debug("Connection made to %s", self.factory.peer)
@@ -34,9 +39,21 @@ class ClientProtocol(Protocol, TimeoutMixin):
         self._rate_limiter = self.factory.rate_limiter
         self.peer = self.factory.peer
         self._response_deferreds = {}
-        self._response_buff = ''
+        self._response_buff = MessageBuffer()
+        # whether framing and pipelining have been asked for, and which the server agreed to
+        self._capabilities_requested = False
+        self._framed = False
+        self._pipelining = False
+        # whether a request has been asked for or sent and is still waiting for its response
+        self._request_in_progress = False
         self._downloading_blob = False
         self._blob_download_request = None
+        # a blob request sent while the previous blob is still arriving, and the number of bytes
+        # of that blob still to come, after which the response to the request follows
+        self._pending_blob_request = None
+        self._blob_bytes_remaining = None
+        # when the request waiting for its response was sent, to measure the peer's response time
+        self._request_sent_at = None
         self._next_request = {}
         self.connection_closed = False
         self.connection_closing = False
@@ -50,20 +67,11 @@ class ClientProtocol(Protocol, TimeoutMixin):
         log.debug("Data receieved from %s", self.peer)
         self.setTimeout(None)
         self._rate_limiter.report_dl_bytes(len(data))
-        if self._downloading_blob is True:
-            self._blob_download_request.write(data)
-        else:
-            self._response_buff += data
-            if len(self._response_buff) > conf.settings['MAX_RESPONSE_INFO_SIZE']:
-                log.warning("Response is too large from %s. Size %s",
-                            self.peer, len(self._response_buff))
-                self.transport.loseConnection()
-            response, extra_data = self._get_valid_response(self._response_buff)
-            if response is not None:
-                self._response_buff = ''
-                self._handle_response(response)
-                if self._downloading_blob is True and len(extra_data) != 0:
-                    self._blob_download_request.write(extra_data)
+        while data:
+            if self._downloading_blob is True:
+                data = self._write_blob_data(data)
+            else:
+                data = self._read_response(data)
 
     def timeoutConnection(self):
         log.info("Connection timed out to %s", self.peer)
@@ -81,8 +89,9 @@ class ClientProtocol(Protocol, TimeoutMixin):
         for key, d in self._response_deferreds.items():
             del self._response_deferreds[key]
             d.errback(err)
-        if self._blob_download_request is not None:
-            self._blob_download_request.cancel(err)
+        for blob_request in (self._blob_download_request, self._pending_blob_request):
+            if blob_request is not None:
+                blob_request.cancel(err)
         self.factory.connection_was_made_deferred.callback(True)
 
     ######### IRequestSender #########
@@ -100,12 +109,16 @@ class ClientProtocol(Protocol, TimeoutMixin):
         if self._blob_download_request is None:
             d = self.add_request(blob_request)
             self._blob_download_request = blob_request
-            blob_request.finished_deferred.addCallbacks(self._downloading_finished,
-                                                        self._downloading_failed)
-            blob_request.finished_deferred.addErrback(self._handle_response_error)
-            return d
+        elif self._downloading_blob and self._pending_blob_request is None:
+            d = self.add_request(blob_request)
+            self._pending_blob_request = blob_request
         else:
             raise ValueError("There is already a blob download request active")
+        blob_request.finished_deferred.addCallbacks(
+            self._downloading_finished, self._downloading_failed,
+            callbackArgs=(blob_request,), errbackArgs=(blob_request,))
+        blob_request.finished_deferred.addErrback(self._handle_response_error)
+        return d
 
     def cancel_requests(self):
         self.connection_closing = True
@@ -115,10 +128,12 @@ class ClientProtocol(Protocol, TimeoutMixin):
             del self._response_deferreds[key]
             d.errback(err)
             ds.append(d)
-        if self._blob_download_request is not None:
-            self._blob_download_request.cancel(err)
-            ds.append(self._blob_download_request.finished_deferred)
-            self._blob_download_request = None
+        for blob_request in (self._blob_download_request, self._pending_blob_request):
+            if blob_request is not None:
+                blob_request.cancel(err)
+                ds.append(blob_request.finished_deferred)
+        self._blob_download_request = None
+        self._pending_blob_request = None
         return defer.DeferredList(ds)
 
     ######### Internal request handling #########
@@ -132,11 +147,18 @@ class ClientProtocol(Protocol, TimeoutMixin):
     def _ask_for_request(self):
         if self.connection_closed is True or self.connection_closing is True:
             return
+        if self._request_in_progress:
+            # only one request is sent ahead of the blob being downloaded
+            return
+        self._request_in_progress = True
 
         def send_request_or_close(do_request):
             if do_request is True:
                 request_msg, self._next_request = self._next_request, {}
                 self._send_request_message(request_msg)
+            elif self._pipelining and self._blob_download_request is not None:
+                # there's nothing to send ahead of this blob, so ask again once it's downloaded
+                self._request_in_progress = False
             else:
                 # The connection manager has indicated that this connection should be terminated
                 log.info(
@@ -152,27 +174,82 @@ class ClientProtocol(Protocol, TimeoutMixin):
         self.setTimeout(self.PROTOCOL_TIMEOUT)
         # TODO: compare this message to the last one. If they're the same,
         # TODO: incrementally delay this message.
+        if not self._capabilities_requested:
+            self._capabilities_requested = True
+            request_msg[FRAMING_QUERY] = FRAMING_VERSION
+            request_msg[self.PIPELINING_QUERY] = self.PIPELINING_VERSION
         m = json.dumps(request_msg, default=encode_decimal)
+        if self._framed:
+            m = frame_message(m)
+        self._request_sent_at = time.time()
         self.transport.write(m)
 
-    def _get_valid_response(self, response_msg):
-        extra_data = None
-        response = None
-        curr_pos = 0
-        while 1:
-            next_close_paren = response_msg.find('}', curr_pos)
-            if next_close_paren != -1:
-                curr_pos = next_close_paren + 1
-                try:
-                    response = json.loads(response_msg[:curr_pos])
-                except ValueError:
-                    pass
-                else:
-                    extra_data = response_msg[curr_pos:]
-                    break
-            else:
-                break
-        return response, extra_data
+    def _read_response(self, data):
+        """Add data to the response buffer and handle the response once it's complete
+
+        Returns the data received after the response which belongs to the blob being downloaded
+        """
+        self._response_buff.write(data)
+        if len(self._response_buff) > conf.settings['MAX_RESPONSE_INFO_SIZE']:
+            log.warning("Response is too large from %s. Size %s",
+                        self.peer, len(self._response_buff))
+            self.transport.loseConnection()
+        try:
+            response, extra_data = self._response_buff.get_message()
+        except ValueError:
+            log.warning("Invalid response from %s", self.peer)
+            self._response_buff.clear()
+            self.transport.loseConnection()
+            return ''
+        if response is None:
+            return ''
+        self._request_in_progress = False
+        if self._request_sent_at is not None:
+            self.peer.report_response_time(time.time() - self._request_sent_at)
+            self._request_sent_at = None
+        if response.pop(FRAMING_QUERY, None) == FRAMING_VERSION:
+            # the server agreed to frame the messages after this one
+            self._framed = self._response_buff.framed = True
+        if response.pop(self.PIPELINING_QUERY, None) == self.PIPELINING_VERSION:
+            # the server handles requests in order, so the next one can be sent while a blob
+            # is still arriving
+            self._pipelining = True
+        self._handle_response(response)
+        if self._downloading_blob is True:
+            return extra_data
+        return ''
+
+    def _write_blob_data(self, data):
+        """Write data to the blob being downloaded
+
+        Returns the data received after the end of the blob, which is only known when pipelining
+        """
+        blob_request = self._blob_download_request
+        if self._blob_bytes_remaining is None:
+            blob_request.write(data)
+            return ''
+        blob_data = data[:self._blob_bytes_remaining]
+        self._blob_bytes_remaining -= len(blob_data)
+        if not self._blob_bytes_remaining:
+            # the blob's finished deferred fires once it has been verified, the response to the
+            # pipelined request may arrive before that
+            self._blob_bytes_remaining = None
+            self._downloading_blob = False
+            self._blob_download_request = None
+            if self._request_sent_at is not None:
+                # don't count the time the pipelined request spent waiting behind the blob
+                self._request_sent_at = time.time()
+        blob_request.write(blob_data)
+        return data[len(blob_data):]
+
+    def _get_incoming_blob_length(self, response):
+        response_fields = response.get(self._blob_download_request.response_identifier)
+        if not isinstance(response_fields, dict) or 'error' in response_fields:
+            return None
+        length = response_fields.get('length')
+        if not isinstance(length, (int, long)) or length <= 0:
+            return None
+        return length
 
     def _handle_response_error(self, err):
         # If an error gets to this point, log it and kill the connection.
@@ -188,6 +265,10 @@ class ClientProtocol(Protocol, TimeoutMixin):
 
     def _handle_response(self, response):
         ds = []
+        if self._blob_download_request is None and self._pending_blob_request is not None:
+            # this responds to the request sent while the previous blob was being downloaded
+            self._blob_download_request = self._pending_blob_request
+            self._pending_blob_request = None
         log.debug(
             "Handling a response from %s. Expected responses: %s. Actual responses: %s",
             self.peer, self._response_deferreds.keys(), response.keys())
@@ -203,9 +284,16 @@ class ClientProtocol(Protocol, TimeoutMixin):
 
         if self._blob_download_request is not None:
             self._downloading_blob = True
+            blob_length = self._get_incoming_blob_length(response)
             d = self._blob_download_request.finished_deferred
+            if blob_length is not None:
+                d.addCallback(self._report_download, blob_length, time.time())
             d.addErrback(self._handle_response_error)
             ds.append(d)
+            if self._pipelining:
+                self._blob_bytes_remaining = blob_length
+                if blob_length is not None:
+                    self._ask_for_request()
 
         # TODO: are we sure we want to consume errors here
         dl = defer.DeferredList(ds, consumeErrors=True)
@@ -230,20 +318,25 @@ class ClientProtocol(Protocol, TimeoutMixin):
 
         dl.addCallback(get_next_request)
 
-    def _downloading_finished(self, arg):
+    def _report_download(self, arg, num_bytes, started):
+        self.peer.report_download(num_bytes, time.time() - started)
+        return arg
+
+    def _downloading_finished(self, arg, blob_request):
         log.debug("The blob has finished downloading from %s", self.peer)
-        self._blob_download_request = None
-        self._downloading_blob = False
+        if self._blob_download_request is blob_request:
+            self._blob_download_request = None
+            self._downloading_blob = False
         return arg
 
-    def _downloading_failed(self, err):
+    def _downloading_failed(self, err, blob_request):
         if err.check(DownloadCanceledError):
             # TODO: (wish-list) it seems silly to close the connection over this, and it shouldn't
             # TODO: always be this way. it's done this way now because the client has no other way
             # TODO: of telling the server it wants the download to stop. It would be great if the
             # TODO: protocol had such a mechanism.
             log.debug("Closing the connection to %s because the download of blob %s was canceled",
-                     self.peer, self._blob_download_request.blob)
+                     self.peer, blob_request.blob)
         return err
 
     ######### IRateLimited #########
@@ -1,10 +1,10 @@
-import random
 import logging
 from twisted.internet import defer, reactor
 from zope.interface import implements
 from lbrynet import interfaces
 from lbrynet import conf
 from lbrynet.core.client.ClientProtocol import ClientProtocolFactory
+from lbrynet.core.client.PeerSelector import get_peer_selector
 from lbrynet.core.Error import InsufficientFundsError
 from lbrynet.core import utils
 
@@ -20,20 +20,39 @@ class PeerConnectionHandler(object):
 
 class ConnectionManager(object):
     implements(interfaces.IConnectionManager)
+    # connections are managed whenever a connection closes, a peer search finishes or a blob is
+    # downloaded, this often, and otherwise every MANAGE_CALL_INTERVAL_SEC
     MANAGE_CALL_INTERVAL_SEC = 5
+    MANAGE_DEBOUNCE_SEC = 0.1
+    # managing the connections reconnects to the peers the last search found straight away, but
+    # each peer search is a DHT lookup, so another one isn't started until this long after the
+    # last one started
+    MIN_PEER_SEARCH_INTERVAL_SEC = 2
     TCP_CONNECT_TIMEOUT = 15
 
     def __init__(self, downloader, rate_limiter,
-                 primary_request_creators, secondary_request_creators):
+                 primary_request_creators, secondary_request_creators, peer_selector=None):
         self.downloader = downloader
         self.rate_limiter = rate_limiter
         self._primary_request_creators = primary_request_creators
         self._secondary_request_creators = secondary_request_creators
+        if peer_selector is None:
+            peer_selector = get_peer_selector(conf.settings['peer_selection_policy'])
+        self._peer_selector = peer_selector
         self._peer_connections = {}  # {Peer: PeerConnectionHandler}
         self._connections_closing = {}  # {Peer: deferred (fired when the connection is closed)}
         self._next_manage_call = None
         # a deferred that gets fired when a _manage call is set
         self._manage_deferred = None
+        # whether to manage the connections again as soon as the current manage call finishes
+        self._manage_again = False
+        # the peers the last search of each request creator found, less those which have since
+        # disconnected {request creator: [Peer]}
+        self._found_peers = {}
+        # a delayed call that is active until another peer search may be started
+        self._peer_search_timer = None
+        # whether to manage the connections as soon as _peer_search_timer has run
+        self._manage_after_search_timer = False
         self.stopped = True
         log.info("%s initialized", self._get_log_name())
 
@@ -70,11 +89,18 @@ class ConnectionManager(object):
         if self._next_manage_call and self._next_manage_call.active():
             self._next_manage_call.cancel()
         self._next_manage_call = None
+        if self._peer_search_timer and self._peer_search_timer.active():
+            self._peer_search_timer.cancel()
+        self._peer_search_timer = None
         yield self._close_peers()
 
     def num_peer_connections(self):
         return len(self._peer_connections)
 
+    def blob_downloaded(self, blob):
+        # the blobs still needed, and so the peers worth searching for, may have changed
+        self._schedule_manage()
+
     def _close_peers(self):
         def disconnect_peer(p):
             d = defer.Deferred()
@@ -146,20 +172,65 @@ class ConnectionManager(object):
     @defer.inlineCallbacks
     def manage(self, schedule_next_call=True):
         self._manage_deferred = defer.Deferred()
-        if len(self._peer_connections) < conf.settings['max_connections_per_stream']:
+        self._manage_again = False
+        if self._needs_peers():
             log.debug("%s have %d connections, looking for %d",
                         self._get_log_name(), len(self._peer_connections),
                         conf.settings['max_connections_per_stream'])
             ordered_request_creators = self._rank_request_creator_connections()
-            peers = yield self._get_new_peers(ordered_request_creators)
-            new_conns = conf.settings['max_connections_per_stream'] - len(self._peer_connections)
-            peers = self._pick_best_peers(peers, new_conns)
-            for peer in peers:
-                self._connect_to_peer(peer)
+            self._connect_to_found_peers(ordered_request_creators)
+        if self._needs_peers():
+            if self._peer_search_timer is not None and self._peer_search_timer.active():
+                # search once the interval has passed, if there still aren't enough peers then
+                self._manage_after_search_timer = True
+            else:
+                self._start_peer_search_timer()
+                yield self._get_new_peers(self._rank_request_creator_connections())
         self._manage_deferred.callback(None)
         self._manage_deferred = None
-        if not self.stopped and schedule_next_call:
-            self._next_manage_call = utils.call_later(self.MANAGE_CALL_INTERVAL_SEC, self.manage)
+        if not self.stopped:
+            if schedule_next_call:
+                self._next_manage_call = utils.call_later(self.MANAGE_CALL_INTERVAL_SEC,
+                                                          self.manage)
+            if self._manage_again:
+                self._schedule_manage()
+
+    def _needs_peers(self):
+        return len(self._peer_connections) < conf.settings['max_connections_per_stream']
+
+    def _connect_to_found_peers(self, request_creators):
+        peers = []
+        for request_creator in request_creators:
+            for peer in self._found_peers.get(request_creator, []):
+                if peer not in peers:
+                    peers.append(peer)
+        self._connect_to_new_peers(peers)
+
+    def _start_peer_search_timer(self):
+        self._manage_after_search_timer = False
+        self._peer_search_timer = utils.call_later(self.MIN_PEER_SEARCH_INTERVAL_SEC,
+                                                   self._peer_search_timer_done)
+
+    def _peer_search_timer_done(self):
+        self._peer_search_timer = None
+        if self._manage_after_search_timer:
+            self._manage_after_search_timer = False
+            self._schedule_manage()
+
+    def _schedule_manage(self):
+        """Manage the connections soon, unless they're about to be managed anyway"""
+        if self.stopped:
+            return
+        if self._manage_deferred is not None:
+            # the peer searches of the running manage call may predate whatever happened
+            self._manage_again = True
+            return
+        next_call = self._next_manage_call
+        if next_call is not None and next_call.active():
+            if next_call.getTime() - next_call.seconds() > self.MANAGE_DEBOUNCE_SEC:
+                next_call.reset(self.MANAGE_DEBOUNCE_SEC)
+        else:
+            self._next_manage_call = utils.call_later(self.MANAGE_DEBOUNCE_SEC, self.manage)
 
     def _rank_request_creator_connections(self):
         """Returns an ordered list of our request creators, ranked according
@@ -173,19 +244,41 @@ class ConnectionManager(object):
 
         return sorted(self._primary_request_creators, key=count_peers)
 
-    @defer.inlineCallbacks
     def _get_new_peers(self, request_creators):
+        """Search for peers for all the request creators at once
+
+        The peers each search finds are connected to as soon as it finishes, and kept to
+        reconnect to until the next search. Returns a deferred which fires once all the searches
+        have finished.
+        """
         log.debug("%s Trying to get a new peer to connect to", self._get_log_name())
-        if not request_creators:
-            defer.returnValue(None)
-        new_peers = yield request_creators[0].get_new_peers()
-        if not new_peers:
-            new_peers = yield self._get_new_peers(request_creators[1:])
-        defer.returnValue(new_peers)
+
+        def search_failed(err):
+            log.warning("%s A peer search failed: %s", self._get_log_name(),
+                        err.getErrorMessage())
+
+        def search_finished(peers, request_creator):
+            self._found_peers[request_creator] = list(peers or [])
+            self._connect_to_new_peers(peers)
+
+        ds = []
+        for request_creator in request_creators:
+            d = defer.maybeDeferred(request_creator.get_new_peers)
+            d.addCallback(search_finished, request_creator)
+            d.addErrback(search_failed)
+            ds.append(d)
+        return defer.DeferredList(ds)
+
+    def _connect_to_new_peers(self, peers):
+        if self.stopped:
+            return
+        new_conns = conf.settings['max_connections_per_stream'] - len(self._peer_connections)
+        if new_conns <= 0:
+            return
+        for peer in self._pick_best_peers(peers, new_conns):
+            self._connect_to_peer(peer)
 
     def _pick_best_peers(self, peers, num_peers_to_pick):
-        # TODO: Eventually rank them based on past performance/reputation. For now
-        # TODO: just pick the first to which we don't have an open connection
         log.debug("%s Got a list of peers to choose from: %s",
                     self._get_log_name(), peers)
         log.debug("%s Current connections: %s",
@@ -195,8 +288,7 @@ class ConnectionManager(object):
         if peers is None:
             return []
         out = [peer for peer in peers if peer not in self._peer_connections]
-        random.shuffle(out)
-        return out[0:num_peers_to_pick]
+        return self._peer_selector.pick_peers(out, num_peers_to_pick)
 
 
     def _connect_to_peer(self, peer):
@@ -218,10 +310,15 @@ class ConnectionManager(object):
                     self._get_log_name(), peer)
         if peer in self._peer_connections:
             del self._peer_connections[peer]
+        # don't reconnect to it until a search finds it again
+        for found_peers in self._found_peers.itervalues():
+            if peer in found_peers:
+                found_peers.remove(peer)
         if peer in self._connections_closing:
             d = self._connections_closing[peer]
             del self._connections_closing[peer]
             d.callback(True)
+        self._schedule_manage()
         return connection_was_made
 
 
@@ -47,15 +47,51 @@ class DHTPeerFinder(object):
             reactor.callLater(timeout, _trigger_timeout)
 
         peer_list = yield finished_deferred
+        defer.returnValue(self._get_available_peers(peer_list))
 
-        peers = set(peer_list)
+    @defer.inlineCallbacks
+    def find_peers_for_blobs(self, blob_hashes, timeout=None):
+        """Find the peers for many blobs with one batch of DHT lookups
+
+        Returns a deferred which fires with {blob_hash: [Peer]}. Blobs whose lookup failed or
+        timed out are left out, a blob which was looked up but has no peers maps to [].
+        """
+        def _trigger_timeout():
+            for blob_hash, d in lookups.iteritems():
+                if not d.called:
+                    log.debug("Peer search for %s timed out", short_hash(blob_hash))
+                    d.cancel()
+
+        bin_hashes = {binascii.unhexlify(blob_hash): blob_hash for blob_hash in blob_hashes}
+        lookups = {
+            bin_hashes[bin_hash]: d
+            for bin_hash, d in self.dht_node.getPeersForBlobs(bin_hashes.keys()).iteritems()
+        }
+        timeout_call = None
+        if timeout is not None:
+            timeout_call = reactor.callLater(timeout, _trigger_timeout)
+
+        peers = {}
+        for blob_hash, d in lookups.iteritems():
+            try:
+                peer_list = yield d
+            except defer.CancelledError:
+                continue
+            except Exception as err:
+                log.debug("Peer search for %s failed: %s", short_hash(blob_hash), err)
+                continue
+            peers[blob_hash] = self._get_available_peers(peer_list)
+        if timeout_call is not None and timeout_call.active():
+            timeout_call.cancel()
+        defer.returnValue(peers)
+
+    def _get_available_peers(self, peer_list):
         good_peers = []
-        for host, port in peers:
+        for host, port in set(peer_list):
             peer = self.peer_manager.get_peer(host, port)
             if peer.is_available() is True:
                 good_peers.append(peer)
-
-        defer.returnValue(good_peers)
+        return good_peers
 
     def get_most_popular_hashes(self, num_to_return):
         return self.dht_node.get_most_popular_hashes(num_to_return)
@@ -0,0 +1,82 @@
+import math
+import random
+
+from lbrynet import conf
+
+
+class RandomPeerSelector(object):
+    """Pick peers at random, ignoring how they did before"""
+    name = 'random'
+
+    def pick_peers(self, peers, count):
+        peers = list(peers)
+        random.shuffle(peers)
+        return peers[:count]
+
+
+class UCBPeerSelector(object):
+    """Pick the peers which did best before, giving peers with few measurements another chance
+
+    A peer's value is the rate it would deliver a blob at, counting the time it takes to respond,
+    scaled down by the fraction of requests to it which failed and by how much more it charges
+    than the cheapest of the candidates. Values are relative to the best candidate, and each
+    peer gets an exploration bonus which shrinks as it's measured more (UCB1), so a peer which was
+    slow once isn't written off for good. Peers which haven't been measured are tried first.
+
+    The measurements are kept on the Peer, which PeerManager shares between streams.
+    """
+    name = 'ucb'
+    EXPLORATION = 0.5
+
+    def pick_peers(self, peers, count):
+        peers = list(peers)
+        # peers which rank the same are picked at random
+        random.shuffle(peers)
+        values = self._get_values(peers)
+        measurements = dict((peer, peer.downloads + peer.failures) for peer in peers)
+        total = sum(measurements.itervalues())
+
+        def rank(peer):
+            if not measurements[peer]:
+                return float('inf')
+            bonus = self.EXPLORATION * math.sqrt(math.log(total) / measurements[peer])
+            return values[peer] + bonus
+
+        peers.sort(key=rank, reverse=True)
+        return peers[:count]
+
+    def _get_values(self, peers):
+        rates = [float(peer.payment_rate) for peer in peers if peer.payment_rate]
+        cheapest_rate = min(rates) if rates else None
+        values = {}
+        for peer in peers:
+            value = self._get_delivery_rate(peer) * (1.0 - peer.get_failure_rate())
+            if peer.payment_rate and cheapest_rate:
+                value *= cheapest_rate / float(peer.payment_rate)
+            values[peer] = value
+        best = max(values.itervalues()) if values else 0
+        if best > 0:
+            for peer in values:
+                values[peer] /= best
+        return values
+
+    def _get_delivery_rate(self, peer):
+        if not peer.download_rate:
+            return 0.0
+        blob_size = conf.settings['BLOB_SIZE']
+        seconds = blob_size / peer.download_rate + (peer.response_time or 0.0)
+        return blob_size / seconds
+
+
+PEER_SELECTORS = [
+    RandomPeerSelector,
+    UCBPeerSelector,
+]
+
+
+def get_peer_selector(name):
+    for selector in PEER_SELECTORS:
+        if selector.name == name:
+            return selector()
+    raise ValueError("Unknown peer selection policy: %s (expected one of %s)" %
+                     (name, ", ".join(s.name for s in PEER_SELECTORS)))
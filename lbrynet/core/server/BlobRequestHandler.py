@@ -194,18 +194,18 @@ class BlobRequestHandler(object):
             return inner_d
 
         def count_bytes(data):
-            uploaded = len(data)
-            self.blob_bytes_uploaded += uploaded
-            self.peer.update_stats('blob_bytes_uploaded', uploaded)
-            if self.analytics_manager is not None:
-                self.analytics_manager.add_observation(analytics.BLOB_BYTES_UPLOADED, uploaded)
+            self._count_uploaded_bytes(len(data))
             return data
 
         def start_transfer():
-            self.file_sender = FileSender()
             log.debug("Starting the file upload")
             assert self.read_handle is not None, \
                 "self.read_handle was None when trying to start the transfer"
+            if self._can_sendfile(consumer):
+                d = consumer.sendfile(self.read_handle, 0, self.currently_uploading.length)
+                d.addCallback(self._count_uploaded_bytes)
+                return d
+            self.file_sender = FileSender()
             d = self.file_sender.beginFileTransfer(self.read_handle, consumer, count_bytes)
             return d
 
@@ -233,3 +233,17 @@ class BlobRequestHandler(object):
                 log.warning("Upload has failed. Reason: %s", reason.getErrorMessage())
 
         return _send_file()
+
+    def _can_sendfile(self, consumer):
+        # blobs which aren't stored in their own file are read through python
+        can_sendfile = getattr(consumer, 'can_sendfile', None)
+        return (
+            can_sendfile is not None and can_sendfile() and
+            isinstance(self.read_handle, file) and self.currently_uploading.length is not None
+        )
+
+    def _count_uploaded_bytes(self, uploaded):
+        self.blob_bytes_uploaded += uploaded
+        self.peer.update_stats('blob_bytes_uploaded', uploaded)
+        if self.analytics_manager is not None:
+            self.analytics_manager.add_observation(analytics.BLOB_BYTES_UPLOADED, uploaded)
@@ -11,7 +11,20 @@ log = logging.getLogger(__name__)
 
 class DHTHashAnnouncer(object):
     ANNOUNCE_CHECK_INTERVAL = 60
+    # number of groups of hashes announced at once to begin with, this is adjusted to the
+    # measured announce times between the minimum and maximum
     CONCURRENT_ANNOUNCERS = 5
+    MIN_CONCURRENT_ANNOUNCERS = 1
+    MAX_CONCURRENT_ANNOUNCERS = 50
+    # number of consecutive hashes in the queue announced as one group, the hashes of a group
+    # are close to each other so their lookups mostly reach the same nodes
+    ANNOUNCE_GROUP_SIZE = 10
+    # concurrency grows while the average time to announce a hash is below the first of
+    # these multiples of the fastest time seen, and shrinks while it is above the second
+    FAST_ANNOUNCE_FACTOR = 1.5
+    SLOW_ANNOUNCE_FACTOR = 2.0
+    # sd blobs and the first blob of each stream are reannounced this often
+    PRIORITY_REANNOUNCE_TIME = 15 * 60
 
     """This class announces to the DHT that this peer has certain blobs"""
     def __init__(self, dht_node, peer_port):
@@ -20,7 +33,13 @@ class DHTHashAnnouncer(object):
         self.suppliers = []
         self.next_manage_call = None
         self.hash_queue = collections.deque()
-        self._concurrent_announcers = 0
+        self.concurrent_announcers = self.CONCURRENT_ANNOUNCERS
+        self._running_announcers = 0
+        self._priority_sources = []
+        self._priority_announce_times = {}  # {blob_hash: time it was last queued}
+        # smoothed and smallest seconds it took to announce a single hash
+        self._announce_time = None
+        self._min_announce_time = None
 
     def run_manage_loop(self):
         if self.peer_port is not None:
@@ -36,6 +55,15 @@ class DHTHashAnnouncer(object):
     def add_supplier(self, supplier):
         self.suppliers.append(supplier)
 
+    def add_priority_hashes_source(self, get_blob_hashes):
+        """Announce the blobs returned by get_blob_hashes ahead of the others, and every
+        PRIORITY_REANNOUNCE_TIME seconds rather than when their supplier schedules them
+
+        get_blob_hashes is called every ANNOUNCE_CHECK_INTERVAL seconds and returns a deferred
+        which fires with an iterable of blob hashes
+        """
+        self._priority_sources.append(get_blob_hashes)
+
     def immediate_announce(self, blob_hashes):
         if self.peer_port is not None:
             return self._announce_hashes(blob_hashes, immediate=True)
@@ -45,9 +73,16 @@ class DHTHashAnnouncer(object):
     def hash_queue_size(self):
         return len(self.hash_queue)
 
+    def get_hash_announce_duration(self):
+        """Seconds it takes on average to get through one hash of the queue, or None if no
+        hash has been announced yet"""
+        if self._announce_time is None:
+            return None
+        return self._announce_time / self.concurrent_announcers
+
     def _announce_available_hashes(self):
         log.debug('Announcing available hashes')
-        ds = []
+        ds = [self._announce_priority_hashes()]
         for supplier in self.suppliers:
             d = supplier.hashes_to_announce()
             d.addCallback(self._announce_hashes)
@@ -55,6 +90,31 @@ class DHTHashAnnouncer(object):
         dl = defer.DeferredList(ds)
         return dl
 
+    @defer.inlineCallbacks
+    def _announce_priority_hashes(self):
+        blob_hashes = set()
+        for get_blob_hashes in self._priority_sources:
+            d = defer.maybeDeferred(get_blob_hashes)
+            d.addErrback(self._priority_source_failed, get_blob_hashes)
+            hashes = yield d
+            blob_hashes.update(hashes)
+        now = time.time()
+        due = []
+        for blob_hash in blob_hashes:
+            last_announce = self._priority_announce_times.get(blob_hash)
+            if last_announce is None or now - last_announce >= self.PRIORITY_REANNOUNCE_TIME:
+                self._priority_announce_times[blob_hash] = now
+                due.append(blob_hash)
+        for blob_hash in set(self._priority_announce_times) - blob_hashes:
+            del self._priority_announce_times[blob_hash]
+        if due:
+            yield self._announce_hashes(due, immediate=True)
+
+    def _priority_source_failed(self, err, get_blob_hashes):
+        log.warning("Failed to get priority hashes from %s: %s", get_blob_hashes,
+                    err.getErrorMessage())
+        return []
+
     def _announce_hashes(self, hashes, immediate=False):
         if not hashes:
             return
@@ -63,39 +123,78 @@ class DHTHashAnnouncer(object):
         start = time.time()
         ds = []
 
-        for h in hashes:
+        # queue the hashes in order so that consecutive hashes are close to each other
+        queued = []
+        for h in sorted(hashes):
             announce_deferred = defer.Deferred()
             ds.append(announce_deferred)
-            if immediate:
-                self.hash_queue.appendleft((h, announce_deferred))
-            else:
-                self.hash_queue.append((h, announce_deferred))
+            queued.append((h, announce_deferred))
+        if immediate:
+            self.hash_queue.extendleft(reversed(queued))
+        else:
+            self.hash_queue.extend(queued)
         log.debug('There are now %s hashes remaining to be announced', self.hash_queue_size())
 
-        def announce():
-            if len(self.hash_queue):
-                h, announce_deferred = self.hash_queue.popleft()
-                log.debug('Announcing blob %s to dht', h)
-                d = self.dht_node.announceHaveBlob(binascii.unhexlify(h), self.peer_port)
-                d.chainDeferred(announce_deferred)
-                d.addBoth(lambda _: utils.call_later(0, announce))
-            else:
-                self._concurrent_announcers -= 1
-
-        for i in range(self._concurrent_announcers, self.CONCURRENT_ANNOUNCERS):
-            self._concurrent_announcers += 1
-            announce()
+        self._start_announcers()
         d = defer.DeferredList(ds)
         d.addCallback(lambda _: log.debug('Took %s seconds to announce %s hashes',
                                           time.time() - start, len(hashes)))
         return d
 
+    def _start_announcers(self):
+        while self._running_announcers < self.concurrent_announcers and self.hash_queue:
+            self._running_announcers += 1
+            self._announce_next_group()
+
+    def _announce_next_group(self):
+        if not self.hash_queue or self._running_announcers > self.concurrent_announcers:
+            self._running_announcers -= 1
+            return
+        group = []
+        while self.hash_queue and len(group) < self.ANNOUNCE_GROUP_SIZE:
+            group.append(self.hash_queue.popleft())
+        log.debug('Announcing %i blobs to dht', len(group))
+        start = time.time()
+        results = self.dht_node.announceHaveBlobs(
+            [binascii.unhexlify(h) for h, _ in group], self.peer_port, parallelism=1)
+        for h, announce_deferred in group:
+            results[binascii.unhexlify(h)].chainDeferred(announce_deferred)
+        d = defer.DeferredList([announce_deferred for _, announce_deferred in group])
+        d.addCallback(lambda _: utils.call_later(0, self._group_announced, len(group),
+                                                 time.time() - start))
+
+    def _group_announced(self, count, elapsed):
+        self._update_concurrency(count, elapsed)
+        self._announce_next_group()
+        self._start_announcers()
+
+    def _update_concurrency(self, count, elapsed):
+        """Adjust the number of groups announced at once to the time this group took
+
+        Like TCP Vegas, the concurrency grows by one while hashes are announced about as fast
+        as they have ever been and shrinks by one when they take much longer, which happens
+        when the node's connection or the nodes it stores at are overloaded.
+        """
+        announce_time = elapsed / count
+        if self._announce_time is None:
+            self._announce_time = announce_time
+            self._min_announce_time = announce_time
+        else:
+            self._announce_time = 0.875 * self._announce_time + 0.125 * announce_time
+            self._min_announce_time = min(self._min_announce_time, announce_time)
+        if self._announce_time > self.SLOW_ANNOUNCE_FACTOR * self._min_announce_time:
+            self.concurrent_announcers = max(self.MIN_CONCURRENT_ANNOUNCERS,
+                                             self.concurrent_announcers - 1)
+        elif self._announce_time <= self.FAST_ANNOUNCE_FACTOR * self._min_announce_time:
+            self.concurrent_announcers = min(self.MAX_CONCURRENT_ANNOUNCERS,
+                                             self.concurrent_announcers + 1)
+
 
 class DHTHashSupplier(object):
     # 1 hour is the min time hash will be reannounced
     MIN_HASH_REANNOUNCE_TIME = 60*60
     # conservative assumption of the time it takes to announce
-    # a single hash
+    # a single hash, used until the announcer has measured it
     SINGLE_HASH_ANNOUNCE_DURATION = 1
 
     """Classes derived from this class give hashes to a hash announcer"""
@@ -113,8 +212,8 @@ class DHTHashSupplier(object):
         Hash reannounce time is set to current time + MIN_HASH_REANNOUNCE_TIME,
         unless we are announcing a lot of hashes at once which could cause the
         the announce queue to pile up.  To prevent pile up, reannounce
-        only after a conservative estimate of when it will finish
-        to announce all the hashes.
+        only after an estimate of when it will finish to announce all the
+        hashes, at the rate the announcer has been announcing them.
 
         Args:
             num_hashes_to_announce: number of hashes that will be added to the queue
@@ -122,8 +221,11 @@ class DHTHashSupplier(object):
             timestamp for next announce time
         """
         queue_size = self.hash_announcer.hash_queue_size()+num_hashes_to_announce
+        hash_announce_duration = self.hash_announcer.get_hash_announce_duration()
+        if hash_announce_duration is None:
+            hash_announce_duration = self.SINGLE_HASH_ANNOUNCE_DURATION
         reannounce = max(self.MIN_HASH_REANNOUNCE_TIME,
-                            queue_size*self.SINGLE_HASH_ANNOUNCE_DURATION)
+                            queue_size*hash_announce_duration)
         return time.time() + reannounce
 
 
@@ -1,14 +1,96 @@
+import errno
 import logging
-from twisted.internet import interfaces, error
+from twisted.internet import interfaces, error, defer
 from twisted.internet.protocol import Protocol, ServerFactory
 from twisted.python import failure
 from zope.interface import implements
 from lbrynet.core.server.ServerRequestHandler import ServerRequestHandler
 
+try:
+    from os import sendfile
+except ImportError:
+    # python 2 needs the pysendfile package for sendfile support
+    try:
+        from sendfile import sendfile
+    except ImportError:
+        sendfile = None
+
 
 log = logging.getLogger(__name__)
 
 
+class SendfileProducer(object):
+    """Sends part of a file straight from the file to a TCP transport's socket with sendfile
+
+    This is registered as a pull producer with the transport, which calls resumeProducing once
+    everything written to it before has been flushed and it is safe to write to the socket
+    directly. When the socket can't take more data it waits for the transport to report that
+    it is writable again.
+    """
+    implements(interfaces.IPullProducer)
+
+    def __init__(self, transport, file_handle, offset, count, report_bytes):
+        self.transport = transport
+        self.file_handle = file_handle
+        self.offset = offset
+        self.end = offset + count
+        self.report_bytes = report_bytes
+        self.bytes_sent = 0
+        self.paused = False
+        self.deferred = None
+        self._started = False
+
+    def begin_transfer(self):
+        d = self.deferred = defer.Deferred()
+        self.transport.registerProducer(self, False)
+        self._started = True
+        # resumeProducing will be called once the transport's write buffer is empty
+        self.transport.startWriting()
+        return d
+
+    def pause(self):
+        self.paused = True
+
+    def resume(self):
+        self.paused = False
+        if self.deferred is not None:
+            self.transport.startWriting()
+
+    def resumeProducing(self):
+        if not self._started or self.paused or self.deferred is None:
+            return
+        try:
+            sent = sendfile(self.transport.fileno(), self.file_handle.fileno(), self.offset,
+                            self.end - self.offset)
+        except (IOError, OSError) as err:
+            if err.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                self.transport.startWriting()
+                return
+            return self._finish(failure.Failure(err))
+        if sent == 0:
+            return self._finish(failure.Failure(IOError("File ended before it was sent")))
+        self.offset += sent
+        self.bytes_sent += sent
+        self.report_bytes(sent)
+        if self.offset >= self.end:
+            self._finish(self.bytes_sent)
+        else:
+            self.transport.startWriting()
+
+    def stopProducing(self):
+        if self.deferred is not None:
+            self._finish(failure.Failure(error.ConnectionLost()))
+
+    def _finish(self, result):
+        if self.transport.producer is self:
+            self.transport.unregisterProducer()
+        d, self.deferred = self.deferred, None
+        if isinstance(result, failure.Failure):
+            d.errback(result)
+        else:
+            d.callback(result)
+
+
 class ServerProtocol(Protocol):
     """ServerProtocol needs to:
 
@@ -28,6 +110,8 @@ class ServerProtocol(Protocol):
 
     #Protocol stuff
 
+    sendfile_producer = None
+
     def connectionMade(self):
         log.debug("Got a connection")
         peer_info = self.transport.getPeer()
@@ -67,15 +151,48 @@ class ServerProtocol(Protocol):
         self.transport.write(data)
         self.factory.rate_limiter.report_ul_bytes(len(data))
 
+    def can_sendfile(self):
+        return (
+            sendfile is not None and
+            hasattr(self.transport, 'fileno') and hasattr(self.transport, 'startWriting') and
+            not interfaces.ISSLTransport.providedBy(self.transport)
+        )
+
+    def sendfile(self, file_handle, offset, count):
+        """Send count bytes of file_handle, starting at offset, without copying them through
+        python
+
+        Returns a deferred which fires with the number of bytes sent
+        """
+        log.trace("Sending %s bytes of %s with sendfile", count, file_handle)
+        assert self.sendfile_producer is None, "Already sending a file"
+        self.sendfile_producer = SendfileProducer(
+            self.transport, file_handle, offset, count, self.factory.rate_limiter.report_ul_bytes)
+        if self.request_handler is not None and self.request_handler.production_paused:
+            # the rate limiter has throttled uploads
+            self.sendfile_producer.pause()
+        d = self.sendfile_producer.begin_transfer()
+
+        def clear_producer(result):
+            self.sendfile_producer = None
+            return result
+
+        d.addBoth(clear_producer)
+        return d
+
     #Rate limiter stuff
 
     def throttle_upload(self):
         if self.request_handler is not None:
             self.request_handler.pauseProducing()
+        if self.sendfile_producer is not None:
+            self.sendfile_producer.pause()
 
     def unthrottle_upload(self):
         if self.request_handler is not None:
             self.request_handler.resumeProducing()
+        if self.sendfile_producer is not None:
+            self.sendfile_producer.resume()
 
     def throttle_download(self):
         self.transport.pauseProducing()
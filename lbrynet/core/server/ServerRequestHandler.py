@@ -1,7 +1,9 @@
 import json
 import logging
-from twisted.internet import interfaces, defer
+from twisted.internet import error, interfaces, defer
 from zope.interface import implements
+from lbrynet.core.MessageFraming import FRAMING_QUERY, FRAMING_VERSION, MessageBuffer
+from lbrynet.core.MessageFraming import frame_message
 from lbrynet.interfaces import IRequestHandler
 
 
@@ -14,12 +16,20 @@ class ServerRequestHandler(object):
     associated with streams.
     """
     implements(interfaces.IPushProducer, interfaces.IConsumer, IRequestHandler)
+    PIPELINING_QUERY = 'blob_request_pipelining'
+    # requests are handled one at a time, so a client may send its next request while a blob
+    # is being uploaded to it
+    PIPELINING_VERSION = 1
 
     def __init__(self, consumer):
         self.consumer = consumer
         self.production_paused = False
-        self.request_buff = ''
+        self.request_buff = MessageBuffer()
+        # whether responses are framed, which the client asks for in its first request
+        self.framed = False
         self.response_buff = ''
+        # deferreds fired once response_buff has been written out
+        self._flushed_deferreds = []
         self.producer = None
         self.request_received = False
         self.CHUNK_SIZE = 2**14
@@ -37,6 +47,9 @@ class ServerRequestHandler(object):
             self.producer.stopProducing()
             self.producer = None
         self.production_paused = True
+        flushed_deferreds, self._flushed_deferreds = self._flushed_deferreds, []
+        for d in flushed_deferreds:
+            d.errback(error.ConnectionLost())
         self.consumer.unregisterProducer()
 
     def resumeProducing(self):
@@ -60,6 +73,10 @@ class ServerRequestHandler(object):
             return
         log.trace("writing %s bytes to the client", len(chunk))
         self.consumer.write(chunk)
+        if not self.response_buff:
+            flushed_deferreds, self._flushed_deferreds = self._flushed_deferreds, []
+            for d in flushed_deferreds:
+                d.callback(None)
         reactor.callLater(0, self._produce_more)
 
     #IConsumer stuff
@@ -86,28 +103,52 @@ class ServerRequestHandler(object):
 
         reactor.callLater(0, get_more_data)
 
+    def can_sendfile(self):
+        return self.consumer.can_sendfile()
+
+    def sendfile(self, file_handle, offset, count):
+        """Send part of a file with sendfile once the buffered response has been written
+
+        Returns a deferred which fires with the number of bytes sent
+        """
+        if not self.response_buff:
+            return self.consumer.sendfile(file_handle, offset, count)
+        d = defer.Deferred()
+        self._flushed_deferreds.append(d)
+        d.addCallback(lambda _: self.consumer.sendfile(file_handle, offset, count))
+        return d
+
     #From Protocol
 
     def data_received(self, data):
         log.debug("Received data")
         log.debug("%s", str(data))
+        self.request_buff.write(data)
         if self.request_received is False:
-            return self._parse_data_and_maybe_send_blob(data)
+            return self._parse_data_and_maybe_send_blob()
         else:
-            log.warning(
-                "The client sent data when we were uploading a file. This should not happen")
+            # the client has pipelined its next request, which is handled once this one is done
+            log.debug("Queueing data received while handling a request")
 
-    def _parse_data_and_maybe_send_blob(self, data):
-        self.request_buff = self.request_buff + data
-        msg = self.try_to_parse_request(self.request_buff)
+    def _parse_data_and_maybe_send_blob(self):
+        try:
+            msg, extra_data = self.request_buff.get_message()
+        except ValueError:
+            # the client would wait for a response which isn't coming, hang up instead
+            log.warning("Received a request which is not a valid json message, closing the "
+                        "connection")
+            self.request_buff.clear()
+            self.stopProducing()
+            return
         if msg:
-            self.request_buff = ''
+            if extra_data:
+                self.request_buff.write(extra_data)
             self._process_msg(msg)
         else:
             log.debug("Request buff not a valid json message")
-            log.debug("Request buff: %s", self.request_buff)
 
     def _process_msg(self, msg):
+        self.request_received = True
         d = self.handle_request(msg)
         if self.blob_sender:
             d.addCallback(lambda _: self.blob_sender.send_blob_if_requested(self))
@@ -132,9 +173,13 @@ class ServerRequestHandler(object):
     def finished_response(self):
         self.request_received = False
         self._produce_more()
+        if len(self.request_buff):
+            self._parse_data_and_maybe_send_blob()
 
     def send_response(self, msg):
         m = json.dumps(msg)
+        if self.framed:
+            m = frame_message(m)
         log.debug("Sending a response of length %s", str(len(m)))
         log.debug("Response: %s", str(m))
         self.response_buff = self.response_buff + m
@@ -162,8 +207,18 @@ class ServerRequestHandler(object):
                 err.getErrorMessage())
             return err
 
+        start_framing = not self.framed and msg.get(FRAMING_QUERY) == FRAMING_VERSION
+        pipelining = self.PIPELINING_QUERY in msg
+
         def send_response(response):
+            if pipelining:
+                response[self.PIPELINING_QUERY] = self.PIPELINING_VERSION
+            if start_framing:
+                # the client will frame its next request, and expects the next response framed
+                response[FRAMING_QUERY] = FRAMING_VERSION
+                self.request_buff.framed = True
             self.send_response(response)
+            self.framed = self.framed or start_framing
             return True
 
         ds = []
@@ -177,10 +232,3 @@ class ServerRequestHandler(object):
         dl.addCallback(create_response_message)
         dl.addCallback(send_response)
         return dl
-
-    def try_to_parse_request(self, request_buff):
-        try:
-            msg = json.loads(request_buff)
-            return msg
-        except ValueError:
-            return None
@@ -0,0 +1,156 @@
+import collections
+import heapq
+
+
+class RateCounter(object):
+    """ Counts events, and the bytes they carried, over a sliding window
+
+    The window is split into a fixed number of buckets kept in a ring. A bucket
+    is reset when it is reused for a newer time slot, so old counts expire
+    without any periodic sweep, and adding an event or reading the totals
+    never costs more than the number of buckets.
+    """
+
+    def __init__(self, window=1.0, buckets=10):
+        self._bucketWidth = float(window) / buckets
+        self._slots = [None] * buckets
+        self._counts = [0] * buckets
+        self._bytes = [0] * buckets
+
+    def add(self, size, now):
+        slot = int(now / self._bucketWidth)
+        i = slot % len(self._slots)
+        if self._slots[i] != slot:
+            self._slots[i] = slot
+            self._counts[i] = 0
+            self._bytes[i] = 0
+        self._counts[i] += 1
+        self._bytes[i] += size
+
+    def totals(self, now):
+        """ Return (events, bytes) seen within the window ending at now """
+        oldest = int(now / self._bucketWidth) - len(self._slots)
+        count, size = 0, 0
+        for i, slot in enumerate(self._slots):
+            if slot is not None and slot > oldest:
+                count += self._counts[i]
+                size += self._bytes[i]
+        return count, size
+
+
+class RecentAddresses(object):
+    """ Keeps the addresses seen within the last window seconds
+
+    Addresses are kept in the order they were last seen in, so the expired ones
+    are always at the front and are dropped as the set is used.
+    """
+
+    def __init__(self, window=1.0):
+        self.window = window
+        self._lastSeen = collections.OrderedDict()
+
+    def add(self, address, now):
+        self._lastSeen.pop(address, None)
+        self._lastSeen[address] = now
+        self._expire(now)
+
+    def count(self, now):
+        self._expire(now)
+        return len(self._lastSeen)
+
+    def _expire(self, now):
+        while self._lastSeen:
+            address, seen = next(self._lastSeen.iteritems())
+            if now - seen < self.window:
+                break
+            del self._lastSeen[address]
+
+
+class TopTalkers(object):
+    """ Approximates the peers which sent or received the most bytes
+
+    At most size peers are tracked (the "space saving" algorithm). When a peer
+    which isn't tracked shows up while the table is full, it replaces the
+    smallest entry and inherits its count, so the totals of the peers that
+    stay in the table can be overestimated, but never by more than the
+    smallest count.
+
+    The smallest entry is found with a heap of (bytes, peer) entries. Entries
+    are pushed as counts grow and the outdated ones are skipped when they
+    come up, the heap is rebuilt from the table once it holds twice as many
+    entries as there are peers.
+    """
+
+    def __init__(self, size=100):
+        self.size = size
+        self._bytes = {}
+        self._heap = []
+
+    def add(self, address, size):
+        count = self._bytes.get(address)
+        if count is None and len(self._bytes) >= self.size:
+            count = self._pop_smallest()
+        count = (count or 0) + size
+        self._bytes[address] = count
+        heapq.heappush(self._heap, (count, address))
+        if len(self._heap) > 2 * self.size:
+            self._heap = [(c, a) for a, c in self._bytes.iteritems()]
+            heapq.heapify(self._heap)
+
+    def top(self, count=None):
+        """ Return a list of (address, bytes), most bytes first """
+        ranked = sorted(self._bytes.iteritems(), key=lambda item: item[1], reverse=True)
+        return ranked[:count] if count is not None else ranked
+
+    def _pop_smallest(self):
+        while True:
+            count, address = heapq.heappop(self._heap)
+            if self._bytes.get(address) == count:
+                del self._bytes[address]
+                return count
+
+
+class TokenBucket(object):
+    """ Allows events at rate per second on average, and bursts of up to burst
+    events at once
+    """
+
+    def __init__(self, rate, burst, now=0):
+        self.rate = float(rate)
+        self.burst = burst
+        self._tokens = float(burst)
+        self._lastUpdate = now
+
+    def consume(self, now):
+        """ Take a token for an event at now, return False if there is none left """
+        elapsed = max(0, now - self._lastUpdate)
+        self._tokens = min(self.burst, self._tokens + elapsed * self.rate)
+        self._lastUpdate = now
+        if self._tokens < 1:
+            return False
+        self._tokens -= 1
+        return True
+
+
+class SourceRateLimiter(object):
+    """ A token bucket for each source address
+
+    The buckets of at most size sources are kept, the least recently seen
+    source is forgotten to make room for a new one, which starts with a full
+    bucket.
+    """
+
+    def __init__(self, rate, burst, size=10000):
+        self.rate = rate
+        self.burst = burst
+        self.size = size
+        self._buckets = collections.OrderedDict()
+
+    def consume(self, address, now):
+        bucket = self._buckets.pop(address, None)
+        if bucket is None:
+            bucket = TokenBucket(self.rate, self.burst, now)
+            if len(self._buckets) >= self.size:
+                self._buckets.popitem(last=False)
+        self._buckets[address] = bucket
+        return bucket.consume(now)
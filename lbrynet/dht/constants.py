@@ -39,6 +39,20 @@ tokenSecretChangeInterval = 300  # 5 minutes
 
 peer_request_timeout = 10
 
+#: Number of lookups a batch of value lookups runs at once
+batchedLookupParallelism = 8
+
+#: Number of requests per second a single address may send on average, and in a burst;
+#: requests beyond this are dropped without a response
+rpcRateLimitPerSource = 50
+rpcBurstPerSource = 100
+#: Number of source addresses whose request rate is tracked at once
+rateLimitedSourcesTracked = 10000
+#: Number of store and findValue requests per second answered from all sources together;
+#: requests beyond this are answered with an error. 0 means no limit
+storeRateLimit = 100
+findValueRateLimit = 500
+
 ######## IMPLEMENTATION-SPECIFIC CONSTANTS ###########
 
 #: The interval in which the node should check its whether any buckets need refreshing,
@@ -49,6 +63,11 @@ checkRefreshInterval = refreshTimeout / 5
 #: be spread across several UDP packets.
 udpDatagramMaxSize = 8192  # 8 KB
 
+#: Seconds to wait for the rest of the packets of a message spread across several UDP
+#: packets, and the most bytes of such incomplete messages to keep
+partialMessageTimeout = 30
+partialMessagesMaxSize = 2 ** 20  # 1 MB
+
 from lbrynet.core.cryptoutils import get_lbry_hash_obj
 
 h = get_lbry_hash_obj()
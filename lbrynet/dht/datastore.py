@@ -8,6 +8,10 @@
 # may be created by processing this file with epydoc: http://epydoc.sf.net
 
 import UserDict
+import cPickle
+import heapq
+import os
+import sqlite3
 import time
 import constants
 
@@ -27,12 +31,22 @@ class DataStore(UserDict.DictMixin):
 
 
 class DictDataStore(DataStore):
-    """ A datastore using an in-memory Python dictionary """
+    """ A datastore using an in-memory Python dictionary
+
+    Each peer is stored once per key, a peer re-announcing a key refreshes its
+    existing entry. Entries are expired from a heap ordered by expiry time, so
+    expiring them costs time proportional to the number of expired entries.
+    """
 
     def __init__(self):
         # Dictionary format:
-        # { <key>: (<value>, <lastPublished>, <originallyPublished> <originalPublisherID>) }
+        # { <key>: { <compact address>: (<lastPublished>, <originallyPublished>,
+        #                                <originalPublisherID>) } }
         self._dict = {}
+        # heap of (<expiry time>, <key>, <compact address>), with one item per entry. Refreshed
+        # entries keep their old item until it is popped, then are pushed back with their new
+        # expiry time
+        self._expiryHeap = []
 
     def keys(self):
         """ Return a list of the keys in this data store """
@@ -40,15 +54,17 @@ class DictDataStore(DataStore):
 
     def removeExpiredPeers(self):
         now = int(time.time())
-
-        def notExpired(peer):
-            if (now - peer[2]) > constants.dataExpireTimeout:
-                return False
-            return True
-
-        for key in self._dict.keys():
-            unexpired_peers = filter(notExpired, self._dict[key])
-            self._dict[key] = unexpired_peers
+        while self._expiryHeap and self._expiryHeap[0][0] < now:
+            _, key, value = heapq.heappop(self._expiryHeap)
+            peers = self._dict[key]
+            expiryTime = peers[value][0] + constants.dataExpireTimeout
+            if expiryTime >= now:
+                # re-announced since this item was pushed
+                heapq.heappush(self._expiryHeap, (expiryTime, key, value))
+                continue
+            del peers[value]
+            if not peers:
+                del self._dict[key]
 
     def hasPeersForBlob(self, key):
         if key in self._dict and len(self._dict[key]) > 0:
@@ -56,11 +72,90 @@ class DictDataStore(DataStore):
         return False
 
     def addPeerToBlob(self, key, value, lastPublished, originallyPublished, originalPublisherID):
-        if key in self._dict:
-            self._dict[key].append((value, lastPublished, originallyPublished, originalPublisherID))
+        peers = self._dict.setdefault(key, {})
+        if value in peers:
+            previous = peers[value]
+            peers[value] = (max(lastPublished, previous[0]), previous[1], originalPublisherID)
         else:
-            self._dict[key] = [(value, lastPublished, originallyPublished, originalPublisherID)]
+            peers[value] = (lastPublished, originallyPublished, originalPublisherID)
+            heapq.heappush(self._expiryHeap,
+                           (lastPublished + constants.dataExpireTimeout, key, value))
 
     def getPeersForBlob(self, key):
         if key in self._dict:
-            return [val[0] for val in self._dict[key]]
+            return self._dict[key].keys()
+
+
+class SQLiteDataStore(DictDataStore):
+    """ A DictDataStore which is loaded from, and saved to, an SQLite database
+    so that the stored peers survive a restart of the node
+
+    Peers are served from memory as in DictDataStore, the database is only
+    written when save() is called. Items set on the data store (such as the
+    C{nodeState} the node saves its ID and contacts as) are saved along with
+    the peers.
+    """
+
+    def __init__(self, dbFile):
+        DictDataStore.__init__(self)
+        self._dbFile = dbFile
+        self._state = {}
+        if os.path.isfile(self._dbFile):
+            self._load()
+
+    def __getitem__(self, key):
+        return self._state[key]
+
+    def __setitem__(self, key, value):
+        self._state[key] = value
+
+    def __delitem__(self, key):
+        del self._state[key]
+
+    def __contains__(self, key):
+        return key in self._state
+
+    def save(self):
+        """ Write the stored peers and items to the database, replacing what
+        was previously saved """
+        peers = [
+            (sqlite3.Binary(key), sqlite3.Binary(value), lastPublished, originallyPublished,
+             sqlite3.Binary(originalPublisherID))
+            for key, values in self._dict.iteritems()
+            for value, (lastPublished, originallyPublished, originalPublisherID)
+            in values.iteritems()
+        ]
+        state = [
+            (key, sqlite3.Binary(cPickle.dumps(value, cPickle.HIGHEST_PROTOCOL)))
+            for key, value in self._state.iteritems()
+        ]
+        db = self._connect()
+        try:
+            with db:
+                db.execute("delete from peers")
+                db.executemany("insert into peers values (?, ?, ?, ?, ?)", peers)
+                db.execute("delete from state")
+                db.executemany("insert into state values (?, ?)", state)
+        finally:
+            db.close()
+
+    def _connect(self):
+        db = sqlite3.connect(self._dbFile)
+        db.execute("create table if not exists peers (key blob, value blob, "
+                   "lastPublished integer, originallyPublished integer, "
+                   "originalPublisherID blob)")
+        db.execute("create table if not exists state (key text primary key, value blob)")
+        return db
+
+    def _load(self):
+        db = self._connect()
+        try:
+            for key, value in db.execute("select key, value from state"):
+                self._state[key] = cPickle.loads(str(value))
+            for row in db.execute("select * from peers"):
+                key, value, lastPublished, originallyPublished, originalPublisherID = row
+                self.addPeerToBlob(str(key), str(value), lastPublished, originallyPublished,
+                                   str(originalPublisherID))
+        finally:
+            db.close()
+        self.removeExpiredPeers()
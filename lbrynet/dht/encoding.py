@@ -52,6 +52,10 @@ class Bencode(Encoding):
     @note: This algorithm differs from the "official" Bencode algorithm in
            that it can encode/decode floating point values in addition to
            integers.
+
+    Encoding appends the pieces of the output to a list which is joined once,
+    and decoding walks the data by offset rather than slicing off what is
+    left, so both take time linear in the size of the message.
     """
 
     def encode(self, data):
@@ -63,33 +67,9 @@ class Bencode(Encoding):
         @return: The encoded data
         @rtype: str
         """
-        if isinstance(data, (int, long)):
-            return 'i%de' % data
-        elif isinstance(data, str):
-            return '%d:%s' % (len(data), data)
-        elif isinstance(data, (list, tuple)):
-            encodedListItems = ''
-            for item in data:
-                encodedListItems += self.encode(item)
-            return 'l%se' % encodedListItems
-        elif isinstance(data, dict):
-            encodedDictItems = ''
-            keys = data.keys()
-            keys.sort()
-            for key in keys:
-                encodedDictItems += self.encode(key)
-                encodedDictItems += self.encode(data[key])
-            return 'd%se' % encodedDictItems
-        elif isinstance(data, float):
-            # This (float data type) is a non-standard extension to the original Bencode algorithm
-            return 'f%fe' % data
-        elif data is None:
-            # This (None/NULL data type) is a non-standard extension
-            # to the original Bencode algorithm
-            return 'n'
-        else:
-            print data
-            raise TypeError("Cannot bencode '%s' object" % type(data))
+        chunks = []
+        self._encodeRecursive(data, chunks)
+        return ''.join(chunks)
 
     def decode(self, data):
         """ Decoder implementation of the Bencode algorithm
@@ -107,48 +87,142 @@ class Bencode(Encoding):
             raise DecodeError('Cannot decode empty string')
         try:
             return self._decodeRecursive(data)[0]
-        except ValueError as e:
-            raise DecodeError(e.message)
+        except (ValueError, IndexError, KeyError, TypeError) as e:
+            raise DecodeError(str(e))
+
+    @staticmethod
+    def _encodeRecursive(data, chunks):
+        """ Append the encoded pieces of data to the list chunks
+
+        Do not call this; use C{encode()} instead
+        """
+        encoder = _encoders.get(type(data))
+        if encoder is None:
+            # subclasses of the supported types
+            if isinstance(data, (int, long)):
+                encoder = _encodeInt
+            elif isinstance(data, str):
+                encoder = _encodeStr
+            elif isinstance(data, (list, tuple)):
+                encoder = _encodeList
+            elif isinstance(data, dict):
+                encoder = _encodeDict
+            elif isinstance(data, float):
+                encoder = _encodeFloat
+            else:
+                raise TypeError("Cannot bencode '%s' object" % type(data))
+        encoder(data, chunks)
 
     @staticmethod
     def _decodeRecursive(data, startIndex=0):
         """ Actual implementation of the recursive Bencode algorithm
 
-        Do not call this; use C{decode()} instead
+        Returns the decoded value and the index just past it. Do not call
+        this; use C{decode()} instead
         """
-        if data[startIndex] == 'i':
-            endPos = data[startIndex:].find('e') + startIndex
-            return int(data[startIndex + 1:endPos]), endPos + 1
-        elif data[startIndex] == 'l':
-            startIndex += 1
-            decodedList = []
-            while data[startIndex] != 'e':
-                listData, startIndex = Bencode._decodeRecursive(data, startIndex)
-                decodedList.append(listData)
-            return decodedList, startIndex + 1
-        elif data[startIndex] == 'd':
-            startIndex += 1
-            decodedDict = {}
-            while data[startIndex] != 'e':
-                key, startIndex = Bencode._decodeRecursive(data, startIndex)
-                value, startIndex = Bencode._decodeRecursive(data, startIndex)
-                decodedDict[key] = value
-            return decodedDict, startIndex
-        elif data[startIndex] == 'f':
-            # This (float data type) is a non-standard extension to the original Bencode algorithm
-            endPos = data[startIndex:].find('e') + startIndex
-            return float(data[startIndex + 1:endPos]), endPos + 1
-        elif data[startIndex] == 'n':
-            # This (None/NULL data type) is a non-standard extension
-            # to the original Bencode algorithm
-            return None, startIndex + 1
-        else:
-            splitPos = data[startIndex:].find(':') + startIndex
-            try:
-                length = int(data[startIndex:splitPos])
-            except ValueError, e:
-                raise DecodeError, e
-            startIndex = splitPos + 1
-            endPos = startIndex + length
-            bytes = data[startIndex:endPos]
-            return bytes, endPos
+        return _decoders[data[startIndex]](data, startIndex)
+
+
+def _encodeInt(data, chunks):
+    chunks.append('i%de' % data)
+
+
+def _encodeStr(data, chunks):
+    chunks.append('%d:' % len(data))
+    chunks.append(data)
+
+
+def _encodeList(data, chunks):
+    chunks.append('l')
+    for item in data:
+        Bencode._encodeRecursive(item, chunks)
+    chunks.append('e')
+
+
+def _encodeDict(data, chunks):
+    chunks.append('d')
+    for key in sorted(data):
+        Bencode._encodeRecursive(key, chunks)
+        Bencode._encodeRecursive(data[key], chunks)
+    chunks.append('e')
+
+
+def _encodeFloat(data, chunks):
+    # This (float data type) is a non-standard extension to the original Bencode algorithm
+    chunks.append('f%fe' % data)
+
+
+def _encodeNone(data, chunks):
+    # This (None/NULL data type) is a non-standard extension
+    # to the original Bencode algorithm
+    chunks.append('n')
+
+
+_encoders = {
+    int: _encodeInt,
+    long: _encodeInt,
+    bool: _encodeInt,
+    str: _encodeStr,
+    list: _encodeList,
+    tuple: _encodeList,
+    dict: _encodeDict,
+    float: _encodeFloat,
+    type(None): _encodeNone,
+}
+
+
+def _decodeInt(data, startIndex):
+    endPos = data.index('e', startIndex)
+    return int(data[startIndex + 1:endPos]), endPos + 1
+
+
+def _decodeStr(data, startIndex):
+    splitPos = data.index(':', startIndex)
+    length = int(data[startIndex:splitPos])
+    startIndex = splitPos + 1
+    endPos = startIndex + length
+    if endPos > len(data):
+        raise ValueError("String of length %i runs past the end of the data" % length)
+    return data[startIndex:endPos], endPos
+
+
+def _decodeList(data, startIndex):
+    startIndex += 1
+    decodedList = []
+    while data[startIndex] != 'e':
+        listData, startIndex = _decoders[data[startIndex]](data, startIndex)
+        decodedList.append(listData)
+    return decodedList, startIndex + 1
+
+
+def _decodeDict(data, startIndex):
+    startIndex += 1
+    decodedDict = {}
+    while data[startIndex] != 'e':
+        key, startIndex = _decoders[data[startIndex]](data, startIndex)
+        value, startIndex = _decoders[data[startIndex]](data, startIndex)
+        decodedDict[key] = value
+    return decodedDict, startIndex + 1
+
+
+def _decodeFloat(data, startIndex):
+    # This (float data type) is a non-standard extension to the original Bencode algorithm
+    endPos = data.index('e', startIndex)
+    return float(data[startIndex + 1:endPos]), endPos + 1
+
+
+def _decodeNone(data, startIndex):
+    # This (None/NULL data type) is a non-standard extension
+    # to the original Bencode algorithm
+    return None, startIndex + 1
+
+
+_decoders = {
+    'i': _decodeInt,
+    'l': _decodeList,
+    'd': _decodeDict,
+    'f': _decodeFloat,
+    'n': _decodeNone,
+}
+for _digit in '0123456789':
+    _decoders[_digit] = _decodeStr
@@ -1,19 +1,33 @@
-from collections import Counter
-import datetime
+import collections
+import heapq
+import time
 
 
 class HashWatcher(object):
-    def __init__(self):
-        self.ttl = 600
-        self.hashes = []
+    """ Counts the distinct nodes which asked for each hash within the last ttl seconds
+
+    Requests are grouped into buckets of bucket_width seconds. Every (hash,
+    requester) pair is kept once, in the bucket it was last seen in, and
+    counted once for its hash. When a bucket gets older than ttl, the pairs
+    which weren't seen again since are dropped, so each request is only ever
+    expired once and adding one never costs more than a dictionary update.
+    """
+
+    def __init__(self, ttl=600, bucket_width=10):
+        self.ttl = ttl
+        self.bucket_width = bucket_width
         self.next_tick = None
+        # [(bucket number, [(hash, requester ip)])], oldest first
+        self._buckets = collections.deque()
+        self._last_seen = {}  # {(hash, requester ip): bucket number}
+        self._counts = {}  # {hash: number of requesters}
 
     def tick(self):
 
         from twisted.internet import reactor
 
         self._remove_old_hashes()
-        self.next_tick = reactor.callLater(10, self.tick)
+        self.next_tick = reactor.callLater(self.bucket_width, self.tick)
 
     def stop(self):
         if self.next_tick is not None:
@@ -21,15 +35,37 @@ class HashWatcher(object):
             self.next_tick = None
 
     def add_requested_hash(self, hashsum, contact):
-        from_ip = contact.compact_ip
-        matching_hashes = [h for h in self.hashes if h[0] == hashsum and h[2] == from_ip]
-        if len(matching_hashes) == 0:
-            self.hashes.append((hashsum, datetime.datetime.now(), from_ip))
+        self._add(hashsum, contact.compact_ip(), time.time())
 
     def most_popular_hashes(self, num_to_return=10):
-        hash_counter = Counter([h[0] for h in self.hashes])
-        return hash_counter.most_common(num_to_return)
+        """ Return a list of (hash, number of requesters), most requested first """
+        self._remove_old_hashes()
+        return heapq.nlargest(num_to_return, self._counts.iteritems(), key=lambda item: item[1])
+
+    def _add(self, hashsum, from_ip, now):
+        bucket = int(now / self.bucket_width)
+        self._remove_old_hashes(now)
+        if not self._buckets or self._buckets[-1][0] != bucket:
+            self._buckets.append((bucket, []))
+        key = (hashsum, from_ip)
+        if key not in self._last_seen:
+            self._counts[hashsum] = self._counts.get(hashsum, 0) + 1
+        elif self._last_seen[key] == bucket:
+            return
+        self._last_seen[key] = bucket
+        self._buckets[-1][1].append(key)
 
-    def _remove_old_hashes(self):
-        remove_time = datetime.datetime.now() - datetime.timedelta(minutes=10)
-        self.hashes = [h for h in self.hashes if h[1] < remove_time]
+    def _remove_old_hashes(self, now=None):
+        if now is None:
+            now = time.time()
+        oldest = int((now - self.ttl) / self.bucket_width)
+        while self._buckets and self._buckets[0][0] < oldest:
+            bucket, keys = self._buckets.popleft()
+            for key in keys:
+                # the request may have been seen again in a newer bucket
+                if self._last_seen.get(key) == bucket:
+                    del self._last_seen[key]
+                    hashsum = key[0]
+                    self._counts[hashsum] -= 1
+                    if not self._counts[hashsum]:
+                        del self._counts[hashsum]
@@ -14,6 +14,17 @@ class BucketFull(Exception):
     """ Raised when the bucket is full """
 
 
+def keyToLong(key):
+    """ Returns the integer value of a key (or node ID)
+
+    @param key: The key, as a binary string or an integer
+    @type key: str or int
+    """
+    if isinstance(key, str):
+        return long(key.encode('hex'), 16)
+    return key
+
+
 class KBucket(object):
     """ Description - later
     """
@@ -28,7 +39,10 @@ class KBucket(object):
         self.lastAccessed = 0
         self.rangeMin = rangeMin
         self.rangeMax = rangeMax
+        # the contacts, least recently seen first
         self._contacts = list()
+        # the same contacts, by the integer value of their node ID
+        self._contactsByID = {}
 
     def addContact(self, contact):
         """ Add contact to _contact list in the right order. This will move the
@@ -41,21 +55,31 @@ class KBucket(object):
         @param contact: The contact to add
         @type contact: kademlia.contact.Contact
         """
-        if contact in self._contacts:
+        contactKey = keyToLong(contact.id)
+        if contactKey in self._contactsByID:
             # Move the existing contact to the end of the list
             # - using the new contact to allow add-on data
             #   (e.g. optimization-specific stuff) to pe updated as well
-            self._contacts.remove(contact)
-            self._contacts.append(contact)
-        elif len(self._contacts) < constants.k:
-            self._contacts.append(contact)
-        else:
+            self._contacts.remove(self._contactsByID[contactKey])
+        elif len(self._contacts) >= constants.k:
             raise BucketFull("No space in bucket to insert contact")
+        self._contacts.append(contact)
+        self._contactsByID[contactKey] = contact
 
     def getContact(self, contactID):
-        """ Get the contact specified node ID"""
-        index = self._contacts.index(contactID)
-        return self._contacts[index]
+        """ Get the contact specified node ID
+
+        @raise ValueError: The specified contact is not in this bucket
+        """
+        try:
+            return self._contactsByID[keyToLong(contactID)]
+        except KeyError:
+            raise ValueError("No contact with the specified ID in this bucket")
+
+    def iterContactsByID(self):
+        """ Iterate over (integer node ID, contact) pairs of the contacts in
+        this bucket, in no particular order """
+        return self._contactsByID.iteritems()
 
     def getContacts(self, count=-1, excludeContact=None):
         """ Returns a list containing up to the first count number of contacts
@@ -114,7 +138,9 @@ class KBucket(object):
 
         @raise ValueError: The specified contact is not in this bucket
         """
-        self._contacts.remove(contact)
+        contactID = contact if isinstance(contact, (str, int, long)) else contact.id
+        self._contacts.remove(self.getContact(contactID))
+        del self._contactsByID[keyToLong(contactID)]
 
     def keyInRange(self, key):
         """ Tests whether the specified key (i.e. node ID) is in the range
@@ -129,9 +155,7 @@ class KBucket(object):
                  if not.
         @rtype: bool
         """
-        if isinstance(key, str):
-            key = long(key.encode('hex'), 16)
-        return self.rangeMin <= key < self.rangeMax
+        return self.rangeMin <= keyToLong(key) < self.rangeMax
 
     def __len__(self):
         return len(self._contacts)
@@ -7,12 +7,15 @@
 # The docstrings in this module contain epytext markup; API documentation
 # may be created by processing this file with epydoc: http://epydoc.sf.net
 import binascii
+import bisect
+import collections
 import hashlib
-import operator
+import heapq
 import struct
 import time
 
-from twisted.internet import defer, error, reactor, threads
+from twisted.internet import defer, error, reactor
+from twisted.python.failure import Failure
 
 import constants
 import routingtable
@@ -51,7 +54,7 @@ class Node(object):
 
     def __init__(self, id=None, udpPort=4000, dataStore=None,
                  routingTableClass=None, networkProtocol=None, lbryid=None,
-                 externalIP=None):
+                 externalIP=None, iterativeFindHelperClass=None):
         """
         @param dataStore: The data store to use. This must be class inheriting
                           from the C{DataStore} interface (or providing the
@@ -73,6 +76,12 @@ class Node(object):
                                 change the format of the physical RPC messages
                                 being transmitted.
         @type networkProtocol: entangled.kademlia.protocol.KademliaProtocol
+        @param iterativeFindHelperClass: The class which carries out the
+                                         iterations of an iterative lookup,
+                                         this can be overridden to (for
+                                         example) record how each contact
+                                         was found.
+        @type iterativeFindHelperClass: _IterativeFindHelper
         """
         if id != None:
             self.id = id
@@ -89,6 +98,17 @@ class Node(object):
         self._joinDeferred = None
         self.next_refresh_call = None
         self.next_change_token_call = None
+        # Initialize the data storage mechanism used by this node
+        state = None
+        if dataStore is None:
+            self._dataStore = datastore.DictDataStore()
+        else:
+            self._dataStore = dataStore
+            # Try to restore the node's state...
+            if 'nodeState' in self._dataStore:
+                state = self._dataStore['nodeState']
+                if id is None:
+                    self.id = state['id']
         # Create k-buckets (for storing contacts)
         if routingTableClass is None:
             self._routingTable = routingtable.OptimizedTreeRoutingTable(self.id)
@@ -100,22 +120,15 @@ class Node(object):
             self._protocol = protocol.KademliaProtocol(self)
         else:
             self._protocol = networkProtocol
-        # Initialize the data storage mechanism used by this node
+        self._iterativeFindHelperClass = iterativeFindHelperClass or _IterativeFindHelper
         self.token_secret = self._generateID()
         self.old_token_secret = None
         self.change_token()
-        if dataStore is None:
-            self._dataStore = datastore.DictDataStore()
-        else:
-            self._dataStore = dataStore
-            # Try to restore the node's state...
-            if 'nodeState' in self._dataStore:
-                state = self._dataStore['nodeState']
-                self.id = state['id']
-                for contactTriple in state['closestNodes']:
-                    contact = Contact(
-                        contactTriple[0], contactTriple[1], contactTriple[2], self._protocol)
-                    self._routingTable.addContact(contact)
+        if state is not None:
+            for contactTriple in state['closestNodes']:
+                contact = Contact(
+                    contactTriple[0], contactTriple[1], contactTriple[2], self._protocol)
+                self._routingTable.addContact(contact)
         self.externalIP = externalIP
         self.hash_watcher = HashWatcher()
 
@@ -134,6 +147,21 @@ class Node(object):
         if self._listeningPort is not None:
             self._listeningPort.stopListening()
         self.hash_watcher.stop()
+        self._persistState()
+
+    def _persistState(self):
+        """ Save this node's ID and contacts, along with the stored peers, if the
+        data store can be saved """
+        if not hasattr(self._dataStore, 'save'):
+            return
+        contacts = []
+        for bucket in self._routingTable._buckets:
+            contacts.extend((c.id, c.address, c.port) for c in bucket._contacts)
+        self._dataStore['nodeState'] = {'id': self.id, 'closestNodes': contacts}
+        try:
+            self._dataStore.save()
+        except Exception:
+            log.exception("Failed to save the DHT node state")
 
     @defer.inlineCallbacks
     def joinNetwork(self, knownNodeAddresses=None):
@@ -157,7 +185,9 @@ class Node(object):
         # IGNORE:E1101
         # Create temporary contact information for the list of addresses of known nodes
         if knownNodeAddresses != None:
-            bootstrapContacts = []
+            # start with the closest contacts restored from a previous run, if any, since
+            # they are likely to know about the nodes close to this one
+            bootstrapContacts = self._routingTable.findCloseNodes(self.id, constants.k)
             for address, port in knownNodeAddresses:
                 contact = Contact(self._generateID(), address, port, self._protocol)
                 bootstrapContacts.append(contact)
@@ -202,37 +232,79 @@ class Node(object):
     def announceHaveBlob(self, key, port):
         return self.iterativeAnnounceHaveBlob(key, {'port': port, 'lbryid': self.lbryid})
 
-    def getPeersForBlob(self, blob_hash):
-        def expand_and_filter(result):
-            expanded_peers = []
-            if isinstance(result, dict):
-                if blob_hash in result:
-                    for peer in result[blob_hash]:
-                        if self.lbryid != peer[6:]:
-                            host = ".".join([str(ord(d)) for d in peer[:4]])
-                            if host == "127.0.0.1":
-                                if "from_peer" in result:
-                                    if result["from_peer"] != "self":
-                                        host = result["from_peer"]
-                            port, = struct.unpack('>H', peer[4:6])
-                            expanded_peers.append((host, port))
-            return expanded_peers
-
-        def find_failed(err):
-            return []
+    def announceHaveBlobs(self, keys, port, parallelism=None):
+        """ Announce many blobs at once, see C{iterativeAnnounceHaveBlobs}
 
+        @return: a dictionary of key to the deferred of its announcement
+        @rtype: dict
+        """
+        return self.iterativeAnnounceHaveBlobs(keys, {'port': port, 'lbryid': self.lbryid},
+                                               parallelism)
+
+    def getPeersForBlob(self, blob_hash):
         d = self.iterativeFindValue(blob_hash)
-        d.addCallbacks(expand_and_filter, find_failed)
+        d.addCallbacks(self._expandPeers, lambda err: [], callbackArgs=(blob_hash,))
         return d
 
+    def getPeersForBlobs(self, blob_hashes):
+        """ Find the peers for many blobs at once, sharing the nodes found
+        while looking up each blob with the lookups of the others
+
+        @return: a dictionary of blob hash to a deferred which fires with the
+                 (host, port) of the peers for that blob, or fails if its
+                 lookup failed, so that this can be told apart from a blob
+                 which has no peers
+        @rtype: dict
+        """
+        lookups = self.iterativeFindValues(blob_hashes)
+        for blob_hash, d in lookups.iteritems():
+            d.addCallback(self._expandPeers, blob_hash)
+        return lookups
+
+    def _expandPeers(self, result, blob_hash):
+        expanded_peers = []
+        if isinstance(result, dict):
+            if blob_hash in result:
+                for peer in result[blob_hash]:
+                    if self.lbryid != peer[6:]:
+                        host = ".".join([str(ord(d)) for d in peer[:4]])
+                        if host == "127.0.0.1":
+                            if "from_peer" in result:
+                                if result["from_peer"] != "self":
+                                    host = result["from_peer"]
+                        port, = struct.unpack('>H', peer[4:6])
+                        expanded_peers.append((host, port))
+        return expanded_peers
+
     def get_most_popular_hashes(self, num_to_return):
         return self.hash_watcher.most_popular_hashes(num_to_return)
 
     def get_bandwidth_stats(self):
         return self._protocol.bandwidth_stats
 
-    def iterativeAnnounceHaveBlob(self, blob_hash, value):
+    def iterativeAnnounceHaveBlobs(self, blob_hashes, value, parallelism=None):
+        """ Run C{iterativeAnnounceHaveBlob} for many blob hashes as one batch
+
+        Like C{iterativeFindValues}, the hashes are announced in order and
+        the lookup for the nodes to store each one at starts from the nodes
+        which answered the lookups for the hashes before it, so hashes whose
+        closest nodes overlap mostly reuse the same findNode results.
+
+        @param parallelism: the number of announcements to run at once,
+                            C{constants.batchedLookupParallelism} by default
+        @type parallelism: int
+
+        @return: a dictionary of blob hash to the deferred of its announcement
+        @rtype: dict
+        """
+        batch = _BatchedAnnounce(self, blob_hashes, value, parallelism)
+        batch.start()
+        return batch.results
+
+    def iterativeAnnounceHaveBlob(self, blob_hash, value, _batch=None):
         known_nodes = {}
+        # the token is added to the value per node it is stored at
+        value = dict(value)
 
         def log_error(err, n):
             if err.check(protocol.TimeoutError):
@@ -288,7 +360,7 @@ class Node(object):
                 ds.append(df)
             return defer.DeferredList(ds)
 
-        d = self.iterativeFindNode(blob_hash)
+        d = self._iterativeFind(blob_hash, batch=_batch)
         d.addCallbacks(requestPeers)
         return d
 
@@ -330,13 +402,16 @@ class Node(object):
         return self._iterativeFind(key)
 
     @defer.inlineCallbacks
-    def iterativeFindValue(self, key):
+    def iterativeFindValue(self, key, _batch=None):
         """ The Kademlia search operation (deterministic)
 
         Call this to retrieve data from the DHT.
 
         @param key: the n-bit key (i.e. the value ID) to search for
         @type key: str
+        @param _batch: the batch of lookups this one is part of, if any (see
+                       C{iterativeFindValues})
+        @type _batch: _LookupBatch
 
         @return: This immediately returns a deferred object, which will return
                  either one of two things:
@@ -373,11 +448,34 @@ class Node(object):
                     outerDf.callback(result)
 
         # Execute the search
-        iterative_find_result = yield self._iterativeFind(key, rpc='findValue')
+        iterative_find_result = yield self._iterativeFind(key, rpc='findValue', batch=_batch)
         checkResult(iterative_find_result)
         result = yield outerDf
         defer.returnValue(result)
 
+    def iterativeFindValues(self, keys):
+        """ Run C{iterativeFindValue} for many keys as one batch
+
+        The keys are looked up in order, so that keys which are close to each
+        other are searched for one after another, with at most
+        C{constants.batchedLookupParallelism} lookups running at once. Every
+        node which answers one of the lookups is remembered for the rest of
+        the batch, and each lookup starts from the remembered nodes closest to
+        its key as well as those from the routing table. This way the lookups
+        don't each walk through the same far away nodes to get to the region
+        of the network their key is in, which is most of the traffic of a lookup.
+
+        @param keys: the n-bit keys to search for
+        @type keys: list
+
+        @return: a dictionary of key to a deferred which fires with the result
+                 C{iterativeFindValue} would have given for that key
+        @rtype: dict
+        """
+        batch = _BatchedFindValue(self, keys)
+        batch.start()
+        return batch.results
+
     def addContact(self, contact):
         """ Add/update the given contact; simple wrapper for the same method
         in this object's RoutingTable object
@@ -433,7 +531,7 @@ class Node(object):
         return 'pong'
 
     @rpcmethod
-    def store(self, key, value, originalPublisherID=None, self_store=False, **kwargs):
+    def store(self, key, value, originalPublisherID=None, age=0, **kwargs):
         """ Store the received data in this node's local hash table
 
         @param key: The hashtable key of the data
@@ -448,6 +546,11 @@ class Node(object):
                     isn't actually given, to compensate for clock skew between
                     different nodes.
         @type age: int
+        @param self_store: Whether this node is storing itself as a peer for
+                           C{key}, which needs no token. Only honoured for
+                           local calls, never for ones received over the
+                           network.
+        @type self_store: bool
 
         @rtype: str
 
@@ -455,6 +558,9 @@ class Node(object):
                (which is the case currently) might not be a good idea... will have
                to fix this (perhaps use a stream from the Protocol class?)
         """
+        # a store received over the network always needs a valid token
+        self_store = kwargs.get('self_store', False) and '_rpcNodeContact' not in kwargs
+
         # Get the sender's ID (if any)
         if originalPublisherID is None:
             if '_rpcNodeID' in kwargs:
@@ -462,7 +568,7 @@ class Node(object):
             else:
                 raise TypeError, 'No NodeID given. Therefore we can\'t store this node'
 
-        if self_store is True and self.externalIP:
+        if self_store and self.externalIP:
             contact = Contact(self.id, self.externalIP, self.port, None, None)
             compact_ip = contact.compact_ip()
         elif '_rpcNodeContact' in kwargs:
@@ -472,7 +578,7 @@ class Node(object):
             return 'Not OK'
             # raise TypeError, 'No contact info available'
 
-        if ((self_store is False) and
+        if ((not self_store) and
                 ('token' not in value or not self.verify_token(value['token'], compact_ip))):
             raise ValueError('Invalid or missing token')
 
@@ -558,7 +664,7 @@ class Node(object):
         return generate_id()
 
     @defer.inlineCallbacks
-    def _iterativeFind(self, key, startupShortlist=None, rpc='findNode'):
+    def _iterativeFind(self, key, startupShortlist=None, rpc='findNode', batch=None):
         """ The basic Kademlia iterative lookup operation (for nodes/values)
 
         This builds a list of k "closest" contacts through iterative use of
@@ -579,6 +685,10 @@ class Node(object):
                     other operations that piggy-back on the basic Kademlia
                     lookup operation (Entangled's "delete" RPC, for instance).
         @type rpc: str
+        @param batch: the batch of lookups this one is part of, the nodes
+                      which answered the other lookups in it are also used
+                      to start this one
+        @type batch: _LookupBatch
 
         @return: If C{findValue} is C{True}, the algorithm will stop as soon
                  as a data value for C{key} is found, and return a dictionary
@@ -589,7 +699,11 @@ class Node(object):
         findValue = rpc != 'findNode'
 
         if startupShortlist is None:
-            shortlist = self._routingTable.findCloseNodes(key, constants.alpha)
+            shortlist = self._routingTable.findCloseNodes(key, constants.k)
+            if batch is not None:
+                for contact in batch.findCloseContacts(key, constants.k):
+                    if contact not in shortlist:
+                        shortlist.append(contact)
             if key != self.id:
                 # Update the "last accessed" timestamp for the appropriate k-bucket
                 self._routingTable.touchKBucket(key)
@@ -605,7 +719,8 @@ class Node(object):
 
         outerDf = defer.Deferred()
 
-        helper = _IterativeFindHelper(self, outerDf, shortlist, key, findValue, rpc)
+        helper = self._iterativeFindHelperClass(self, outerDf, shortlist, key, findValue, rpc,
+                                                batch)
         # Start the iterations
         helper.searchIteration()
         result = yield outerDf
@@ -642,7 +757,9 @@ class Node(object):
 
     # args put here because _refreshRoutingTable does outerDF.callback(None)
     def _removeExpiredPeers(self, *args):
-        df = threads.deferToThread(self._dataStore.removeExpiredPeers)
+        # only the expired peers are visited, so this is cheap enough for the reactor thread,
+        # which is the only one the data store may be modified from
+        df = defer.maybeDeferred(self._dataStore.removeExpiredPeers)
         return df
 
 
@@ -652,32 +769,41 @@ class Node(object):
 class _IterativeFindHelper(object):
     # TODO: use polymorphism to search for a value or node
     #       instead of using a find_value flag
-    def __init__(self, node, outer_d, shortlist, key, find_value, rpc):
+    def __init__(self, node, outer_d, shortlist, key, find_value, rpc, batch=None):
         self.node = node
         self.outer_d = outer_d
-        self.shortlist = shortlist
         self.key = key
         self.find_value = find_value
         self.rpc = rpc
+        self.batch = batch
         # all distance operations in this class only care about the distance
         # to self.key, so this makes it easier to calculate those
         self.distance = Distance(key)
-        # List of active queries; len() indicates number of active probes
-        #
-        # n.b: using lists for these variables, because Python doesn't
-        #   allow binding a new value to a name in an enclosing
-        #   (non-global) scope
-        self.active_probes = []
-        # List of contact IDs that have already been queried
-        self.already_contacted = []
-        # Probes that were active during the previous iteration
-        # A list of found and known-to-be-active remote nodes
+        # The distance to self.key of every contact seen, by contact ID; each
+        # distance is only calculated once
+        self.distances = {}
+        # The known contacts, by contact ID
+        self.shortlist = {}
+        # (distance, contact ID) of the shortlisted contacts which haven't been
+        # contacted yet, as a heap so the closest is always first
+        self.candidates = []
+        # Number of active queries
+        self.active_probes = 0
+        # IDs of the contacts that have already been queried
+        self.already_contacted = set()
+        # The found and known-to-be-active remote nodes, closest first, and
+        # their distances and IDs
         self.active_contacts = []
+        self.active_distances = []
+        self.active_contact_ids = set()
         # This should only contain one entry; the next scheduled iteration call
         self.pending_iteration_calls = []
-        self.prev_closest_node = [None]
+        self.prev_closest_node = None
         self.find_value_result = {}
-        self.slow_node_count = [0]
+        # Probes that were active during the previous iteration
+        self.slow_node_count = 0
+        for contact in shortlist:
+            self._addToShortlist(contact)
 
     def extendShortlist(self, responseTuple):
         """ @type responseMsg: kademlia.msgtypes.ResponseMessage """
@@ -686,16 +812,17 @@ class _IterativeFindHelper(object):
         responseMsg = responseTuple[0]
         originAddress = responseTuple[1]  # tuple: (ip adress, udp port)
         # Make sure the responding node is valid, and abort the operation if it isn't
-        if responseMsg.nodeID in self.active_contacts or responseMsg.nodeID == self.node.id:
+        if responseMsg.nodeID in self.active_contact_ids or responseMsg.nodeID == self.node.id:
             return responseMsg.nodeID
 
         # Mark this node as active
         aContact = self._getActiveContact(responseMsg, originAddress)
-        self.active_contacts.append(aContact)
+        self._addActiveContact(aContact)
+        if self.batch is not None:
+            self.batch.addContact(aContact)
 
         # This makes sure "bootstrap"-nodes with "fake" IDs don't get queried twice
-        if responseMsg.nodeID not in self.already_contacted:
-            self.already_contacted.append(responseMsg.nodeID)
+        self.already_contacted.add(responseMsg.nodeID)
 
         # Now grow extend the (unverified) shortlist with the returned contacts
         result = responseMsg.response
@@ -715,13 +842,30 @@ class _IterativeFindHelper(object):
     def _getActiveContact(self, responseMsg, originAddress):
         if responseMsg.nodeID in self.shortlist:
             # Get the contact information from the shortlist...
-            return self.shortlist[self.shortlist.index(responseMsg.nodeID)]
+            return self.shortlist[responseMsg.nodeID]
         else:
             # If it's not in the shortlist; we probably used a fake ID to reach it
             # - reconstruct the contact, using the real node ID this time
             return Contact(
                 responseMsg.nodeID, originAddress[0], originAddress[1], self.node._protocol)
 
+    def _getDistance(self, contactID):
+        if contactID not in self.distances:
+            self.distances[contactID] = self.distance(contactID)
+        return self.distances[contactID]
+
+    def _addToShortlist(self, contact):
+        self.shortlist[contact.id] = contact
+        if contact.id not in self.already_contacted:
+            heapq.heappush(self.candidates, (self._getDistance(contact.id), contact.id))
+
+    def _addActiveContact(self, contact):
+        distance = self._getDistance(contact.id)
+        index = bisect.bisect(self.active_distances, distance)
+        self.active_distances.insert(index, distance)
+        self.active_contacts.insert(index, contact)
+        self.active_contact_ids.add(contact.id)
+
     def _keepSearching(self, result):
         contactTriples = self._getContactTriples(result)
         for contactTriple in contactTriples:
@@ -743,40 +887,41 @@ class _IterativeFindHelper(object):
             self.find_value_result['closestNodeNoValue'] = aContact
 
     def _is_closer(self, responseMsg):
-        return self.distance.is_closer(responseMsg.nodeID, self.active_contacts[0].id)
+        return self._getDistance(responseMsg.nodeID) < self.active_distances[0]
 
     def _addIfValid(self, contactTriple):
         if isinstance(contactTriple, (list, tuple)) and len(contactTriple) == 3:
-            testContact = Contact(
-                contactTriple[0], contactTriple[1], contactTriple[2], self.node._protocol)
-            if testContact not in self.shortlist:
-                self.shortlist.append(testContact)
+            if contactTriple[0] not in self.shortlist:
+                self._addToShortlist(Contact(
+                    contactTriple[0], contactTriple[1], contactTriple[2], self.node._protocol))
 
     def removeFromShortlist(self, failure):
         """ @type failure: twisted.python.failure.Failure """
         failure.trap(protocol.TimeoutError)
         deadContactID = failure.getErrorMessage()
-        if deadContactID in self.shortlist:
-            self.shortlist.remove(deadContactID)
+        self.shortlist.pop(deadContactID, None)
         return deadContactID
 
     def cancelActiveProbe(self, contactID):
-        self.active_probes.pop()
-        if len(self.active_probes) <= constants.alpha / 2 and len(self.pending_iteration_calls):
+        self.active_probes -= 1
+        if self.active_probes <= constants.alpha / 2 and len(self.pending_iteration_calls):
             # Force the iteration
             self.pending_iteration_calls[0].cancel()
             del self.pending_iteration_calls[0]
             self.searchIteration()
 
-    def sortByDistance(self, contact_list):
-        """Sort the list of contacts in order by distance from key"""
-        ExpensiveSort(contact_list, self.distance.to_contact).sort()
+    def _nextCandidate(self):
+        """ Pop the closest shortlisted contact which hasn't been contacted yet """
+        while self.candidates:
+            contactID = heapq.heappop(self.candidates)[1]
+            # contacts which timed out have been removed from the shortlist since they were pushed
+            if contactID not in self.already_contacted and contactID in self.shortlist:
+                return self.shortlist[contactID]
+        return None
 
     # Send parallel, asynchronous FIND_NODE RPCs to the shortlist of contacts
     def searchIteration(self):
-        self.slow_node_count[0] = len(self.active_probes)
-        # Sort the discovered active nodes from closest to furthest
-        self.sortByDistance(self.active_contacts)
+        self.slow_node_count = self.active_probes
         # This makes sure a returning probe doesn't force calling this function by mistake
         while len(self.pending_iteration_calls):
             del self.pending_iteration_calls[0]
@@ -796,17 +941,16 @@ class _IterativeFindHelper(object):
 
         # The search continues...
         if len(self.active_contacts):
-            self.prev_closest_node[0] = self.active_contacts[0]
+            self.prev_closest_node = self.active_contacts[0]
         contactedNow = 0
-        self.sortByDistance(self.shortlist)
         # Store the current shortList length before contacting other nodes
         prevShortlistLength = len(self.shortlist)
-        for contact in self.shortlist:
-            if contact.id not in self.already_contacted:
-                self._probeContact(contact)
-                contactedNow += 1
-            if contactedNow == constants.alpha:
+        while contactedNow < constants.alpha:
+            contact = self._nextCandidate()
+            if contact is None:
                 break
+            self._probeContact(contact)
+            contactedNow += 1
         if self._should_lookup_active_calls():
             # Schedule the next iteration if there are any active
             # calls (Kademlia uses loose parallelism)
@@ -821,22 +965,22 @@ class _IterativeFindHelper(object):
             self.outer_d.callback(self.active_contacts)
 
     def _probeContact(self, contact):
-        self.active_probes.append(contact.id)
+        self.active_probes += 1
+        self.already_contacted.add(contact.id)
         rpcMethod = getattr(contact, self.rpc)
         df = rpcMethod(self.key, rawResponse=True)
         df.addCallback(self.extendShortlist)
         df.addErrback(self.removeFromShortlist)
         df.addCallback(self.cancelActiveProbe)
         df.addErrback(lambda _: log.exception('Failed to contact %s', contact))
-        self.already_contacted.append(contact.id)
 
     def _should_lookup_active_calls(self):
         return (
-            len(self.active_probes) > self.slow_node_count[0] or
+            self.active_probes > self.slow_node_count or
             (
                 len(self.shortlist) < constants.k and
                 len(self.active_contacts) < len(self.shortlist) and
-                len(self.active_probes) > 0
+                self.active_probes > 0
             )
         )
 
@@ -844,12 +988,81 @@ class _IterativeFindHelper(object):
         return (
             len(self.active_contacts) >= constants.k or
             (
-                self.active_contacts[0] == self.prev_closest_node[0] and
-                len(self.active_probes) == self.slow_node_count[0]
+                self.active_contacts[0] == self.prev_closest_node and
+                self.active_probes == self.slow_node_count
             )
         )
 
 
+class _LookupBatch(object):
+    """ The state shared by a batch of lookups for many keys
+
+    Subclasses run the lookup for a single key in C{_lookup}, passing the
+    batch on to C{Node._iterativeFind}, which adds the nodes that answer to it.
+    """
+
+    def __init__(self, node, keys, parallelism=None):
+        self.node = node
+        self.parallelism = parallelism or constants.batchedLookupParallelism
+        self.results = {key: defer.Deferred() for key in keys}
+        # looking keys up in order means consecutive lookups are for nearby keys
+        self._pending = collections.deque(sorted(self.results))
+        # nodes which have answered any of the lookups, by node id
+        self._contacts = {}
+
+    def start(self):
+        for _ in range(self.parallelism):
+            self._lookupNext()
+
+    def addContact(self, contact):
+        self._contacts[contact.id] = contact
+
+    def findCloseContacts(self, key, count):
+        distance = Distance(key)
+        return heapq.nsmallest(count, self._contacts.itervalues(), key=distance.to_contact)
+
+    def _lookup(self, key):
+        raise NotImplementedError()
+
+    def _lookupNext(self):
+        # skip the keys the caller has given up on (cancelled) before their lookup started
+        while self._pending and self.results[self._pending[0]].called:
+            self._pending.popleft()
+        if not self._pending:
+            return
+        key = self._pending.popleft()
+        d = self._lookup(key)
+        d.addBoth(self._lookupFinished, key)
+
+    def _lookupFinished(self, result, key):
+        d = self.results[key]
+        # the caller may have given up on this key already
+        if not d.called:
+            if isinstance(result, Failure):
+                d.errback(result)
+            else:
+                d.callback(result)
+        self._lookupNext()
+
+
+class _BatchedFindValue(_LookupBatch):
+    """ The state shared by the lookups of C{Node.iterativeFindValues} """
+
+    def _lookup(self, key):
+        return self.node.iterativeFindValue(key, _batch=self)
+
+
+class _BatchedAnnounce(_LookupBatch):
+    """ The state shared by the announcements of C{Node.iterativeAnnounceHaveBlobs} """
+
+    def __init__(self, node, keys, value, parallelism=None):
+        _LookupBatch.__init__(self, node, keys, parallelism)
+        self.value = value
+
+    def _lookup(self, key):
+        return self.node.iterativeAnnounceHaveBlob(key, self.value, _batch=self)
+
+
 class Distance(object):
     """Calculate the XOR result between two string variables.
 
@@ -872,38 +1085,3 @@ class Distance(object):
     def to_contact(self, contact):
         """A convenience function for calculating the distance to a contact"""
         return self(contact.id)
-
-
-class ExpensiveSort(object):
-    """Sort a list in place.
-
-    The result of `key(item)` is cached for each item in the `to_sort`
-    list as an optimization.  This can be useful when `key` is
-    expensive.
-
-    Attributes:
-        to_sort: a list of items to sort
-        key: callable, like `key` in normal python sort
-        attr: the attribute name used to cache the value on each item.
-    """
-
-    def __init__(self, to_sort, key, attr='__value'):
-        self.to_sort = to_sort
-        self.key = key
-        self.attr = attr
-
-    def sort(self):
-        self._cacheValues()
-        self._sortByValue()
-        self._removeValue()
-
-    def _cacheValues(self):
-        for item in self.to_sort:
-            setattr(item, self.attr, self.key(item))
-
-    def _sortByValue(self):
-        self.to_sort.sort(key=operator.attrgetter(self.attr))
-
-    def _removeValue(self):
-        for item in self.to_sort:
-            delattr(item, self.attr)
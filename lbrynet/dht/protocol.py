@@ -13,13 +13,15 @@ import time
 import socket
 import errno
 
-from twisted.internet import protocol, defer, error, reactor, task
+from twisted.internet import protocol, defer, error, reactor
 from twisted.python import failure
 
 import constants
 import encoding
 import msgtypes
 import msgformat
+import bandwidth
+import reassembly
 from contact import Contact
 
 log = logging.getLogger(__name__)
@@ -36,6 +38,10 @@ class TimeoutError(Exception):
         self.remote_contact_id = remote_contact_id
 
 
+class RateLimitError(Exception):
+    """ Sent instead of a response when a node is answering too many requests """
+
+
 class Delay(object):
     maxToSendDelay = 10 ** -3  # 0.05
     minToSendDelay = 10 ** -5  # 0.01
@@ -60,86 +66,84 @@ class Delay(object):
 class KademliaProtocol(protocol.DatagramProtocol):
     """ Implements all low-level network-related functions of a Kademlia node """
 
-    msgSizeLimit = constants.udpDatagramMaxSize - 26
+    # RPC IDs are digests of the same hash as node IDs
+    msgIDLength = constants.key_bits / 8
+    # length of the header of a packet of a message spread over several packets
+    packetHeaderLength = msgIDLength + 6
+    msgSizeLimit = constants.udpDatagramMaxSize - packetHeaderLength
+    # number of peers whose traffic is tracked individually
+    topContactsTracked = 100
 
     def __init__(self, node):
         self._node = node
         self._encoder = encoding.Bencode()
         self._translator = msgformat.DefaultFormat()
         self._sentMessages = {}
-        self._partialMessages = {}
+        self._partialMessages = reassembly.PartialMessages(constants.partialMessageTimeout,
+                                                           constants.partialMessagesMaxSize)
+        # number of packets of a partial response received by the time its RPC last timed out
         self._partialMessagesProgress = {}
         self._delay = Delay()
         # keep track of outstanding writes so that they
         # can be cancelled on shutdown
         self._call_later_list = {}
 
-        # keep track of bandwidth usage by peer
-        self._history_rx = {}
-        self._history_tx = {}
-        self._bytes_rx = {}
-        self._bytes_tx = {}
-        self._queries_rx_per_second = 0
-        self._queries_tx_per_second = 0
-        self._kbps_tx = 0
-        self._kbps_rx = 0
-        self._recent_contact_count = 0
-        self._total_bytes_tx = 0
+        # keep track of bandwidth usage, overall and by peer
+        self._rate_rx = bandwidth.RateCounter()
+        self._rate_tx = bandwidth.RateCounter()
+        self._recent_contacts = bandwidth.RecentAddresses()
+        self._top_contacts = bandwidth.TopTalkers(self.topContactsTracked)
         self._total_bytes_rx = 0
-        self._bandwidth_stats_update_lc = task.LoopingCall(self._update_bandwidth_stats)
-
-    def _update_bandwidth_stats(self):
-        recent_rx_history = {}
+        self._total_bytes_tx = 0
+        # number of requests received and sent, by RPC method
+        self._rpcs_rx = {}
+        self._rpcs_tx = {}
+
+        # limit the requests handled per source, and the expensive ones overall
+        self._source_limiter = bandwidth.SourceRateLimiter(
+            constants.rpcRateLimitPerSource, constants.rpcBurstPerSource,
+            constants.rateLimitedSourcesTracked)
+        self._method_limiters = {}
+        for method, rate in (('store', constants.storeRateLimit),
+                             ('findValue', constants.findValueRateLimit)):
+            if rate:
+                self._method_limiters[method] = bandwidth.TokenBucket(rate, rate)
+        self._rpcs_dropped = 0
+        self._rpcs_rejected = 0
+
+    def _count_rx(self, size, address):
         now = time.time()
-        for address, history in self._history_rx.iteritems():
-            recent_rx_history[address] = [(s, t) for (s, t) in history if now - t < 1.0]
-        qps_rx = sum(len(v) for (k, v) in recent_rx_history.iteritems())
-        bps_rx = sum(sum([x[0] for x in v]) for (k, v) in recent_rx_history.iteritems())
-        kbps_rx = round(float(bps_rx) / 1024.0, 2)
+        self._rate_rx.add(size, now)
+        self._recent_contacts.add(address, now)
+        self._top_contacts.add(address, size)
+        self._total_bytes_rx += size
 
-        recent_tx_history = {}
+    def _count_tx(self, size, address):
         now = time.time()
-        for address, history in self._history_tx.iteritems():
-            recent_tx_history[address] = [(s, t) for (s, t) in history if now - t < 1.0]
-        qps_tx = sum(len(v) for (k, v) in recent_tx_history.iteritems())
-        bps_tx = sum(sum([x[0] for x in v]) for (k, v) in recent_tx_history.iteritems())
-        kbps_tx = round(float(bps_tx) / 1024.0, 2)
-
-        recent_contacts = []
-        for k, v in recent_rx_history.iteritems():
-            if v:
-                recent_contacts.append(k)
-        for k, v in recent_tx_history.iteritems():
-            if v and k not in recent_contacts:
-                recent_contacts.append(k)
-
-        self._queries_rx_per_second = qps_rx
-        self._queries_tx_per_second = qps_tx
-        self._kbps_tx = kbps_tx
-        self._kbps_rx = kbps_rx
-        self._recent_contact_count = len(recent_contacts)
-        self._total_bytes_tx = sum(v for (k, v) in self._bytes_tx.iteritems())
-        self._total_bytes_rx = sum(v for (k, v) in self._bytes_rx.iteritems())
+        self._rate_tx.add(size, now)
+        self._recent_contacts.add(address, now)
+        self._top_contacts.add(address, size)
+        self._total_bytes_tx += size
 
     @property
     def queries_rx_per_second(self):
-        return self._queries_rx_per_second
+        return self._rate_rx.totals(time.time())[0]
 
     @property
     def queries_tx_per_second(self):
-        return self._queries_tx_per_second
+        return self._rate_tx.totals(time.time())[0]
 
     @property
     def kbps_tx(self):
-        return self._kbps_tx
+        return round(float(self._rate_tx.totals(time.time())[1]) / 1024.0, 2)
 
     @property
     def kbps_rx(self):
-        return self._kbps_rx
+        return round(float(self._rate_rx.totals(time.time())[1]) / 1024.0, 2)
 
     @property
     def recent_contact_count(self):
-        return self._recent_contact_count
+        return self._recent_contacts.count(time.time())
 
     @property
     def total_bytes_tx(self):
@@ -159,9 +163,38 @@ class KademliaProtocol(protocol.DatagramProtocol):
             "queries_received": self.queries_rx_per_second,
             "queries_sent": self.queries_tx_per_second,
             "recent_contacts": self.recent_contact_count,
+            "queries_dropped": self._rpcs_dropped,
+            "queries_rejected": self._rpcs_rejected,
+            "partial_messages_dropped": self._partialMessages.dropped,
+            "partial_messages_expired": self._partialMessages.expired,
+            # the number of requests received and sent so far by RPC method, and
+            # the contacts which most data has been exchanged with
+            "rpcs": {
+                "queries_received": dict(self._rpcs_rx),
+                "queries_sent": dict(self._rpcs_tx),
+                "top_contacts": [("%s:%i" % address, size)
+                                 for address, size in self._top_contacts.top(10)],
+            },
         }
         return response
 
+    def _allowRequest(self, address, method, now):
+        """ Check a request against the rate limits
+
+        @return: C{None} if the request may be handled, otherwise the reason
+                 it may not; 'dropped' if its source sent too many requests,
+                 or 'rejected' if the node handled too many requests of its
+                 method from all sources
+        """
+        if constants.rpcRateLimitPerSource and not self._source_limiter.consume(address, now):
+            self._rpcs_dropped += 1
+            return 'dropped'
+        limiter = self._method_limiters.get(method)
+        if limiter is not None and not limiter.consume(now):
+            self._rpcs_rejected += 1
+            return 'rejected'
+        return None
+
     def sendRPC(self, contact, method, args, rawResponse=False):
         """ Sends an RPC to the specified contact
 
@@ -194,6 +227,7 @@ class KademliaProtocol(protocol.DatagramProtocol):
         encodedMsg = self._encoder.encode(msgPrimitive)
 
         log.debug("DHT SEND CALL %s(%s)", method, args[0].encode('hex'))
+        self._rpcs_tx[method] = self._rpcs_tx.get(method, 0) + 1
 
         df = defer.Deferred()
         if rawResponse:
@@ -208,8 +242,6 @@ class KademliaProtocol(protocol.DatagramProtocol):
 
     def startProtocol(self):
         log.info("DHT listening on UDP %i", self._node.port)
-        if not self._bandwidth_stats_update_lc.running:
-            self._bandwidth_stats_update_lc.start(1)
 
     def datagramReceived(self, datagram, address):
         """ Handles and parses incoming RPC messages (and responses)
@@ -218,23 +250,17 @@ class KademliaProtocol(protocol.DatagramProtocol):
                receives a UDP datagram
         """
 
-        if datagram[0] == '\x00' and datagram[25] == '\x00':
+        headerLength = self.packetHeaderLength
+        if (datagram[0] == '\x00' and len(datagram) > headerLength and
+                datagram[headerLength - 1] == '\x00'):
             totalPackets = (ord(datagram[1]) << 8) | ord(datagram[2])
-            msgID = datagram[5:25]
+            msgID = datagram[5:headerLength - 1]
             seqNumber = (ord(datagram[3]) << 8) | ord(datagram[4])
-            if msgID not in self._partialMessages:
-                self._partialMessages[msgID] = {}
-            self._partialMessages[msgID][seqNumber] = datagram[26:]
-            if len(self._partialMessages[msgID]) == totalPackets:
-                keys = self._partialMessages[msgID].keys()
-                keys.sort()
-                data = ''
-                for key in keys:
-                    data += self._partialMessages[msgID][key]
-                    datagram = data
-                del self._partialMessages[msgID]
-            else:
+            datagram = self._partialMessages.add(msgID, seqNumber, totalPackets,
+                                                 datagram[headerLength:], time.time())
+            if datagram is None:
                 return
+            self._partialMessagesProgress.pop(msgID, None)
         try:
             msgPrimitive = self._encoder.decode(datagram)
         except encoding.DecodeError:
@@ -247,20 +273,23 @@ class KademliaProtocol(protocol.DatagramProtocol):
         message = self._translator.fromPrimitive(msgPrimitive)
         remoteContact = Contact(message.nodeID, address[0], address[1], self)
 
-        now = time.time()
-        contact_history = self._history_rx.get(address, [])
-        if len(contact_history) > 1000:
-            contact_history = [x for x in contact_history if now - x[1] < 1.0]
-        contact_history.append((len(datagram), time.time()))
-        self._history_rx[address] = contact_history
-        bytes_rx = self._bytes_rx.get(address, 0)
-        bytes_rx += len(datagram)
-        self._bytes_rx[address] = bytes_rx
+        self._count_rx(len(datagram), address)
+
+        limited = None
+        if isinstance(message, msgtypes.RequestMessage):
+            limited = self._allowRequest(address[0], message.request, time.time())
+            if limited == 'dropped':
+                # don't spend anything more on a source which is flooding us
+                return
 
         # Refresh the remote node's details in the local node's k-buckets
         self._node.addContact(remoteContact)
-        if isinstance(message, msgtypes.RequestMessage):
+        if limited == 'rejected':
+            self._sendError(remoteContact, message.id, RateLimitError,
+                            'Too many %s requests' % message.request)
+        elif isinstance(message, msgtypes.RequestMessage):
             # This is an RPC method request
+            self._rpcs_rx[message.request] = self._rpcs_rx.get(message.request, 0) + 1
             self._handleRPC(remoteContact, message.id, message.request, message.args)
 
         elif isinstance(message, msgtypes.ResponseMessage):
@@ -297,7 +326,7 @@ class KademliaProtocol(protocol.DatagramProtocol):
             |           |     |      |      |        ||||||||||||   0x00   |
             |Transmision|Total number|Sequence number| RPC ID   |Header end|
             | type ID   | of packets |of this packet |          | indicator|
-            | (1 byte)  | (2 bytes)  |  (2 bytes)    |(20 bytes)| (1 byte) |
+            | (1 byte)  | (2 bytes)  |  (2 bytes)    |(48 bytes)| (1 byte) |
             |           |     |      |      |        ||||||||||||          |
 
         @note: The header used for breaking up large data segments will
@@ -306,15 +335,7 @@ class KademliaProtocol(protocol.DatagramProtocol):
                class (see C{kademlia.msgformat} and C{kademlia.encoding}).
         """
 
-        now = time.time()
-        contact_history = self._history_tx.get(address, [])
-        if len(contact_history) > 1000:
-            contact_history = [x for x in contact_history if now - x[1] < 1.0]
-        contact_history.append((len(data), time.time()))
-        self._history_tx[address] = contact_history
-        bytes_tx = self._bytes_tx.get(address, 0)
-        bytes_tx += len(data)
-        self._bytes_tx[address] = bytes_tx
+        self._count_tx(len(data), address)
 
         if len(data) > self.msgSizeLimit:
             # We have to spread the data over multiple UDP datagrams,
@@ -415,7 +436,7 @@ class KademliaProtocol(protocol.DatagramProtocol):
             log.error("deferred timed out, but is not present in sent messages list!")
             return
         remoteContactID, df = self._sentMessages[messageID][0:2]
-        if self._partialMessages.has_key(messageID):
+        if messageID in self._partialMessages:
             # We are still receiving this message
             self._msgTimeoutInProgress(messageID, remoteContactID, df)
             return
@@ -429,21 +450,20 @@ class KademliaProtocol(protocol.DatagramProtocol):
         # See if any progress has been made; if not, kill the message
         if self._hasProgressBeenMade(messageID):
             # Reset the RPC timeout timer
+            self._partialMessagesProgress[messageID] = self._partialMessages.packetCount(messageID)
             timeoutCall = reactor.callLater(constants.rpcTimeout, self._msgTimeout, messageID)
             self._sentMessages[messageID] = (remoteContactID, df, timeoutCall)
         else:
             # No progress has been made
-            del self._partialMessagesProgress[messageID]
-            del self._partialMessages[messageID]
+            del self._sentMessages[messageID]
+            self._partialMessagesProgress.pop(messageID, None)
+            self._partialMessages.abandon(messageID)
             df.errback(failure.Failure(TimeoutError(remoteContactID)))
 
     def _hasProgressBeenMade(self, messageID):
         return (
-            self._partialMessagesProgress.has_key(messageID) and
-            (
-                len(self._partialMessagesProgress[messageID]) !=
-                len(self._partialMessages[messageID])
-            )
+            self._partialMessagesProgress.get(messageID, 0) !=
+            self._partialMessages.packetCount(messageID)
         )
 
     def stopProtocol(self):
@@ -453,9 +473,6 @@ class KademliaProtocol(protocol.DatagramProtocol):
         """
         log.info('Stopping DHT')
 
-        if self._bandwidth_stats_update_lc.running:
-            self._bandwidth_stats_update_lc.stop()
-
         for delayed_call in self._call_later_list.values():
             try:
                 delayed_call.cancel()
@@ -0,0 +1,103 @@
+import collections
+
+
+class _PartialMessage(object):
+    __slots__ = ('totalPackets', 'packets', 'size', 'started')
+
+    def __init__(self, totalPackets, started):
+        self.totalPackets = totalPackets
+        self.packets = {}
+        self.size = 0
+        self.started = started
+
+
+class PartialMessages(object):
+    """ Reassembles messages which were spread over several datagrams
+
+    The packets of incomplete messages are kept for at most maxAge seconds,
+    and for at most maxBytes bytes over all messages; when a new packet would
+    go over that, the oldest incomplete messages are dropped to make room.
+    Messages are kept in the order their first packet arrived in, so the
+    expired and oldest ones are always at the front.
+    """
+
+    def __init__(self, maxAge, maxBytes):
+        self.maxAge = maxAge
+        self.maxBytes = maxBytes
+        self._messages = collections.OrderedDict()
+        self._size = 0
+        # number of messages given up on to stay within maxBytes or because
+        # their packets were invalid, and because they didn't complete in time
+        self.dropped = 0
+        self.expired = 0
+
+    def __contains__(self, msgID):
+        return msgID in self._messages
+
+    def __len__(self):
+        return len(self._messages)
+
+    @property
+    def size(self):
+        return self._size
+
+    def packetCount(self, msgID):
+        """ Return the number of packets of a message received so far """
+        message = self._messages.get(msgID)
+        return len(message.packets) if message is not None else 0
+
+    def add(self, msgID, seqNumber, totalPackets, data, now):
+        """ Add a packet of a message
+
+        @return: the whole message if this was its last missing packet,
+                 otherwise C{None}
+        """
+        self._expire(now)
+        message = self._messages.get(msgID)
+        if message is None:
+            if len(data) > self.maxBytes or totalPackets < 1:
+                self.dropped += 1
+                return None
+            message = _PartialMessage(totalPackets, now)
+            self._messages[msgID] = message
+        elif message.totalPackets != totalPackets:
+            self.dropped += 1
+            self.remove(msgID)
+            return None
+        if seqNumber >= totalPackets:
+            self.dropped += 1
+            self.remove(msgID)
+            return None
+        if seqNumber in message.packets:
+            return None
+        while self._size + len(data) > self.maxBytes:
+            oldest = next(iter(self._messages))
+            self.dropped += 1
+            self.remove(oldest)
+            if oldest == msgID:
+                return None
+        message.packets[seqNumber] = data
+        message.size += len(data)
+        self._size += len(data)
+        if len(message.packets) < totalPackets:
+            return None
+        self.remove(msgID)
+        return ''.join(message.packets[i] for i in xrange(totalPackets))
+
+    def abandon(self, msgID):
+        """ Give up on an incomplete message """
+        if msgID in self._messages:
+            self.expired += 1
+            self.remove(msgID)
+
+    def remove(self, msgID):
+        message = self._messages.pop(msgID, None)
+        if message is not None:
+            self._size -= message.size
+
+    def _expire(self, now):
+        while self._messages:
+            msgID, message = next(self._messages.iteritems())
+            if now - message.started < self.maxAge:
+                break
+            self.abandon(msgID)
@@ -5,6 +5,8 @@
 # The docstrings in this module contain epytext markup; API documentation
 # may be created by processing this file with epydoc: http://epydoc.sf.net
 
+import bisect
+import heapq
 import time
 import random
 import constants
@@ -126,6 +128,8 @@ class TreeRoutingTable(RoutingTable):
         """
         # Create the initial (single) k-bucket covering the range of the entire n-bit ID space
         self._buckets = [kbucket.KBucket(rangeMin=0, rangeMax=2 ** constants.key_bits)]
+        # the rangeMin of each of the buckets, to find a key's bucket by bisection
+        self._bucketStarts = [0]
         self._parentNodeID = parentNodeID
 
     def addContact(self, contact):
@@ -206,29 +210,24 @@ class TreeRoutingTable(RoutingTable):
                  node is returning all of the contacts that it knows of.
         @rtype: list
         """
-        bucketIndex = self._kbucketIndex(key)
-        closestNodes = self._buckets[bucketIndex].getContacts(constants.k, _rpcNodeID)
-        # This method must return k contacts (even if we have the node
-        # with the specified key as node ID), unless there is less
-        # than k remote nodes in the routing table
-        i = 1
-        canGoLower = bucketIndex - i >= 0
-        canGoHigher = bucketIndex + i < len(self._buckets)
-        # Fill up the node list to k nodes, starting with the closest neighbouring nodes known
-        while len(closestNodes) < constants.k and (canGoLower or canGoHigher):
-            # TODO: this may need to be optimized
-            if canGoLower:
-                closestNodes.extend(
-                    self._buckets[bucketIndex - i].getContacts(
-                        constants.k - len(closestNodes), _rpcNodeID))
-                canGoLower = bucketIndex - (i + 1) >= 0
-            if canGoHigher:
-                closestNodes.extend(
-                    self._buckets[bucketIndex + i].getContacts(
-                        constants.k - len(closestNodes), _rpcNodeID))
-                canGoHigher = bucketIndex + (i + 1) < len(self._buckets)
-            i += 1
-        return closestNodes
+        key = kbucket.keyToLong(key)
+
+        def bucketDistance(bucket):
+            # XOR maps the bucket's range onto a range of distances that doesn't overlap
+            # that of any other bucket, so the buckets can be ordered by distance as a whole
+            size = bucket.rangeMax - bucket.rangeMin
+            return bucket.rangeMin ^ (key - key % size)
+
+        excludeKey = kbucket.keyToLong(_rpcNodeID) if _rpcNodeID is not None else None
+        candidates = []
+        for bucket in sorted(self._buckets, key=bucketDistance):
+            candidates.extend((contactKey ^ key, contact)
+                              for contactKey, contact in bucket.iterContactsByID()
+                              if contactKey != excludeKey)
+            if len(candidates) >= count:
+                break
+        return [contact for _, contact in heapq.nsmallest(count, candidates,
+                                                           key=lambda c: c[0])]
 
     def getContact(self, contactID):
         """ Returns the (known) contact with the specified node ID
@@ -307,13 +306,7 @@ class TreeRoutingTable(RoutingTable):
         @return: The index of the k-bucket responsible for the specified key
         @rtype: int
         """
-        i = 0
-        for bucket in self._buckets:
-            if bucket.keyInRange(key):
-                return i
-            else:
-                i += 1
-        return i
+        return bisect.bisect_right(self._bucketStarts, kbucket.keyToLong(key)) - 1
 
     def _randomIDInBucketRange(self, bucketIndex):
         """ Returns a random ID in the specified k-bucket's range
@@ -348,6 +341,7 @@ class TreeRoutingTable(RoutingTable):
         oldBucket.rangeMax = splitPoint
         # Now, add the new bucket into the routing table tree
         self._buckets.insert(oldBucketIndex + 1, newBucket)
+        self._bucketStarts.insert(oldBucketIndex + 1, splitPoint)
         # Finally, copy all nodes that belong to the new k-bucket into it...
         for contact in oldBucket._contacts:
             if newBucket.keyInRange(contact.id):
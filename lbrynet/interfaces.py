@@ -19,6 +19,21 @@ class IPeerFinder(Interface):
         @rtype: Deferred which fires with [Peer]
         """
 
+    def find_peers_for_blobs(self, blob_hashes, timeout=None):
+        """
+        Look for peers associated with each of many sha384 hashsums at once.
+
+        @param blob_hashes: The sha384 hashsums to use to look up peers.
+        @type blob_hashes: list of strings, hex encoded
+
+        @param timeout: Seconds after which to give up on the hashsums still being looked up.
+        @type timeout: float
+
+        @return: a Deferred object which fires with a dict of hashsum to a list of Peer
+            objects, hashsums which could not be looked up are left out
+        @rtype: Deferred which fires with {string: [Peer]}
+        """
+
 
 class IRequestSender(Interface):
     """
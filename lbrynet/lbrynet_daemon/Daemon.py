@@ -242,14 +242,14 @@ class Daemon(AuthJSONRPCServer):
 
         @defer.inlineCallbacks
         def _announce_startup():
-            def _announce():
+            def _announce(blob_hashes):
                 self.announced_startup = True
                 self.startup_status = STARTUP_STAGES[5]
                 log.info("Started lbrynet-daemon")
-                log.info("%i blobs in manager", len(self.session.blob_manager.blobs))
+                log.info("%i blobs in manager", len(blob_hashes))
 
-            yield self.session.blob_manager.get_all_verified_blobs()
-            yield _announce()
+            blob_hashes = yield self.session.blob_manager.get_all_verified_blobs()
+            yield _announce(blob_hashes)
 
         log.info("Starting lbrynet-daemon")
 
@@ -440,6 +440,10 @@ class Daemon(AuthJSONRPCServer):
             'search_timeout': float,
             'cache_time': int,
             'share_usage_data': bool,
+            'blob_scrub_rate': int,
+            'blob_scrub_interval': int,
+            'blob_quota_bytes': int,
+            'blob_quota_count': int,
         }
 
         def can_update_key(settings, key, setting_type):
@@ -476,6 +480,14 @@ class Daemon(AuthJSONRPCServer):
         self.search_timeout = conf.settings['search_timeout']
         self.cache_time = conf.settings['cache_time']
 
+        scrubber = getattr(self.session and self.session.blob_manager, 'scrubber', None)
+        if scrubber is not None:
+            scrubber.set_rate(conf.settings['blob_scrub_rate'])
+            scrubber.set_interval(conf.settings['blob_scrub_interval'])
+        if self.session is not None and self.session.blob_quota is not None:
+            self.session.blob_quota.max_bytes = conf.settings['blob_quota_bytes']
+            self.session.blob_quota.max_blobs = conf.settings['blob_quota_count']
+
         return defer.succeed(True)
 
     def _write_db_revision_file(self, version_num):
@@ -539,8 +551,45 @@ class Daemon(AuthJSONRPCServer):
             download_directory=self.download_directory
         )
         yield self.lbry_file_manager.setup()
+        if self.session.hash_announcer is not None:
+            self.session.hash_announcer.add_priority_hashes_source(
+                self._get_managed_stream_head_blob_hashes)
+        if self.session.blob_quota is not None:
+            self.session.blob_quota.add_protected_blobs_source(
+                self._get_managed_stream_blob_hashes)
+            self.session.blob_quota.start()
         log.info('Done setting up file manager')
 
+    @defer.inlineCallbacks
+    def _get_managed_stream_blob_hashes(self):
+        """Get the hashes of the blobs of the streams which have been published or downloaded"""
+        blob_hashes = set()
+        for lbry_file in list(self.lbry_file_manager.lbry_files):
+            sd_hashes = yield self.stream_info_manager.get_sd_blob_hashes_for_stream(
+                lbry_file.stream_hash)
+            blob_hashes.update(sd_hashes)
+            blob_infos = yield self.stream_info_manager.get_blobs_for_stream(
+                lbry_file.stream_hash)
+            blob_hashes.update(blob_info[0] for blob_info in blob_infos if blob_info[0])
+        defer.returnValue(blob_hashes)
+
+    @defer.inlineCallbacks
+    def _get_managed_stream_head_blob_hashes(self):
+        """Get the hashes of the sd blobs and first blobs of the streams which have been
+        published or downloaded, which are needed to start a download and so are announced
+        more often than the rest. Blobs of unfinished downloads which aren't on disk yet are
+        left out"""
+        blob_hashes = set()
+        for lbry_file in list(self.lbry_file_manager.lbry_files):
+            sd_hashes = yield self.stream_info_manager.get_sd_blob_hashes_for_stream(
+                lbry_file.stream_hash)
+            blob_hashes.update(sd_hashes)
+            blob_infos = yield self.stream_info_manager.get_blobs_for_stream(
+                lbry_file.stream_hash, count=1)
+            blob_hashes.update(blob_info[0] for blob_info in blob_infos if blob_info[0])
+        completed = yield self.session.blob_manager.completed_blobs(list(blob_hashes))
+        defer.returnValue(completed)
+
     def _get_analytics(self):
         if not self.analytics_manager.is_started:
             self.analytics_manager.start()
@@ -986,6 +1035,20 @@ class Daemon(AuthJSONRPCServer):
         d.addCallback(self.get_blobs_for_stream_hash)
         return d
 
+    @defer.inlineCallbacks
+    def _get_blob_hashes_in_manager(self, needed=None, finished=None):
+        # the blob manager only keeps objects for recently used blobs, so completed blobs come
+        # from its verified hashes and only blobs still being written come from the objects
+        blob_manager = self.session.blob_manager
+        blob_hashes = []
+        if not needed:
+            verified = yield blob_manager.get_all_verified_blobs()
+            blob_hashes.extend(verified)
+        if not finished:
+            blob_hashes.extend(blob.blob_hash for blob in blob_manager.blobs.itervalues()
+                               if not blob.is_validated())
+        defer.returnValue(sorted(blob_hashes))
+
     ############################################################################
     #                                                                          #
     #                JSON-RPC API methods start here                           #
@@ -1041,6 +1104,10 @@ class Daemon(AuthJSONRPCServer):
             response['session_status'] = {
                 'managed_blobs': len(blobs),
                 'managed_streams': len(self.lbry_file_manager.lbry_files),
+                'blob_cache': self.session.blob_manager.get_cache_stats(),
+                'blob_quota': (self.session.blob_quota.get_status()
+                               if self.session.blob_quota is not None else None),
+                'peers': self.session.peer_manager.get_status(),
             }
         if dht_status:
             response['dht_status'] = self.session.dht_node.get_bandwidth_stats()
@@ -1122,6 +1189,11 @@ class Daemon(AuthJSONRPCServer):
             'download_timeout': (int) download timeout in seconds
             'search_timeout': (float) search timeout in seconds
             'cache_time': (int) cache timeout in seconds
+            'blob_scrub_rate': (int) bytes per second read when checking the integrity of
+                stored blobs, 0 to pause the checks
+            'blob_scrub_interval': (int) seconds between integrity checks of each stored blob
+            'blob_quota_bytes': (int) maximum size of the blob store in bytes, 0 for no limit
+            'blob_quota_count': (int) maximum number of stored blobs, 0 for no limit
         Returns:
             (dict) Updated dictionary of daemon settings
         """
@@ -2188,7 +2260,8 @@ t
             (str) Success/fail message
         """
 
-        if blob_hash not in self.session.blob_manager.blobs:
+        completed = yield self.session.blob_manager.completed_blobs([blob_hash])
+        if blob_hash not in completed and blob_hash not in self.session.blob_manager.blobs:
             response = yield self._render_response("Don't have that blob")
             defer.returnValue(response)
         try:
@@ -2287,14 +2360,16 @@ t
             except NoSuchSDHash:
                 blobs = []
         else:
-            blobs = self.session.blob_manager.blobs.itervalues()
-
-        if needed:
-            blobs = [blob for blob in blobs if not blob.is_validated()]
-        if finished:
-            blobs = [blob for blob in blobs if blob.is_validated()]
+            blobs = None
 
-        blob_hashes = [blob.blob_hash for blob in blobs]
+        if blobs is None:
+            blob_hashes = yield self._get_blob_hashes_in_manager(needed, finished)
+        else:
+            if needed:
+                blobs = [blob for blob in blobs if not blob.is_validated()]
+            if finished:
+                blobs = [blob for blob in blobs if blob.is_validated()]
+            blob_hashes = [blob.blob_hash for blob in blobs]
         page_size = page_size or len(blob_hashes)
         page = page or 0
         start_index = page * page_size
@@ -2303,6 +2378,30 @@ t
         response = yield self._render_response(blob_hashes_for_return)
         defer.returnValue(response)
 
+    def jsonrpc_blob_scrub_status(self):
+        """
+        Get the progress of the background integrity checks of stored blobs
+
+        Usage:
+            blob_scrub_status
+
+        Returns:
+            (dict) Scrubber status
+            {
+                'rate': (int) bytes per second read, 0 if the checks are paused
+                'interval': (int) seconds between checks of each blob
+                'checking': (bool) whether a blob is being checked right now
+                'blobs_checked': (int) blobs checked since startup
+                'bytes_checked': (int) bytes read since startup
+                'blobs_remaining': (int) blobs left to check in the current batch
+                'corrupt_blobs_found': (int) blobs which failed a check and were quarantined
+                    since startup
+                'corrupt_blobs': (list) hashes of the most recent 100 of those blobs
+            }
+        """
+
+        return self._render_response(self.session.blob_manager.get_scrubber_status())
+
     def jsonrpc_blob_reflect_all(self):
         """
         Reflects all saved blobs
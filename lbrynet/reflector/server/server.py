@@ -5,6 +5,7 @@ from twisted.internet import error, defer
 from twisted.internet.protocol import Protocol, ServerFactory
 from lbrynet.core.utils import is_valid_blobhash
 from lbrynet.core.Error import DownloadCanceledError, InvalidBlobHashError
+from lbrynet.core.MessageFraming import decode_unframed
 from lbrynet.reflector.common import REFLECTOR_V1, REFLECTOR_V2
 from lbrynet.reflector.common import ReflectorRequestError, ReflectorClientVersionError
 
@@ -113,25 +114,11 @@ class ReflectorServer(Protocol):
                     self.blob_write(extra_data)
 
     def _get_valid_response(self, response_msg):
-        extra_data = None
-        response = None
-        curr_pos = 0
-        while not self.receiving_blob:
-            next_close_paren = response_msg.find('}', curr_pos)
-            if next_close_paren != -1:
-                curr_pos = next_close_paren + 1
-                try:
-                    response = json.loads(response_msg[:curr_pos])
-                except ValueError:
-                    if curr_pos > MAXIMUM_QUERY_SIZE:
-                        raise ValueError("Error decoding response: %s" % str(response_msg))
-                    else:
-                        pass
-                else:
-                    extra_data = response_msg[curr_pos:]
-                    break
-            else:
-                break
+        if self.receiving_blob:
+            return None, None
+        response, extra_data = decode_unframed(response_msg)
+        if response is None and len(response_msg) > MAXIMUM_QUERY_SIZE:
+            raise ValueError("Error decoding response: %s" % str(response_msg))
         return response, extra_data
 
     def need_handshake(self):
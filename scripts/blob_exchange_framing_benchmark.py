@@ -0,0 +1,129 @@
+"""Benchmark parsing of the JSON messages exchanged between blob exchange peers
+
+Large availability responses and stream descriptor messages are delivered to the parser in
+chunks the size of a TCP read, and parsed with the original parser, which tries to decode the
+buffer at every closing brace, with the single decode used for unframed messages now, and with
+length framed messages.
+"""
+from __future__ import print_function
+
+import argparse
+import json
+import random
+import sys
+import timeit
+
+from lbrynet.core.MessageFraming import MessageBuffer, frame_message
+
+
+def legacy_get_valid_response(response_msg):
+    """The parser MessageBuffer replaced, kept to compare against"""
+    extra_data = None
+    response = None
+    curr_pos = 0
+    while 1:
+        next_close_paren = response_msg.find('}', curr_pos)
+        if next_close_paren != -1:
+            curr_pos = next_close_paren + 1
+            try:
+                response = json.loads(response_msg[:curr_pos])
+            except ValueError:
+                pass
+            else:
+                extra_data = response_msg[curr_pos:]
+                break
+        else:
+            break
+    return response, extra_data
+
+
+def random_hex(size):
+    return ''.join(chr(random.randint(0, 255)) for _ in range(size)).encode('hex')
+
+
+def random_hash():
+    return random_hex(48)
+
+
+def availability_message(blob_count):
+    return {
+        'available_blobs': [random_hash() for _ in range(blob_count)],
+        'blob_data_payment_rate': 'RATE_ACCEPTED',
+    }
+
+
+def descriptor_message(blob_count):
+    blobs = [
+        {'blob_hash': random_hash(), 'blob_num': i, 'iv': random_hex(16),
+         'length': 2097152}
+        for i in range(blob_count)
+    ]
+    blobs.append({'blob_num': blob_count, 'iv': random_hex(16), 'length': 0})
+    return {
+        'stream_type': 'lbryfile',
+        'stream_name': random_hex(16),
+        'key': random_hex(16),
+        'suggested_file_name': random_hex(16),
+        'stream_hash': random_hash(),
+        'blobs': blobs,
+    }
+
+
+def chunks(data, size):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+def parse_legacy(received):
+    buff = ''
+    for chunk in received:
+        buff += chunk
+        response, _ = legacy_get_valid_response(buff)
+        if response is not None:
+            return response
+
+
+def parse_buffer(received, framed):
+    buff = MessageBuffer()
+    buff.framed = framed
+    for chunk in received:
+        buff.write(chunk)
+        response, _ = buff.get_message()
+        if response is not None:
+            return response
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--blobs', type=int, default=500,
+                        help='number of blobs in each message')
+    parser.add_argument('--chunk-size', type=int, default=4096)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(args)
+
+    random.seed(args.seed)
+    messages = [
+        ('availability', availability_message(args.blobs)),
+        ('descriptor', descriptor_message(args.blobs)),
+    ]
+    for name, message in messages:
+        encoded = json.dumps(message)
+        unframed = chunks(encoded, args.chunk_size)
+        framed = chunks(frame_message(encoded), args.chunk_size)
+        print("%s message: %i bytes in %i chunks" % (name, len(encoded), len(unframed)))
+        parsers = [
+            ('legacy', lambda: parse_legacy(unframed)),
+            ('unframed', lambda: parse_buffer(unframed, False)),
+            ('framed', lambda: parse_buffer(framed, True)),
+        ]
+        for parser_name, parse in parsers:
+            if parse() != message:
+                print("%s parser decoded the message incorrectly" % parser_name)
+                return 1
+            elapsed = min(timeit.repeat(parse, number=1, repeat=args.repeat))
+            print("  %-8s %10.2f ms" % (parser_name, elapsed * 1000))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,177 @@
+"""Benchmark the DHT bencode codec against the original string-slicing implementation
+
+By default the benchmark runs over a synthetic mix of the messages a DHT node exchanges (pings,
+findNode and findValue requests and their responses, and stores). Recorded traffic can be used
+instead by passing a file with one hex encoded datagram per line.
+"""
+from __future__ import print_function
+
+import argparse
+import random
+import sys
+import timeit
+
+from lbrynet.dht import constants
+from lbrynet.dht import encoding
+from lbrynet.dht import msgformat
+from lbrynet.dht import msgtypes
+
+
+class LegacyBencode(encoding.Encoding):
+    """The implementation Bencode replaced, kept to compare against"""
+
+    def encode(self, data):
+        if isinstance(data, (int, long)):
+            return 'i%de' % data
+        elif isinstance(data, str):
+            return '%d:%s' % (len(data), data)
+        elif isinstance(data, (list, tuple)):
+            encodedListItems = ''
+            for item in data:
+                encodedListItems += self.encode(item)
+            return 'l%se' % encodedListItems
+        elif isinstance(data, dict):
+            encodedDictItems = ''
+            keys = data.keys()
+            keys.sort()
+            for key in keys:
+                encodedDictItems += self.encode(key)
+                encodedDictItems += self.encode(data[key])
+            return 'd%se' % encodedDictItems
+        elif isinstance(data, float):
+            return 'f%fe' % data
+        elif data is None:
+            return 'n'
+        else:
+            raise TypeError("Cannot bencode '%s' object" % type(data))
+
+    def decode(self, data):
+        return self._decodeRecursive(data)[0]
+
+    @staticmethod
+    def _decodeRecursive(data, startIndex=0):
+        if data[startIndex] == 'i':
+            endPos = data[startIndex:].find('e') + startIndex
+            return int(data[startIndex + 1:endPos]), endPos + 1
+        elif data[startIndex] == 'l':
+            startIndex += 1
+            decodedList = []
+            while data[startIndex] != 'e':
+                listData, startIndex = LegacyBencode._decodeRecursive(data, startIndex)
+                decodedList.append(listData)
+            return decodedList, startIndex + 1
+        elif data[startIndex] == 'd':
+            startIndex += 1
+            decodedDict = {}
+            while data[startIndex] != 'e':
+                key, startIndex = LegacyBencode._decodeRecursive(data, startIndex)
+                value, startIndex = LegacyBencode._decodeRecursive(data, startIndex)
+                decodedDict[key] = value
+            return decodedDict, startIndex
+        elif data[startIndex] == 'f':
+            endPos = data[startIndex:].find('e') + startIndex
+            return float(data[startIndex + 1:endPos]), endPos + 1
+        elif data[startIndex] == 'n':
+            return None, startIndex + 1
+        else:
+            splitPos = data[startIndex:].find(':') + startIndex
+            length = int(data[startIndex:splitPos])
+            startIndex = splitPos + 1
+            endPos = startIndex + length
+            return data[startIndex:endPos], endPos
+
+
+def random_id():
+    return ''.join(chr(random.randint(0, 255)) for _ in range(constants.key_bits / 8))
+
+
+def random_contact_triple():
+    ip = '.'.join(str(random.randint(1, 254)) for _ in range(4))
+    return (random_id(), ip, random.randint(1024, 65535))
+
+
+def random_compact_address():
+    return ''.join(chr(random.randint(0, 255)) for _ in range(6)) + random_id()
+
+
+def synthetic_traffic(count):
+    translator = msgformat.DefaultFormat()
+    messages = []
+    for _ in range(count):
+        node_id, rpc_id, key = random_id(), random_id()[:20], random_id()
+        kind = random.choice(['ping', 'findNode', 'findValue', 'store'])
+        if kind == 'ping':
+            messages.append(msgtypes.RequestMessage(node_id, 'ping', [], rpc_id))
+            messages.append(msgtypes.ResponseMessage(rpc_id, node_id, 'pong'))
+        elif kind == 'findNode':
+            contacts = [random_contact_triple() for _ in range(constants.k)]
+            messages.append(msgtypes.RequestMessage(node_id, 'findNode', [key], rpc_id))
+            messages.append(msgtypes.ResponseMessage(rpc_id, node_id, contacts))
+        elif kind == 'findValue':
+            peers = [random_compact_address() for _ in range(random.randint(1, 50))]
+            response = {key: peers, 'token': random_id()}
+            messages.append(msgtypes.RequestMessage(node_id, 'findValue', [key], rpc_id))
+            messages.append(msgtypes.ResponseMessage(rpc_id, node_id, response))
+        else:
+            value = {'port': 3333, 'lbryid': random_id(), 'token': random_id()}
+            messages.append(
+                msgtypes.RequestMessage(node_id, 'store', [key, value, node_id, 0], rpc_id))
+            messages.append(msgtypes.ResponseMessage(rpc_id, node_id, 'OK'))
+    return [encoding.Bencode().encode(translator.toPrimitive(m)) for m in messages]
+
+
+def recorded_traffic(path):
+    with open(path) as traffic_file:
+        return [line.strip().decode('hex') for line in traffic_file if line.strip()]
+
+
+def benchmark(codec, datagrams, repeat):
+    decoded = [codec.decode(datagram) for datagram in datagrams]
+
+    def encode_all():
+        for primitive in decoded:
+            codec.encode(primitive)
+
+    def decode_all():
+        for datagram in datagrams:
+            codec.decode(datagram)
+
+    encode_time = min(timeit.repeat(encode_all, number=1, repeat=repeat))
+    decode_time = min(timeit.repeat(decode_all, number=1, repeat=repeat))
+    return encode_time, decode_time
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--traffic', help='file of hex encoded datagrams, one per line')
+    parser.add_argument('--messages', type=int, default=5000,
+                        help='number of synthetic exchanges to generate')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(args)
+
+    random.seed(args.seed)
+    if args.traffic:
+        datagrams = recorded_traffic(args.traffic)
+    else:
+        datagrams = synthetic_traffic(args.messages)
+    total_bytes = sum(len(d) for d in datagrams)
+    print("%i datagrams, %i bytes" % (len(datagrams), total_bytes))
+
+    current, legacy = encoding.Bencode(), LegacyBencode()
+    for datagram in datagrams:
+        primitive = current.decode(datagram)
+        if current.encode(primitive) != legacy.encode(primitive):
+            print("Encoded output differs from the legacy encoder for %s" % datagram.encode('hex'))
+            return 1
+
+    results = [('legacy', benchmark(legacy, datagrams, args.repeat)),
+               ('current', benchmark(current, datagrams, args.repeat))]
+    for name, (encode_time, decode_time) in results:
+        print("%-8s encode: %8.1f datagrams/s  decode: %8.1f datagrams/s" % (
+            name, len(datagrams) / encode_time, len(datagrams) / decode_time))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
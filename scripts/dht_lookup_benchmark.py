@@ -0,0 +1,90 @@
+"""Benchmark iterative DHT node lookups over a simulated in-process network
+
+Every simulated node has a routing table holding its closest neighbours and a random sample
+of the rest of the network. RPCs are answered immediately by the contacted node without
+touching the reactor, so the benchmark measures the cost of the lookup itself. It reports
+lookups per second, RPCs per lookup and how often the lookup found the true closest nodes.
+"""
+from __future__ import print_function
+
+import argparse
+import random
+import sys
+import timeit
+
+from dht_simulation import InMemoryNetwork, address_for_port, distance, random_id, reactor
+
+from lbrynet.dht import constants
+from lbrynet.dht.contact import Contact
+from lbrynet.dht.node import Node
+
+
+def build_network(size, neighbours, sample):
+    network = InMemoryNetwork(reactor, random)
+    node_ids = sorted(random_id() for _ in range(size))
+    nodes = []
+    for i, node_id in enumerate(node_ids):
+        node = Node(node_id, udpPort=1024 + i)
+        network.add_direct_node(node)
+        nodes.append(node)
+    for i, node in enumerate(nodes):
+        # nodes next to each other in sorted order share the longest prefixes
+        known = nodes[max(0, i - neighbours):i + neighbours + 1]
+        known += random.sample(nodes, sample)
+        for contact_node in known:
+            if contact_node is not node:
+                address, port = address_for_port(contact_node.port)
+                node.addContact(Contact(contact_node.id, address, port, node._protocol))
+    return network, nodes
+
+
+def closest(nodes, key):
+    return min(nodes, key=lambda node: distance(node.id, key))
+
+
+def run_lookups(searchers, keys):
+    results = []
+    for node, key in zip(searchers, keys):
+        d = node.iterativeFindNode(key)
+        # the simulated network answers synchronously, so the lookup is already finished
+        d.addCallback(results.append)
+    return results
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--nodes', type=int, default=2000)
+    parser.add_argument('--lookups', type=int, default=200)
+    parser.add_argument('--neighbours', type=int, default=constants.k,
+                        help='number of closest nodes each node knows on either side')
+    parser.add_argument('--sample', type=int, default=100,
+                        help='number of random nodes each node knows')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(args)
+
+    random.seed(args.seed)
+    print("Building a network of %i nodes" % args.nodes)
+    network, nodes = build_network(args.nodes, args.neighbours, args.sample)
+    searchers = random.sample(nodes, args.lookups)
+    keys = [random_id() for _ in range(args.lookups)]
+
+    network.rpcs = 0
+    results = run_lookups(searchers, keys)
+    rpcs_per_lookup = float(network.rpcs) / args.lookups
+    found = 0
+    for node, key, result in zip(searchers, keys, results):
+        others = [n for n in nodes if n is not node]
+        if result and result[0].id == closest(others, key).id:
+            found += 1
+    elapsed = min(timeit.repeat(lambda: run_lookups(searchers, keys),
+                                number=1, repeat=args.repeat))
+
+    print("%8.1f lookups/s" % (args.lookups / elapsed))
+    print("%8.1f RPCs per lookup" % rpcs_per_lookup)
+    print("%7.1f%% of lookups found the closest node" % (100.0 * found / args.lookups))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,190 @@
+"""An in-process simulated network for running many DHT nodes in one process
+
+Importing this module installs SimulatedReactor as the twisted reactor, so it has to be imported
+before anything imports twisted.internet.reactor.
+"""
+import heapq
+import random
+
+from twisted.internet import base, defer, task
+from twisted.internet.main import installReactor
+
+
+class SimulatedReactor(task.Clock):
+    """A clock which only moves forward when told to, and which hands out in-memory UDP ports
+
+    task.Clock re-sorts its whole list of pending calls every time one is added or run, which
+    is far too slow with thousands of nodes, so the calls are kept in a heap instead. Cancelled
+    and rescheduled calls are left in the heap and skipped when they come up.
+    """
+
+    def __init__(self):
+        task.Clock.__init__(self)
+        self.network = None
+        self._heap = []  # [(time, sequence, DelayedCall)]
+        self._sequence = 0
+
+    def listenUDP(self, port, protocol, interface='', maxPacketSize=8192):
+        return self.network.listen(port, protocol)
+
+    def callLater(self, when, what, *a, **kw):
+        dc = base.DelayedCall(self.seconds() + when, what, a, kw, lambda c: None, self._push,
+                              self.seconds)
+        self._push(dc)
+        return dc
+
+    def getDelayedCalls(self):
+        return [dc for _, _, dc in self._heap if dc.active()]
+
+    def _push(self, dc):
+        self._sequence += 1
+        heapq.heappush(self._heap, (dc.getTime(), self._sequence, dc))
+
+    def _next_call_time(self):
+        while self._heap:
+            when, _, dc = self._heap[0]
+            if dc.active() and dc.getTime() == when:
+                return when
+            heapq.heappop(self._heap)
+        return None
+
+    def advance(self, amount):
+        self.rightNow += amount
+        while True:
+            when = self._next_call_time()
+            if when is None or when > self.seconds():
+                break
+            dc = heapq.heappop(self._heap)[2]
+            dc.called = 1
+            dc.func(*dc.args, **dc.kw)
+
+    def run_until(self, d, timeout):
+        """Advance time until the deferred d has fired or timeout seconds have passed"""
+        deadline = self.seconds() + timeout
+        while not d.called:
+            when = self._next_call_time()
+            if when is None or when > deadline:
+                break
+            self.advance(max(0, when - self.seconds()))
+        if not d.called:
+            self.advance(max(0, deadline - self.seconds()))
+
+    def run_for(self, seconds):
+        deadline = self.seconds() + seconds
+        while True:
+            when = self._next_call_time()
+            if when is None or when > deadline:
+                break
+            self.advance(max(0, when - self.seconds()))
+        self.advance(max(0, deadline - self.seconds()))
+
+
+# the nodes use the simulated reactor, so it has to be installed before twisted's default reactor
+# is imported by anything else
+reactor = SimulatedReactor()
+installReactor(reactor)
+
+from lbrynet.dht import constants  # pylint: disable=wrong-import-position
+from lbrynet.dht.msgtypes import ResponseMessage  # pylint: disable=wrong-import-position
+from lbrynet.dht.protocol import TimeoutError  # pylint: disable=wrong-import-position
+
+
+def random_id(rng=random):
+    return ''.join(chr(rng.randint(0, 255)) for _ in range(constants.key_bits / 8))
+
+
+def distance(a, b):
+    return long(a.encode('hex'), 16) ^ long(b.encode('hex'), 16)
+
+
+def address_for_port(port):
+    return '10.0.%i.%i' % (port >> 8, port & 0xff), port
+
+
+class SimulatedPort(object):
+    """The transport of one node's protocol"""
+
+    def __init__(self, network, port, protocol):
+        self.network = network
+        self.address = address_for_port(port)
+        self.protocol = protocol
+
+    def write(self, data, address):
+        self.network.send(self.address, data, address)
+
+    def stopListening(self):
+        self.network.ports.pop(self.address, None)
+        self.protocol.doStop()
+
+    def getHost(self):
+        return self.address
+
+
+class DirectProtocol(object):
+    """A network protocol for a node which answers its RPCs by calling the contacted node directly
+
+    The RPCs skip encoding and the reactor and are answered before sendRPC returns, so a lookup
+    made through it finishes synchronously.
+    """
+
+    def __init__(self, network, node):
+        self.network = network
+        self.node = node
+
+    def sendRPC(self, contact, method, args, rawResponse=False):
+        address = (contact.address, contact.port)
+        self.network.rpcs += 1
+        remote_node = self.network.nodes.get(address)
+        if remote_node is None or address in self.network.offline:
+            return defer.fail(TimeoutError(contact.id))
+        result = getattr(remote_node, method)(*args, _rpcNodeID=self.node.id)
+        return defer.succeed((ResponseMessage('rpcId', remote_node.id, result), address))
+
+
+class InMemoryNetwork(object):
+    """Carries datagrams between the simulated ports, or RPCs between the nodes added to it
+
+    Nodes which joined through reactor.listenUDP send real datagrams, which arrive after the
+    latency and jitter unless they are lost. Nodes added with add_direct_node have their RPCs
+    answered directly by the contacted node instead.
+    """
+
+    def __init__(self, clock, rng, latency=0, jitter=0, loss=0):
+        self.clock = clock
+        self.rng = rng
+        self.latency = latency
+        self.jitter = jitter
+        self.loss = loss
+        self.ports = {}  # {address: SimulatedPort}
+        self.nodes = {}  # {address: Node}, of the nodes answering RPCs directly
+        self.offline = set()  # addresses of nodes which are currently unreachable
+        self.datagrams_sent = 0
+        self.datagrams_dropped = 0
+        self.bytes_sent = 0
+        self.rpcs = 0  # sent through a DirectProtocol
+
+    def listen(self, port, protocol):
+        simulated_port = SimulatedPort(self, port, protocol)
+        self.ports[simulated_port.address] = simulated_port
+        protocol.makeConnection(simulated_port)
+        return simulated_port
+
+    def add_direct_node(self, node):
+        node._protocol = DirectProtocol(self, node)
+        self.nodes[address_for_port(node.port)] = node
+
+    def send(self, source, data, destination):
+        self.datagrams_sent += 1
+        self.bytes_sent += len(data)
+        if (source in self.offline or destination in self.offline or
+                destination not in self.ports or self.rng.random() < self.loss):
+            self.datagrams_dropped += 1
+            return
+        delay = self.latency + self.rng.uniform(0, self.jitter)
+        self.clock.callLater(delay, self._receive, source, data, destination)
+
+    def _receive(self, source, data, destination):
+        if destination in self.offline or destination not in self.ports:
+            self.datagrams_dropped += 1
+            return
+        self.ports[destination].protocol.datagramReceived(data, source)
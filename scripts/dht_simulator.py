@@ -0,0 +1,230 @@
+"""Simulate a DHT network of many nodes in a single process
+
+Every node is a real lbrynet.dht.node.Node. The nodes talk over an in-memory datagram transport
+with configurable latency, jitter and packet loss, and some of them can be taken offline and
+brought back periodically (churn). Time is simulated: the reactor is a clock that jumps straight
+to the next scheduled call, so a run is deterministic for a given seed and hours of network time
+take seconds.
+
+After the nodes have joined, some of them announce random hashes. Then random online nodes look up
+random keys and the announced hashes. The report gives the hop counts, latencies and RPC counts of
+the lookups, how often they found the closest node or the announced value, and the memory used
+per node.
+"""
+from __future__ import print_function
+
+import argparse
+import logging
+import random
+import resource
+import sys
+import time
+
+from dht_simulation import InMemoryNetwork, address_for_port, distance, random_id, reactor
+
+from lbrynet.dht import node as dht_node
+
+
+class HopCountingHelper(dht_node._IterativeFindHelper):
+    """Records how many hops away from the searching node each contact was found"""
+
+    def __init__(self, *args, **kwargs):
+        self.hops = {}
+        self._responder = None
+        super(HopCountingHelper, self).__init__(*args, **kwargs)
+
+    def extendShortlist(self, responseTuple):
+        self._responder = responseTuple[0].nodeID
+        try:
+            return super(HopCountingHelper, self).extendShortlist(responseTuple)
+        finally:
+            self._responder = None
+
+    def _addToShortlist(self, contact):
+        if contact.id not in self.hops:
+            self.hops[contact.id] = self.hops.get(self._responder, 0) + 1
+        super(HopCountingHelper, self)._addToShortlist(contact)
+
+
+def percentile(values, p):
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[int(round(p * (len(values) - 1)))]
+
+
+class Simulation(object):
+    LOOKUP_TIMEOUT = 60
+
+    def __init__(self, args):
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.network = InMemoryNetwork(reactor, self.rng, args.latency / 1000.0, args.jitter / 1000.0,
+                                       args.loss)
+        reactor.network = self.network
+        self.nodes = []
+        self.lookups = []  # (hops, latency, rpcs, found closest)
+        self.value_lookups = []  # (latency, rpcs, found value)
+        self.helpers = []  # the HopCountingHelpers of the current lookup
+
+    def random_id(self):
+        return random_id(self.rng)
+
+    def make_helper(self, *args):
+        helper = HopCountingHelper(*args)
+        self.helpers.append(helper)
+        return helper
+
+    def online_nodes(self):
+        return [n for n in self.nodes if address_for_port(n.port) not in self.network.offline]
+
+    def queries_sent(self, node):
+        return sum(node._protocol.bandwidth_stats['rpcs']['queries_sent'].itervalues())
+
+    def create_nodes(self):
+        memory_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        for i in range(self.args.nodes):
+            port = 1024 + i
+            n = dht_node.Node(self.random_id(), udpPort=port, lbryid=self.random_id(),
+                              externalIP=address_for_port(port)[0],
+                              iterativeFindHelperClass=self.make_helper)
+            # send immediately rather than pacing writes by the wall clock, to be deterministic
+            n._protocol._delay = lambda: 0
+            known_nodes = None
+            if self.nodes:
+                known_nodes = [address_for_port(self.nodes[0].port),
+                               address_for_port(self.rng.choice(self.nodes).port)]
+            self.nodes.append(n)
+            reactor.run_until(n.joinNetwork(known_nodes), self.LOOKUP_TIMEOUT)
+        memory_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is in kilobytes on linux
+        return float(memory_after - memory_before) / len(self.nodes)
+
+    def churn(self):
+        offline = list(self.network.offline)
+        for address in offline:
+            if self.rng.random() < 0.5:
+                self.network.offline.discard(address)
+        for n in self.online_nodes():
+            if self.rng.random() < self.args.churn:
+                self.network.offline.add(address_for_port(n.port))
+        reactor.callLater(self.args.churn_interval, self.churn)
+
+    def announce(self):
+        hashes = []
+        for _ in range(self.args.announces):
+            blob_hash = self.random_id()
+            d = self.rng.choice(self.online_nodes()).announceHaveBlob(blob_hash, 3333)
+            reactor.run_until(d, self.LOOKUP_TIMEOUT)
+            hashes.append(blob_hash)
+        return hashes
+
+    def _lookup(self, origin, key, find):
+        self.helpers = []
+        queries_before = self.queries_sent(origin)
+        started = reactor.seconds()
+        results = []
+        d = find(key)
+        d.addBoth(results.append)
+        reactor.run_until(d, self.LOOKUP_TIMEOUT)
+        latency = reactor.seconds() - started
+        rpcs = self.queries_sent(origin) - queries_before
+        helpers = [h for h in self.helpers if h.node is origin and h.key == key]
+        return (results[0] if results else None), latency, rpcs, helpers
+
+    def find_nodes(self):
+        for _ in range(self.args.lookups):
+            origin = self.rng.choice(self.online_nodes())
+            key = self.random_id()
+            result, latency, rpcs, helpers = self._lookup(origin, key, origin.iterativeFindNode)
+            closest = min((n for n in self.online_nodes() if n is not origin),
+                          key=lambda n: distance(n.id, key))
+            found = bool(result) and isinstance(result, list) and result[0].id == closest.id
+            hops = helpers[0].hops.get(result[0].id, 0) if found and helpers else 0
+            self.lookups.append((hops, latency, rpcs, found))
+
+    def find_values(self, hashes):
+        for blob_hash in hashes:
+            origin = self.rng.choice(self.online_nodes())
+            result, latency, rpcs, _ = self._lookup(origin, blob_hash, origin.iterativeFindValue)
+            found = isinstance(result, dict) and blob_hash in result
+            self.value_lookups.append((latency, rpcs, found))
+
+    def run(self):
+        print("Joining %i nodes" % self.args.nodes)
+        memory_per_node = self.create_nodes()
+        reactor.run_for(self.args.settle)
+        if self.args.churn:
+            self.churn()
+        print("Announcing %i hashes" % self.args.announces)
+        hashes = self.announce()
+        print("Running %i lookups" % self.args.lookups)
+        self.find_nodes()
+        self.find_values(hashes)
+        self.report(memory_per_node)
+
+    def report(self, memory_per_node):
+        print()
+        print("simulated time:     %.0f s" % reactor.seconds())
+        print("online nodes:       %i of %i" % (len(self.online_nodes()), len(self.nodes)))
+        print("datagrams sent:     %i (%i dropped, %.1f MB)" % (
+            self.network.datagrams_sent, self.network.datagrams_dropped,
+            self.network.bytes_sent / 2.0 ** 20))
+        print("memory per node:    %.1f KB" % memory_per_node)
+        if self.lookups:
+            hops = [h for h, _, _, found in self.lookups if found]
+            latencies = [l * 1000 for _, l, _, _ in self.lookups]
+            print("node lookups:       %i, %.1f%% found the closest node" % (
+                len(self.lookups), 100.0 * len(hops) / len(self.lookups)))
+            print("  hops:             mean %.2f, p50 %i, p90 %i, max %i" % (
+                float(sum(hops)) / max(1, len(hops)), percentile(hops, 0.5),
+                percentile(hops, 0.9), max(hops or [0])))
+            print("  latency:          p50 %.0f ms, p90 %.0f ms, p99 %.0f ms" % (
+                percentile(latencies, 0.5), percentile(latencies, 0.9),
+                percentile(latencies, 0.99)))
+            print("  RPCs per lookup:  %.1f" % (
+                float(sum(r for _, _, r, _ in self.lookups)) / len(self.lookups)))
+        if self.value_lookups:
+            found = sum(1 for _, _, f in self.value_lookups if f)
+            latencies = [l * 1000 for l, _, _ in self.value_lookups]
+            print("value lookups:      %i, %.1f%% found the value" % (
+                len(self.value_lookups), 100.0 * found / len(self.value_lookups)))
+            print("  latency:          p50 %.0f ms, p90 %.0f ms, p99 %.0f ms" % (
+                percentile(latencies, 0.5), percentile(latencies, 0.9),
+                percentile(latencies, 0.99)))
+            print("  RPCs per lookup:  %.1f" % (
+                float(sum(r for _, r, _ in self.value_lookups)) / len(self.value_lookups)))
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--nodes', type=int, default=2000)
+    parser.add_argument('--lookups', type=int, default=200)
+    parser.add_argument('--announces', type=int, default=50)
+    parser.add_argument('--latency', type=float, default=50, help='one way latency in ms')
+    parser.add_argument('--jitter', type=float, default=20, help='maximum extra latency in ms')
+    parser.add_argument('--loss', type=float, default=0.01, help='fraction of datagrams lost')
+    parser.add_argument('--churn', type=float, default=0.0,
+                        help='fraction of online nodes going offline every churn interval')
+    parser.add_argument('--churn-interval', type=float, default=60)
+    parser.add_argument('--settle', type=float, default=60,
+                        help='seconds to run the network for after the nodes have joined')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(args)
+
+    logging.basicConfig(level=logging.CRITICAL)
+    # the nodes draw ids from the random module and timestamp things with time.time(), both of
+    # which have to follow the simulation for a run to be repeatable
+    random.seed(args.seed)
+    real_time = time.time
+    time.time = reactor.seconds
+    try:
+        Simulation(args).run()
+    finally:
+        time.time = real_time
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -140,6 +140,13 @@ class PeerFinder(object):
             self.count = 0
         return defer.succeed([self.peer_manager.get_peer("127.0.0.1", peer_port)])
 
+    @defer.inlineCallbacks
+    def find_peers_for_blobs(self, blob_hashes, timeout=None):
+        peers = {}
+        for blob_hash in blob_hashes:
+            peers[blob_hash] = yield self.find_peers_for_blob(blob_hash)
+        defer.returnValue(peers)
+
     def run_manage_loop(self):
         pass
 
@@ -154,6 +161,12 @@ class Announcer(object):
     def hash_queue_size(self):
         return 0
 
+    def get_hash_announce_duration(self):
+        return None
+
+    def add_priority_hashes_source(self, *args):
+        pass
+
     def add_supplier(self, supplier):
         pass
 
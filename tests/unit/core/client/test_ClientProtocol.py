@@ -0,0 +1,116 @@
+import json
+
+import mock
+from twisted.internet import defer, task
+from twisted.trial import unittest
+
+from lbrynet import conf
+from lbrynet.core import utils
+from lbrynet.core.client.ClientProtocol import ClientProtocol
+from lbrynet.core.client.ClientRequest import ClientRequest, ClientBlobRequest
+from lbrynet.core.MessageFraming import FRAMING_QUERY, frame_message
+
+
+class FakeTransport(object):
+    def __init__(self):
+        self.written = []
+        self.connected = True
+
+    def write(self, data):
+        self.written.append(data)
+
+    def loseConnection(self):
+        self.connected = False
+
+
+class FakeBlobDownload(object):
+    def __init__(self, blob_hash, length):
+        self.blob = mock.Mock(blob_hash=blob_hash, length=length)
+        self.data = ''
+        self.finished = defer.Deferred()
+        self.request = ClientBlobRequest({'requested_blob': blob_hash}, 'incoming_blob',
+                                         self.write, self.finished, self.finished.errback,
+                                         self.blob)
+
+    def write(self, data):
+        self.data += data
+        if len(self.data) == self.blob.length:
+            self.finished.callback(self.blob)
+
+
+class FakeConnectionManager(object):
+    """Adds the next scripted request to the protocol each time it's asked for one"""
+
+    def __init__(self, requests):
+        self.requests = requests
+        self.responses = []
+
+    def get_next_request(self, peer, protocol):
+        if not self.requests:
+            return defer.succeed(False)
+        request = self.requests.pop(0)
+        if isinstance(request, FakeBlobDownload):
+            d = protocol.add_blob_request(request.request)
+        else:
+            d = protocol.add_request(request)
+        d.addCallback(self.responses.append)
+        return defer.succeed(True)
+
+
+class ClientProtocolTest(unittest.TestCase):
+    def setUp(self):
+        conf.initialize_settings()
+        self.clock = task.Clock()
+        self.patch(utils, 'call_later', self.clock.callLater)
+        self.transport = FakeTransport()
+
+    def _connect(self, requests):
+        self.connection_manager = FakeConnectionManager(requests)
+        self.protocol = ClientProtocol()
+        self.protocol.factory = mock.Mock(connection_manager=self.connection_manager)
+        self.protocol.transport = self.transport
+        self.protocol.connectionMade()
+
+    def _sent(self):
+        sent, self.transport.written = self.transport.written, []
+        return sent
+
+    def test_capabilities_are_asked_for_in_the_first_request(self):
+        self._connect([ClientRequest({'requested_blobs': ['a']}, 'available_blobs')])
+        request = json.loads(self._sent()[0])
+        self.assertEqual(1, request[FRAMING_QUERY])
+        self.assertEqual(1, request[ClientProtocol.PIPELINING_QUERY])
+
+    def test_blobs_are_requested_one_at_a_time_without_pipelining(self):
+        first, second = FakeBlobDownload('a', 4), FakeBlobDownload('b', 3)
+        self._connect([first, second])
+        self._sent()
+        self.protocol.dataReceived(
+            json.dumps({'incoming_blob': {'blob_hash': 'a', 'length': 4}}) + 'ab')
+        self.assertEqual([], self._sent())
+        self.protocol.dataReceived('cd')
+        self.assertEqual('abcd', first.data)
+        self.assertEqual({'requested_blob': 'b'}, json.loads(self._sent()[0]))
+
+    def test_next_blob_is_requested_while_the_blob_downloads(self):
+        first, second = FakeBlobDownload('a', 4), FakeBlobDownload('b', 3)
+        self._connect([first, second])
+        self._sent()
+        self.protocol.dataReceived(json.dumps({
+            'incoming_blob': {'blob_hash': 'a', 'length': 4},
+            FRAMING_QUERY: 1,
+            ClientProtocol.PIPELINING_QUERY: 1,
+        }) + 'ab')
+        sent = self._sent()
+        self.assertEqual(1, len(sent))
+        self.assertEqual(frame_message(json.dumps({'requested_blob': 'b'})), sent[0])
+        self.protocol.dataReceived(
+            'cd' + frame_message(json.dumps({'incoming_blob': {'blob_hash': 'b', 'length': 3}})) +
+            'e')
+        self.assertEqual('abcd', first.data)
+        self.assertEqual('e', second.data)
+        self.protocol.dataReceived('fg')
+        self.assertEqual('efg', second.data)
+        self.assertEqual(2, len(self.connection_manager.responses))
+        self.assertEqual([], self._sent())
+        self.assertFalse(self.transport.connected)
@@ -1,6 +1,7 @@
 import sys
 import time
 import logging
+import mock
 
 from lbrynet.core import log_support
 from lbrynet.core.client.ClientRequest import ClientRequest
@@ -224,3 +225,125 @@ class TestIntegrationConnectionManager(unittest.TestCase):
         self.assertEqual(1, self.TEST_PEER.down_count)
 
 
+
+class DeferredRequestCreator(object):
+    implements(IRequestCreator)
+    def __init__(self):
+        self.searches = []
+
+    def get_new_peers(self):
+        d = defer.Deferred()
+        self.searches.append(d)
+        return d
+
+
+class TestEventDrivenConnectionManager(unittest.TestCase):
+    def setUp(self):
+        conf.initialize_settings()
+        self.clock = task.Clock()
+        utils.call_later = self.clock.callLater
+        from lbrynet.core.client.ConnectionManager import ConnectionManager
+        self.request_creators = [DeferredRequestCreator(), DeferredRequestCreator()]
+        self.connection_manager = ConnectionManager(MocDownloader(), RateLimiter(),
+                                                    self.request_creators, [])
+        self.connected = []
+        self.connection_manager._connect_to_peer = self.connected.append
+        self.connection_manager._start()
+
+    def tearDown(self):
+        self.connection_manager.stop()
+        conf.settings = None
+
+    def test_peer_searches_run_in_parallel(self):
+        peer1, peer2 = Peer(LOCAL_HOST, PEER_PORT), Peer(LOCAL_HOST, PEER_PORT + 1)
+        d = self.connection_manager.manage(schedule_next_call=False)
+        self.assertEqual(1, len(self.request_creators[0].searches))
+        self.assertEqual(1, len(self.request_creators[1].searches))
+        # peers are connected to as soon as the search which found them finishes
+        self.request_creators[1].searches[0].callback([peer2])
+        self.assertEqual([peer2], self.connected)
+        self.assertFalse(d.called)
+        self.request_creators[0].searches[0].callback([peer1])
+        self.assertEqual([peer2, peer1], self.connected)
+        self.assertTrue(d.called)
+
+    def test_failed_search_does_not_stop_the_others(self):
+        peer = Peer(LOCAL_HOST, PEER_PORT)
+        d = self.connection_manager.manage(schedule_next_call=False)
+        self.request_creators[0].searches[0].errback(Exception('no peers'))
+        self.request_creators[1].searches[0].callback([peer])
+        self.assertEqual([peer], self.connected)
+        self.assertTrue(d.called)
+
+    def test_disconnect_triggers_manage_after_debounce(self):
+        manager = self.connection_manager
+        manager._next_manage_call = self.clock.callLater(manager.MANAGE_CALL_INTERVAL_SEC,
+                                                         manager.manage)
+        manager._peer_disconnected(False, Peer(LOCAL_HOST, PEER_PORT))
+        manager.blob_downloaded(None)
+        self.clock.advance(manager.MANAGE_DEBOUNCE_SEC)
+        # both events are handled by one manage call, well before the backstop timer
+        self.assertEqual(1, len(self.request_creators[0].searches))
+        for request_creator in self.request_creators:
+            request_creator.searches[0].callback([])
+        self.clock.advance(manager.MANAGE_CALL_INTERVAL_SEC)
+        self.assertEqual(2, len(self.request_creators[0].searches))
+
+    def test_event_during_manage_triggers_another(self):
+        manager = self.connection_manager
+        manager.manage(schedule_next_call=False)
+        manager.blob_downloaded(None)
+        self.clock.advance(manager.MANAGE_DEBOUNCE_SEC)
+        self.assertEqual(1, len(self.request_creators[0].searches))
+        for request_creator in self.request_creators:
+            request_creator.searches[0].callback([])
+        # the next search waits until MIN_PEER_SEARCH_INTERVAL_SEC after the first one started
+        self.clock.advance(manager.MANAGE_DEBOUNCE_SEC)
+        self.assertEqual(1, len(self.request_creators[0].searches))
+        self.clock.advance(manager.MIN_PEER_SEARCH_INTERVAL_SEC)
+        self.clock.advance(manager.MANAGE_DEBOUNCE_SEC)
+        self.assertEqual(2, len(self.request_creators[0].searches))
+
+    def test_completions_in_a_row_start_one_search(self):
+        manager = self.connection_manager
+        for _ in range(5):
+            manager.blob_downloaded(None)
+            self.clock.advance(manager.MANAGE_DEBOUNCE_SEC)
+            for request_creator in self.request_creators:
+                for search in request_creator.searches:
+                    if not search.called:
+                        search.callback([])
+        self.assertEqual(1, len(self.request_creators[0].searches))
+        self.assertEqual(1, len(self.request_creators[1].searches))
+        # the completions after the first search are handled by one more search, once the
+        # interval has passed
+        self.clock.advance(manager.MIN_PEER_SEARCH_INTERVAL_SEC)
+        self.clock.advance(manager.MANAGE_DEBOUNCE_SEC)
+        self.assertEqual(2, len(self.request_creators[0].searches))
+
+    def test_disconnected_peer_is_replaced_from_the_last_search(self):
+        from lbrynet.core.client.ConnectionManager import PeerConnectionHandler
+        manager = self.connection_manager
+        max_connections = conf.settings['max_connections_per_stream']
+        peers = [Peer(LOCAL_HOST, PEER_PORT + i) for i in range(max_connections + 1)]
+
+        def connect(peer):
+            self.connected.append(peer)
+            manager._peer_connections[peer] = PeerConnectionHandler([], None)
+            manager._peer_connections[peer].connection = mock.Mock()
+        manager._connect_to_peer = connect
+
+        manager.manage(schedule_next_call=False)
+        for request_creator in self.request_creators:
+            request_creator.searches[0].callback(peers)
+        self.assertEqual(max_connections, len(manager._peer_connections))
+        self.clock.advance(1)
+        dropped = self.connected[0]
+        manager._peer_disconnected(False, dropped)
+        self.clock.advance(manager.MANAGE_DEBOUNCE_SEC)
+        # the spare peer from the last search is connected to without another search
+        self.assertEqual(max_connections, len(manager._peer_connections))
+        self.assertNotIn(dropped, manager._peer_connections)
+        self.assertEqual(max_connections + 1, len(self.connected))
+        self.assertEqual(1, len(self.request_creators[0].searches))
+        manager._peer_connections.clear()
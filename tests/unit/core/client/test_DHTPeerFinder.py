@@ -0,0 +1,39 @@
+import binascii
+
+from twisted.internet import defer
+from twisted.trial import unittest
+
+from lbrynet.core.PeerManager import PeerManager
+from lbrynet.core.client.DHTPeerFinder import DHTPeerFinder
+
+
+class FakeDHTNode(object):
+    def __init__(self, results):
+        self.results = results  # {blob_hash: deferred of [(host, port)]}
+
+    def getPeersForBlobs(self, bin_hashes):
+        return {bin_hash: self.results[binascii.hexlify(bin_hash)] for bin_hash in bin_hashes}
+
+
+class FindPeersForBlobsTest(unittest.TestCase):
+    @defer.inlineCallbacks
+    def test_failed_lookups_are_left_out(self):
+        found, empty, failed = 'aa' * 48, 'bb' * 48, 'cc' * 48
+        node = FakeDHTNode({
+            found: defer.succeed([('1.2.3.4', 3333)]),
+            empty: defer.succeed([]),
+            failed: defer.fail(ValueError('lookup failed')),
+        })
+        finder = DHTPeerFinder(node, PeerManager())
+        peers = yield finder.find_peers_for_blobs([found, empty, failed])
+        self.assertEqual(sorted([found, empty]), sorted(peers))
+        self.assertEqual([], peers[empty])
+        self.assertEqual([('1.2.3.4', 3333)], [(p.host, p.port) for p in peers[found]])
+
+    @defer.inlineCallbacks
+    def test_timed_out_lookups_are_left_out(self):
+        found, slow = 'aa' * 48, 'bb' * 48
+        node = FakeDHTNode({found: defer.succeed([('1.2.3.4', 3333)]), slow: defer.Deferred()})
+        finder = DHTPeerFinder(node, PeerManager())
+        peers = yield finder.find_peers_for_blobs([found, slow], timeout=0.01)
+        self.assertEqual([found], list(peers))
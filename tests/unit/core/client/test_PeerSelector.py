@@ -0,0 +1,80 @@
+from twisted.trial import unittest
+
+from lbrynet import conf
+from lbrynet.core.Peer import Peer
+from lbrynet.core.client import PeerSelector
+
+
+def make_peer(port, rate=None, response_time=None, downloads=0, failures=0, payment_rate=None):
+    peer = Peer('1.2.3.4', port)
+    for _ in range(downloads):
+        peer.report_download(rate, 1.0)
+    if response_time is not None:
+        peer.report_response_time(response_time)
+    for _ in range(failures):
+        peer.report_failure()
+    if payment_rate is not None:
+        peer.report_payment_rate(payment_rate)
+    return peer
+
+
+class PeerTest(unittest.TestCase):
+    def test_measurements_are_smoothed(self):
+        peer = Peer('1.2.3.4', 3333)
+        self.assertIsNone(peer.download_rate)
+        peer.report_download(1000, 2.0)
+        self.assertEqual(500, peer.download_rate)
+        peer.report_download(1500, 1.0)
+        self.assertAlmostEqual(500 + Peer.SMOOTHING * 1000, peer.download_rate)
+
+    def test_failure_rate(self):
+        peer = Peer('1.2.3.4', 3333)
+        self.assertEqual(0, peer.get_failure_rate())
+        peer.report_download(1000, 1.0)
+        peer.report_failure()
+        peer.report_down()
+        self.assertAlmostEqual(2.0 / 3, peer.get_failure_rate())
+
+
+class UCBPeerSelectorTest(unittest.TestCase):
+    def setUp(self):
+        conf.initialize_settings()
+        self.selector = PeerSelector.get_peer_selector('ucb')
+
+    def test_fast_peers_are_preferred(self):
+        slow = make_peer(1, rate=100000, downloads=20)
+        fast = make_peer(2, rate=2000000, downloads=20)
+        medium = make_peer(3, rate=500000, downloads=20)
+        self.assertEqual([fast, medium], self.selector.pick_peers([slow, medium, fast], 2))
+
+    def test_unmeasured_peers_are_tried_first(self):
+        fast = make_peer(1, rate=2000000, downloads=20)
+        new = make_peer(2)
+        self.assertEqual([new], self.selector.pick_peers([fast, new], 1))
+
+    def test_failing_and_expensive_peers_rank_lower(self):
+        failing = make_peer(1, rate=2000000, downloads=10, failures=10)
+        expensive = make_peer(2, rate=2000000, downloads=20, payment_rate=0.003)
+        good = make_peer(3, rate=2000000, downloads=20, payment_rate=0.002)
+        self.assertEqual([good, expensive, failing],
+                         self.selector.pick_peers([failing, expensive, good], 3))
+
+    def test_slow_responses_count_against_a_peer(self):
+        slow_to_respond = make_peer(1, rate=2000000, response_time=5.0, downloads=20)
+        quick = make_peer(2, rate=1500000, response_time=0.1, downloads=20)
+        self.assertEqual([quick], self.selector.pick_peers([slow_to_respond, quick], 1))
+
+    def test_rarely_measured_peer_is_explored(self):
+        fast = make_peer(1, rate=2000000, downloads=200)
+        once_slow = make_peer(2, rate=1500000, downloads=1)
+        self.assertEqual([once_slow], self.selector.pick_peers([fast, once_slow], 1))
+
+
+class GetPeerSelectorTest(unittest.TestCase):
+    def test_random_selector(self):
+        peers = [make_peer(port) for port in range(10)]
+        picked = PeerSelector.get_peer_selector('random').pick_peers(peers, 3)
+        self.assertEqual(3, len(set(picked)))
+
+    def test_unknown_selector(self):
+        self.assertRaises(ValueError, PeerSelector.get_peer_selector, 'fastest')
@@ -127,3 +127,20 @@ class TestBlobRequestHandlerSender(unittest.TestCase):
         while consumer.producer:
             consumer.producer.resumeProducing()
         self.assertEqual(consumer.value(), 'test')
+
+    def test_file_is_sent_with_sendfile_when_consumer_supports_it(self):
+        consumer = mock.Mock()
+        consumer.can_sendfile.return_value = True
+        consumer.sendfile.return_value = defer.succeed(4)
+        test_file = open(self.mktemp(), 'w+b')
+        self.addCleanup(test_file.close)
+        test_file.write('test')
+        test_file.seek(0)
+        handler = BlobRequestHandler.BlobRequestHandler(None, None, None, None)
+        handler.peer = mock.create_autospec(Peer.Peer)
+        handler.currently_uploading = mock.Mock()
+        handler.currently_uploading.length = 4
+        handler.read_handle = test_file
+        handler.send_blob_if_requested(consumer)
+        consumer.sendfile.assert_called_once_with(test_file, 0, 4)
+        self.assertEqual(4, handler.blob_bytes_uploaded)
@@ -9,10 +9,12 @@ from tests.util import random_lbry_hash
 class MocDHTNode(object):
     def __init__(self):
         self.blobs_announced = 0
+        self.groups_announced = []
 
-    def announceHaveBlob(self,blob,port):
-        self.blobs_announced += 1
-        return defer.succeed(True)
+    def announceHaveBlobs(self, blobs, port, parallelism=None):
+        self.blobs_announced += len(blobs)
+        self.groups_announced.append(blobs)
+        return dict((blob, defer.succeed(True)) for blob in blobs)
 
 class MocSupplier(object):
     def __init__(self, blobs_to_announce):
@@ -41,6 +43,7 @@ class DHTHashAnnouncerTest(unittest.TestCase):
         self.announcer.add_supplier(self.supplier)
 
     def test_basic(self):
+        self.announcer.ANNOUNCE_GROUP_SIZE = 1
         self.announcer._announce_available_hashes()
         self.assertEqual(self.announcer.hash_queue_size(),self.announcer.CONCURRENT_ANNOUNCERS)
         self.clock.advance(1)
@@ -49,9 +52,64 @@ class DHTHashAnnouncerTest(unittest.TestCase):
 
     def test_immediate_announce(self):
         # Test that immediate announce puts a hash at the front of the queue
+        self.announcer.ANNOUNCE_GROUP_SIZE = 1
         self.announcer._announce_available_hashes()
         blob_hash = random_lbry_hash()
         self.announcer.immediate_announce([blob_hash])
         self.assertEqual(self.announcer.hash_queue_size(),self.announcer.CONCURRENT_ANNOUNCERS+1)
         self.assertEqual(blob_hash, self.announcer.hash_queue[0][0])
 
+    def test_hashes_are_announced_in_groups_of_neighbours(self):
+        self.announcer.ANNOUNCE_GROUP_SIZE = 4
+        self.announcer.CONCURRENT_ANNOUNCERS = 1
+        self.announcer.concurrent_announcers = 1
+        self.announcer._announce_available_hashes()
+        self.clock.advance(1)
+        self.clock.advance(1)
+        self.clock.advance(1)
+        announced = [blob.encode('hex') for group in self.dht_node.groups_announced
+                     for blob in group]
+        self.assertEqual(sorted(self.blobs_to_announce), announced)
+        self.assertEqual([4, 4, 2], [len(group) for group in self.dht_node.groups_announced])
+
+    def test_concurrency_follows_announce_time(self):
+        self.announcer._update_concurrency(10, 1.0)
+        self.assertEqual(self.announcer.CONCURRENT_ANNOUNCERS + 1,
+                         self.announcer.concurrent_announcers)
+        self.announcer._update_concurrency(10, 1.0)
+        self.assertEqual(self.announcer.CONCURRENT_ANNOUNCERS + 2,
+                         self.announcer.concurrent_announcers)
+        for _ in range(10):
+            self.announcer._update_concurrency(10, 10.0)
+        self.assertTrue(self.announcer.concurrent_announcers < self.announcer.CONCURRENT_ANNOUNCERS)
+        self.assertTrue(self.announcer.get_hash_announce_duration() > 0.1)
+
+    def test_priority_hashes_are_reannounced_first(self):
+        self.announcer.ANNOUNCE_GROUP_SIZE = 1
+        self.announcer.CONCURRENT_ANNOUNCERS = 1
+        self.announcer.concurrent_announcers = 1
+        sd_hash = random_lbry_hash()
+        self.announcer.add_priority_hashes_source(lambda: defer.succeed([sd_hash]))
+        self.announcer._announce_available_hashes()
+        self.assertEqual([sd_hash.decode('hex')], self.dht_node.groups_announced[0])
+        # it isn't reannounced again until PRIORITY_REANNOUNCE_TIME has passed
+        self.announcer._announce_available_hashes()
+        self.assertEqual(1, self.dht_node.groups_announced.count([sd_hash.decode('hex')]))
+        self.announcer._priority_announce_times[sd_hash] -= self.announcer.PRIORITY_REANNOUNCE_TIME
+        self.announcer._announce_available_hashes()
+        self.clock.advance(1)
+        # ahead of the data blobs which were queued before it
+        self.assertEqual([sd_hash.decode('hex')], self.dht_node.groups_announced[1])
+        self.assertEqual(2, self.dht_node.groups_announced.count([sd_hash.decode('hex')]))
+
+
+    def test_failing_priority_source_is_skipped(self):
+        self.announcer.ANNOUNCE_GROUP_SIZE = 1
+        sd_hash = random_lbry_hash()
+        self.announcer.add_priority_hashes_source(lambda: defer.fail(ValueError('db is gone')))
+        self.announcer.add_priority_hashes_source(lambda: defer.succeed([sd_hash]))
+        d = self.announcer._announce_available_hashes()
+        self.assertEqual([sd_hash.decode('hex')], self.dht_node.groups_announced[0])
+        d.addCallback(lambda results: self.assertTrue(all(success for success, _ in results)))
+        self.clock.advance(1)
+        return d
@@ -0,0 +1,89 @@
+import errno
+
+import mock
+from twisted.internet import error
+from twisted.trial import unittest
+
+from lbrynet.core.server import ServerProtocol
+
+
+class FakeTCPTransport(object):
+    """Calls the registered pull producer whenever writing is started, like a transport with an
+    empty write buffer and a writable socket would"""
+
+    def __init__(self):
+        self.producer = None
+
+    def fileno(self):
+        return 42
+
+    def registerProducer(self, producer, streaming):
+        self.producer = producer
+
+    def unregisterProducer(self):
+        self.producer = None
+
+    def startWriting(self):
+        if self.producer is not None:
+            self.producer.resumeProducing()
+
+
+class SendfileProducerTest(unittest.TestCase):
+    def setUp(self):
+        self.transport = FakeTCPTransport()
+        self.file_handle = mock.Mock()
+        self.file_handle.fileno.return_value = 7
+        self.reported = []
+
+    def _make_producer(self, offset, count):
+        return ServerProtocol.SendfileProducer(
+            self.transport, self.file_handle, offset, count, self.reported.append)
+
+    def test_file_is_sent_in_chunks(self):
+        sendfile = mock.Mock(side_effect=lambda out_fd, in_fd, offset, count: min(count, 3))
+        self.patch(ServerProtocol, 'sendfile', sendfile)
+        d = self._make_producer(2, 8).begin_transfer()
+        self.assertEqual(8, self.successResultOf(d))
+        self.assertEqual([3, 3, 2], self.reported)
+        self.assertEqual(
+            [mock.call(42, 7, 2, 8), mock.call(42, 7, 5, 5), mock.call(42, 7, 8, 2)],
+            sendfile.call_args_list)
+        self.assertIsNone(self.transport.producer)
+
+    def test_paused_producer_waits_to_be_resumed(self):
+        sendfile = mock.Mock(side_effect=lambda out_fd, in_fd, offset, count: count)
+        self.patch(ServerProtocol, 'sendfile', sendfile)
+        producer = self._make_producer(0, 10)
+        producer.pause()
+        d = producer.begin_transfer()
+        self.assertNoResult(d)
+        self.assertFalse(sendfile.called)
+        producer.resume()
+        self.assertEqual(10, self.successResultOf(d))
+
+    def test_would_block_is_retried(self):
+        results = [IOError(errno.EAGAIN, "try again"), 10]
+
+        def sendfile(out_fd, in_fd, offset, count):
+            result = results.pop(0)
+            if isinstance(result, Exception):
+                raise result
+            return result
+
+        self.patch(ServerProtocol, 'sendfile', sendfile)
+        d = self._make_producer(0, 10).begin_transfer()
+        self.assertEqual(10, self.successResultOf(d))
+
+    def test_truncated_file_fails(self):
+        self.patch(ServerProtocol, 'sendfile', mock.Mock(return_value=0))
+        d = self._make_producer(0, 10).begin_transfer()
+        self.failureResultOf(d, IOError)
+        self.assertIsNone(self.transport.producer)
+
+    def test_lost_connection_fails(self):
+        self.patch(ServerProtocol, 'sendfile', mock.Mock(return_value=0))
+        producer = self._make_producer(0, 10)
+        producer.pause()
+        d = producer.begin_transfer()
+        producer.stopProducing()
+        self.failureResultOf(d, error.ConnectionLost)
@@ -0,0 +1,110 @@
+import json
+
+import mock
+from twisted.internet import defer, reactor
+from twisted.trial import unittest
+
+from lbrynet.core import MessageFraming
+from lbrynet.core.server.ServerRequestHandler import ServerRequestHandler
+
+
+class FakeConsumer(object):
+    def __init__(self):
+        self.written = []
+        self.sent_files = []
+        self.closed = False
+
+    def registerProducer(self, producer, streaming):
+        pass
+
+    def unregisterProducer(self):
+        self.closed = True
+
+    def write(self, data):
+        self.written.append(data)
+
+    def sendfile(self, file_handle, offset, count):
+        self.sent_files.append((file_handle, offset, count))
+        return defer.succeed(count)
+
+
+class FakeQueryHandler(object):
+    def handle_queries(self, queries):
+        return defer.succeed({'echo': queries.get('echo')})
+
+
+class FakeBlobSender(object):
+    def __init__(self, upload):
+        self.upload = upload
+        self.uploads = 0
+
+    def send_blob_if_requested(self, consumer):
+        self.uploads += 1
+        return self.upload
+
+
+class ServerRequestHandlerTest(unittest.TestCase):
+    def setUp(self):
+        self.consumer = FakeConsumer()
+        self.handler = ServerRequestHandler(self.consumer)
+        self.handler.register_query_handler(FakeQueryHandler(), ['echo'])
+        # keep responses in the buffer instead of writing them to the consumer
+        self.handler.production_paused = True
+
+    def _take_response(self):
+        response, self.handler.response_buff = self.handler.response_buff, ''
+        return response
+
+    def test_framing_is_agreed_to(self):
+        request = {'echo': 1, MessageFraming.FRAMING_QUERY: MessageFraming.FRAMING_VERSION}
+        self.handler.data_received(json.dumps(request))
+        self.assertEqual({'echo': 1, MessageFraming.FRAMING_QUERY: MessageFraming.FRAMING_VERSION},
+                         json.loads(self._take_response()))
+        self.handler.data_received(MessageFraming.frame_message(json.dumps({'echo': 2})))
+        self.assertEqual(MessageFraming.frame_message(json.dumps({'echo': 2})),
+                         self._take_response())
+
+    def test_unframed_without_request(self):
+        self.handler.data_received(json.dumps({'echo': 1}))
+        self.assertEqual({'echo': 1}, json.loads(self._take_response()))
+        self.handler.data_received(json.dumps({'echo': 2}))
+        self.assertEqual({'echo': 2}, json.loads(self._take_response()))
+
+    def test_pipelined_request_waits_for_the_blob_upload(self):
+        upload = defer.Deferred()
+        blob_sender = FakeBlobSender(upload)
+        self.handler.register_blob_sender(blob_sender)
+        self.handler.data_received(json.dumps({'echo': 1}) + json.dumps({'echo': 2}))
+        self.assertEqual({'echo': 1}, json.loads(self._take_response()))
+        self.handler.data_received(json.dumps({'echo': 3}))
+        self.assertEqual('', self._take_response())
+        self.assertEqual(1, blob_sender.uploads)
+        blob_sender.upload = defer.succeed(True)
+        upload.callback(True)
+        self.assertEqual('{"echo": 2}{"echo": 3}', self._take_response())
+        self.assertEqual(3, blob_sender.uploads)
+
+    def test_pipelining_is_agreed_to(self):
+        request = {'echo': 1, ServerRequestHandler.PIPELINING_QUERY: 1}
+        self.handler.data_received(json.dumps(request))
+        self.assertEqual({'echo': 1,
+                          ServerRequestHandler.PIPELINING_QUERY:
+                              ServerRequestHandler.PIPELINING_VERSION},
+                         json.loads(self._take_response()))
+
+    def test_invalid_framed_request_closes_the_connection(self):
+        self.handler.data_received(json.dumps({'echo': 1, MessageFraming.FRAMING_QUERY: 1}))
+        self._take_response()
+        self.handler.data_received(MessageFraming.frame_message('{"echo": '))
+        self.assertTrue(self.consumer.closed)
+        self.assertEqual('', self._take_response())
+
+    def test_sendfile_waits_for_the_response_to_be_written(self):
+        self.handler.send_response({'echo': 1})
+        d = self.handler.sendfile('file', 0, 10)
+        self.assertEqual([], self.consumer.sent_files)
+        with mock.patch.object(reactor, 'callLater'):
+            self.handler.resumeProducing()
+        self.assertEqual([json.dumps({'echo': 1})], self.consumer.written)
+        self.assertEqual([('file', 0, 10)], self.consumer.sent_files)
+        self.assertEqual(10, self.successResultOf(d))
@@ -0,0 +1,60 @@
+import mock
+from twisted.trial import unittest
+
+from lbrynet.core.BlobCache import LRUBlobCache
+
+
+def make_blob(blob_hash, readers=0, writers=None):
+    blob = mock.Mock()
+    blob.blob_hash = blob_hash
+    blob.readers = readers
+    blob.writers = writers or {}
+    return blob
+
+
+class LRUBlobCacheTest(unittest.TestCase):
+    def test_evicts_least_recently_used(self):
+        cache = LRUBlobCache(2)
+        cache['a'] = make_blob('a')
+        cache['b'] = make_blob('b')
+        cache.get('a')
+        cache['c'] = make_blob('c')
+        self.assertEqual(['a', 'c'], sorted(cache.iterkeys()))
+        self.assertEqual(1, cache.evictions)
+
+    def test_does_not_evict_blobs_in_use(self):
+        cache = LRUBlobCache(1)
+        cache['a'] = make_blob('a', readers=1)
+        cache['b'] = make_blob('b', writers={'peer': None})
+        self.assertEqual(2, len(cache))
+        cache['a'].readers = 0
+        cache['c'] = make_blob('c')
+        self.assertEqual(['b', 'c'], list(cache.iterkeys()))
+
+    def test_evicts_only_the_least_recently_used_idle_blob(self):
+        cache = LRUBlobCache(3)
+        cache['a'] = make_blob('a', readers=1)
+        cache['b'] = make_blob('b')
+        cache['c'] = make_blob('c')
+        cache['d'] = make_blob('d')
+        self.assertEqual(['a', 'c', 'd'], list(cache.iterkeys()))
+        self.assertEqual(1, cache.evictions)
+
+    def test_evicted_blob_still_referenced_is_returned(self):
+        cache = LRUBlobCache(1)
+        blob = make_blob('a')
+        cache['a'] = blob
+        cache['b'] = make_blob('b')
+        self.assertFalse('a' in list(cache.iterkeys()))
+        self.assertIs(blob, cache.get('a'))
+
+    def test_hit_and_miss_counts(self):
+        cache = LRUBlobCache(10)
+        self.assertIsNone(cache.get('a'))
+        cache['a'] = make_blob('a')
+        cache.get('a')
+        cache.get('a')
+        stats = cache.get_stats()
+        self.assertEqual(2, stats['hits'])
+        self.assertEqual(1, stats['misses'])
+        self.assertEqual(1, stats['size'])
@@ -0,0 +1,457 @@
+import os
+import shutil
+import tempfile
+import time
+
+import mock
+
+from twisted.trial import unittest
+from twisted.internet import defer
+
+from lbrynet import conf
+from lbrynet.core.BlobManager import DiskBlobManager, PackedBlobManager
+from lbrynet.core.cryptoutils import get_lbry_hash_obj
+from lbrynet.core.server.DHTHashAnnouncer import DHTHashAnnouncer
+from tests.util import random_lbry_hash
+
+
+class DiskBlobManagerTest(unittest.TestCase):
+    def setUp(self):
+        conf.initialize_settings()
+        self.blob_dir = tempfile.mkdtemp()
+        self.db_dir = tempfile.mkdtemp()
+        self.bm = DiskBlobManager(DHTHashAnnouncer(None, None), self.blob_dir, self.db_dir, cache_size=2)
+        return self.bm.setup()
+
+    @defer.inlineCallbacks
+    def tearDown(self):
+        yield self.bm.stop()
+        shutil.rmtree(self.blob_dir)
+        shutil.rmtree(self.db_dir)
+        conf.settings = None
+
+    def _write_blob(self, data):
+        h = get_lbry_hash_obj()
+        h.update(data)
+        blob_hash = h.hexdigest()
+        with open(os.path.join(self.blob_dir, blob_hash), 'wb') as f:
+            f.write(data)
+        return blob_hash
+
+    @defer.inlineCallbacks
+    def test_blob_cache_is_bounded(self):
+        for _ in range(5):
+            yield self.bm.get_blob(random_lbry_hash())
+        self.assertEqual(2, len(self.bm.blobs))
+        stats = self.bm.get_cache_stats()
+        self.assertEqual(5, stats['misses'])
+        self.assertEqual(3, stats['evictions'])
+
+    @defer.inlineCallbacks
+    def test_get_blob_returns_cached_blob(self):
+        blob_hash = self._write_blob('hello')
+        blob = yield self.bm.get_blob(blob_hash)
+        self.assertTrue(blob.verified)
+        same_blob = yield self.bm.get_blob(blob_hash)
+        self.assertIs(blob, same_blob)
+        self.assertEqual(1, self.bm.get_cache_stats()['hits'])
+
+
+class VerifiedBlobIndexTest(unittest.TestCase):
+    def setUp(self):
+        conf.initialize_settings()
+        self.blob_dir = tempfile.mkdtemp()
+        self.db_dir = tempfile.mkdtemp()
+        self.blob_hash = random_lbry_hash()
+        open(os.path.join(self.blob_dir, self.blob_hash), 'wb').close()
+        open(os.path.join(self.blob_dir, 'tmpabc123'), 'wb').close()
+        self.bm = DiskBlobManager(DHTHashAnnouncer(None, None), self.blob_dir, self.db_dir)
+        return self.bm.setup()
+
+    @defer.inlineCallbacks
+    def tearDown(self):
+        yield self.bm.stop()
+        shutil.rmtree(self.blob_dir)
+        shutil.rmtree(self.db_dir)
+        conf.settings = None
+
+    def test_setup_scans_blob_dir(self):
+        self.assertEqual(set([self.blob_hash]), self.bm.verified_blob_hashes)
+
+    @defer.inlineCallbacks
+    def test_completed_blobs_does_not_touch_disk(self):
+        missing = random_lbry_hash()
+        with mock.patch('os.path.isfile') as isfile:
+            completed = yield self.bm.completed_blobs([self.blob_hash, missing])
+            self.assertFalse(isfile.called)
+        self.assertEqual([self.blob_hash], completed)
+
+    @defer.inlineCallbacks
+    def test_index_follows_completion_and_deletion(self):
+        blob = mock.Mock(blob_hash=random_lbry_hash(), length=10)
+        yield self.bm.blob_completed(blob)
+        completed = yield self.bm.completed_blobs([blob.blob_hash])
+        self.assertEqual([blob.blob_hash], completed)
+        self.bm.delete_blobs([blob.blob_hash])
+        completed = yield self.bm.completed_blobs([blob.blob_hash])
+        self.assertEqual([], completed)
+
+
+class BatchedDBWriteTest(unittest.TestCase):
+    def setUp(self):
+        conf.initialize_settings()
+        self.blob_dir = tempfile.mkdtemp()
+        self.db_dir = tempfile.mkdtemp()
+        self.bm = DiskBlobManager(DHTHashAnnouncer(None, None), self.blob_dir, self.db_dir)
+        return self.bm.setup()
+
+    @defer.inlineCallbacks
+    def tearDown(self):
+        yield self.bm.stop()
+        shutil.rmtree(self.blob_dir)
+        shutil.rmtree(self.db_dir)
+        conf.settings = None
+
+    def _get_db_blob_hashes(self):
+        d = self.bm.db_conn.runQuery("select blob_hash from blobs")
+        d.addCallback(lambda rows: sorted(r[0] for r in rows))
+        return d
+
+    @defer.inlineCallbacks
+    def test_writes_are_batched_into_one_transaction(self):
+        blobs = [mock.Mock(blob_hash=random_lbry_hash(), length=10) for _ in range(10)]
+        with mock.patch.object(self.bm, '_run_db_writes', wraps=self.bm._run_db_writes) as w:
+            yield defer.DeferredList([self.bm.blob_completed(b) for b in blobs])
+            self.assertEqual(1, w.call_count)
+        blob_hashes = yield self._get_db_blob_hashes()
+        self.assertEqual(sorted(b.blob_hash for b in blobs), blob_hashes)
+
+    @defer.inlineCallbacks
+    def test_delete_cancels_pending_completion(self):
+        blob = mock.Mock(blob_hash=random_lbry_hash(), length=10)
+        d = self.bm.blob_completed(blob)
+        yield self.bm._delete_blobs_from_db([blob.blob_hash])
+        yield d
+        blob_hashes = yield self._get_db_blob_hashes()
+        self.assertEqual([], blob_hashes)
+
+    @defer.inlineCallbacks
+    def test_verified_timestamp_is_written(self):
+        blob = mock.Mock(blob_hash=random_lbry_hash(), length=10)
+        yield self.bm.blob_completed(blob)
+        yield self.bm._update_blob_verified_timestamp(blob.blob_hash, 123.0)
+        rows = yield self.bm.db_conn.runQuery(
+            "select last_verified_time from blobs where blob_hash = ?", (blob.blob_hash,))
+        self.assertEqual([(123.0,)], rows)
+
+
+class ShardedBlobDirTest(unittest.TestCase):
+    def setUp(self):
+        conf.initialize_settings()
+        self.blob_dir = tempfile.mkdtemp()
+        self.db_dir = tempfile.mkdtemp()
+        self.data = 'flat blob'
+        h = get_lbry_hash_obj()
+        h.update(self.data)
+        self.blob_hash = h.hexdigest()
+        with open(os.path.join(self.blob_dir, self.blob_hash), 'wb') as f:
+            f.write(self.data)
+        self.bm = DiskBlobManager(DHTHashAnnouncer(None, None), self.blob_dir, self.db_dir,
+                                  shard_depth=2)
+
+    @defer.inlineCallbacks
+    def tearDown(self):
+        yield self.bm.stop()
+        shutil.rmtree(self.blob_dir)
+        shutil.rmtree(self.db_dir)
+        conf.settings = None
+
+    def _sharded_path(self, blob_hash):
+        return os.path.join(self.blob_dir, blob_hash[:2], blob_hash[2:4], blob_hash)
+
+    @defer.inlineCallbacks
+    def test_existing_blobs_are_migrated(self):
+        yield self.bm.setup()
+        self.assertFalse(os.path.isfile(os.path.join(self.blob_dir, self.blob_hash)))
+        self.assertTrue(os.path.isfile(self._sharded_path(self.blob_hash)))
+        blob = yield self.bm.get_blob(self.blob_hash)
+        self.assertTrue(blob.verified)
+        self.assertEqual(self._sharded_path(self.blob_hash), blob.file_path)
+
+    @defer.inlineCallbacks
+    def test_blob_in_use_is_readable_until_migrated(self):
+        with mock.patch.object(self.bm, '_migrate_blob_files'):
+            yield self.bm.setup()
+        blob = yield self.bm.get_blob(self.blob_hash)
+        read_handle = blob.open_for_reading()
+        self.bm._migrate_blob_files()
+        self.assertTrue(os.path.isfile(os.path.join(self.blob_dir, self.blob_hash)))
+        self.assertEqual(self.data, read_handle.read())
+        blob.close_read_handle(read_handle)
+        self.bm._next_migrate_call.cancel()
+        self.bm._migrate_blob_files()
+        self.assertEqual(self._sharded_path(self.blob_hash), blob.file_path)
+
+    @defer.inlineCallbacks
+    def test_created_blobs_are_sharded(self):
+        yield self.bm.setup()
+        creator = self.bm.get_blob_creator()
+        creator.write('new blob')
+        blob_hash = yield creator.close()
+        self.assertTrue(os.path.isfile(self._sharded_path(blob_hash)))
+        completed = yield self.bm.completed_blobs([blob_hash])
+        self.assertEqual([blob_hash], completed)
+
+
+class BlobScrubTest(unittest.TestCase):
+    def setUp(self):
+        conf.initialize_settings()
+        self.blob_dir = tempfile.mkdtemp()
+        self.db_dir = tempfile.mkdtemp()
+        self.bm = DiskBlobManager(DHTHashAnnouncer(None, None), self.blob_dir, self.db_dir)
+
+    @defer.inlineCallbacks
+    def tearDown(self):
+        yield self.bm.stop()
+        shutil.rmtree(self.blob_dir)
+        shutil.rmtree(self.db_dir)
+        conf.settings = None
+
+    def _write_blob(self, data, stored_data=None):
+        h = get_lbry_hash_obj()
+        h.update(data)
+        blob_hash = h.hexdigest()
+        with open(os.path.join(self.blob_dir, blob_hash), 'wb') as f:
+            f.write(data if stored_data is None else stored_data)
+        return blob_hash
+
+    @defer.inlineCallbacks
+    def _get_last_verified_time(self, blob_hash):
+        yield self.bm._flush_db_writes()
+        rows = yield self.bm.db_conn.runQuery(
+            "select last_verified_time from blobs where blob_hash = ?", (blob_hash,))
+        defer.returnValue(rows[0][0])
+
+    @defer.inlineCallbacks
+    def test_intact_blob_verified_time_is_updated(self):
+        blob_hash = self._write_blob('intact')
+        yield self.bm.setup()
+        yield self.bm.blob_completed(mock.Mock(blob_hash=blob_hash, length=6), 0)
+        completed_time = yield self._get_last_verified_time(blob_hash)
+        to_scrub = yield self.bm.get_blob_hashes_to_scrub(completed_time)
+        self.assertEqual([], to_scrub)
+        to_scrub = yield self.bm.get_blob_hashes_to_scrub(completed_time + 1)
+        self.assertEqual([blob_hash], to_scrub)
+
+        result = yield self.bm.scrub_blob(blob_hash)
+        self.assertEqual((6, False), result)
+        verified_time = yield self._get_last_verified_time(blob_hash)
+        self.assertGreaterEqual(verified_time, completed_time)
+        self.assertIn(blob_hash, self.bm.verified_blob_hashes)
+
+    @defer.inlineCallbacks
+    def test_corrupt_blob_is_quarantined(self):
+        blob_hash = self._write_blob('original', stored_data='0riginal')
+        yield self.bm.setup()
+        blob = yield self.bm.get_blob(blob_hash)
+        result = yield self.bm.scrub_blob(blob_hash)
+        self.assertEqual((8, True), result)
+        self.assertNotIn(blob_hash, self.bm.verified_blob_hashes)
+        self.assertFalse(blob.is_validated())
+        self.assertFalse(os.path.isfile(os.path.join(self.blob_dir, blob_hash)))
+        self.assertTrue(os.path.isfile(os.path.join(self.blob_dir, 'quarantine', blob_hash)))
+        new_blob = yield self.bm.get_blob(blob_hash)
+        self.assertIsNot(blob, new_blob)
+        self.assertFalse(new_blob.is_validated())
+
+    @defer.inlineCallbacks
+    def test_blob_file_without_row_is_added_when_scrubbed(self):
+        blob_hash = self._write_blob('no row')
+        yield self.bm.setup()
+        before = time.time()
+        result = yield self.bm.scrub_blob(blob_hash)
+        self.assertEqual((6, False), result)
+        verified_time = yield self._get_last_verified_time(blob_hash)
+        self.assertGreaterEqual(verified_time, before)
+        to_scrub = yield self.bm.get_blob_hashes_to_scrub(before)
+        self.assertEqual([], to_scrub)
+        lengths = yield self.bm._get_blob_lengths()
+        self.assertEqual([(blob_hash, 6)], lengths)
+
+    @defer.inlineCallbacks
+    def test_blobs_found_on_disk_are_scrubbed_first(self):
+        on_disk = self._write_blob('on disk')
+        completed = self._write_blob('completed')
+        yield self.bm.setup()
+        yield self.bm.blob_completed(mock.Mock(blob_hash=completed, length=9), 0)
+        yield self.bm._flush_db_writes()
+        to_scrub = yield self.bm.get_blob_hashes_to_scrub(time.time() + 1)
+        self.assertEqual([on_disk, completed], to_scrub)
+
+
+class PackedBlobManagerTest(unittest.TestCase):
+    def setUp(self):
+        conf.initialize_settings()
+        self.blob_dir = tempfile.mkdtemp()
+        self.db_dir = tempfile.mkdtemp()
+        self.bm = self._make_blob_manager()
+        return self.bm.setup()
+
+    @defer.inlineCallbacks
+    def tearDown(self):
+        yield self.bm.stop()
+        shutil.rmtree(self.blob_dir)
+        shutil.rmtree(self.db_dir)
+        conf.settings = None
+
+    def _make_blob_manager(self):
+        return PackedBlobManager(DHTHashAnnouncer(None, None), self.blob_dir, self.db_dir,
+                                 segment_size=20)
+
+    @defer.inlineCallbacks
+    def _create_blob(self, data):
+        creator = self.bm.get_blob_creator()
+        creator.write(data)
+        blob_hash = yield creator.close()
+        defer.returnValue(blob_hash)
+
+    @defer.inlineCallbacks
+    def _read_blob(self, blob_hash):
+        blob = yield self.bm.get_blob(blob_hash)
+        read_handle = blob.open_for_reading()
+        data = read_handle.read()
+        blob.close_read_handle(read_handle)
+        defer.returnValue(data)
+
+    @defer.inlineCallbacks
+    def test_blobs_are_appended_to_segments(self):
+        hashes = []
+        for data in ['a' * 10, 'b' * 10, 'c' * 10]:
+            blob_hash = yield self._create_blob(data)
+            hashes.append(blob_hash)
+        self.assertEqual([0, 1], self.bm.segment_store.get_segments())
+        data = yield self._read_blob(hashes[1])
+        self.assertEqual('b' * 10, data)
+
+    @defer.inlineCallbacks
+    def test_index_survives_restart(self):
+        blob_hash = yield self._create_blob('persisted')
+        yield self.bm.stop()
+        self.bm = self._make_blob_manager()
+        yield self.bm.setup()
+        completed = yield self.bm.completed_blobs([blob_hash])
+        self.assertEqual([blob_hash], completed)
+        data = yield self._read_blob(blob_hash)
+        self.assertEqual('persisted', data)
+
+    @defer.inlineCallbacks
+    def test_compaction_reclaims_deleted_blobs(self):
+        deleted = yield self._create_blob('d' * 10)
+        kept = yield self._create_blob('k' * 10)
+        yield self._create_blob('n' * 10)
+        self.bm.delete_blobs([deleted])
+        yield self.bm._delete_blobs_marked_for_deletion()
+        yield self.bm._flush_db_writes()
+        removed = yield self.bm.compact()
+        self.assertEqual(1, removed)
+        self.assertNotIn(0, self.bm.segment_store.get_segments())
+        data = yield self._read_blob(kept)
+        self.assertEqual('k' * 10, data)
+        completed = yield self.bm.completed_blobs([deleted, kept])
+        self.assertEqual([kept], completed)
+
+    @defer.inlineCallbacks
+    def test_downloaded_blob_is_packed(self):
+        data = 'downloaded'
+        h = get_lbry_hash_obj()
+        h.update(data)
+        blob = yield self.bm.get_blob(h.hexdigest(), len(data))
+        finished_d, write, _ = blob.open_for_writing('peer')
+        write(data)
+        yield finished_d
+        yield self.bm.blob_completed(blob)
+        self.assertEqual(0, blob.location[0])
+        read_data = yield self._read_blob(blob.blob_hash)
+        self.assertEqual(data, read_data)
+
+
+class PackedBlobMigrationTest(unittest.TestCase):
+    def setUp(self):
+        conf.initialize_settings()
+        self.blob_dir = tempfile.mkdtemp()
+        self.db_dir = tempfile.mkdtemp()
+        self.data = 'flat blob'
+        h = get_lbry_hash_obj()
+        h.update(self.data)
+        self.blob_hash = h.hexdigest()
+        self.file_path = os.path.join(self.blob_dir, self.blob_hash)
+        with open(self.file_path, 'wb') as f:
+            f.write(self.data)
+        self.bm = PackedBlobManager(DHTHashAnnouncer(None, None), self.blob_dir, self.db_dir,
+                                    segment_size=20)
+
+    @defer.inlineCallbacks
+    def tearDown(self):
+        yield self.bm.stop()
+        shutil.rmtree(self.blob_dir)
+        shutil.rmtree(self.db_dir)
+        conf.settings = None
+
+    @defer.inlineCallbacks
+    def _read_blob(self, blob_hash):
+        blob = yield self.bm.get_blob(blob_hash)
+        read_handle = blob.open_for_reading()
+        data = read_handle.read()
+        blob.close_read_handle(read_handle)
+        defer.returnValue(data)
+
+    @defer.inlineCallbacks
+    def test_blob_files_are_copied_into_segments(self):
+        yield self.bm.setup()
+        yield self.bm._migration_deferred
+        self.assertFalse(os.path.isfile(self.file_path))
+        self.assertEqual([0], self.bm.segment_store.get_segments())
+        yield self.bm.stop()
+        self.bm = PackedBlobManager(DHTHashAnnouncer(None, None), self.blob_dir, self.db_dir,
+                                    segment_size=20)
+        yield self.bm.setup()
+        completed = yield self.bm.completed_blobs([self.blob_hash])
+        self.assertEqual([self.blob_hash], completed)
+        blob = yield self.bm.get_blob(self.blob_hash)
+        self.assertEqual((0, 0), blob.location)
+        data = yield self._read_blob(self.blob_hash)
+        self.assertEqual(self.data, data)
+
+    @defer.inlineCallbacks
+    def test_blob_file_is_served_until_copied(self):
+        with mock.patch.object(self.bm, '_migrate_blob_files'):
+            yield self.bm.setup()
+        completed = yield self.bm.completed_blobs([self.blob_hash])
+        self.assertEqual([self.blob_hash], completed)
+        lengths = yield self.bm.get_stored_blob_lengths()
+        self.assertEqual({self.blob_hash: len(self.data)}, lengths)
+        blob = yield self.bm.get_blob(self.blob_hash)
+        read_handle = blob.open_for_reading()
+        self.bm._migrate_blob_files()
+        yield self.bm._migration_deferred
+        self.assertTrue(os.path.isfile(self.file_path))
+        self.assertEqual(self.data, read_handle.read())
+        blob.close_read_handle(read_handle)
+        self.bm._next_migrate_call.cancel()
+        self.bm._migrate_blob_files()
+        yield self.bm._migration_deferred
+        self.assertFalse(os.path.isfile(self.file_path))
+        data = yield self._read_blob(self.blob_hash)
+        self.assertEqual(self.data, data)
+
+    @defer.inlineCallbacks
+    def test_only_stored_blobs_are_announced(self):
+        yield self.bm.setup()
+        yield self.bm._migration_deferred
+        missing = random_lbry_hash()
+        yield self.bm.db_conn.runQuery(
+            "insert into blobs values (?, ?, ?, ?)", (missing, 10, 0, 0))
+        yield self.bm.db_conn.runQuery(
+            "update blobs set next_announce_time = 0")
+        to_announce = yield self.bm.hashes_to_announce()
+        self.assertEqual([], to_announce)
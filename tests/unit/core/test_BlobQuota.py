@@ -0,0 +1,102 @@
+import os
+import shutil
+import tempfile
+
+import mock
+
+from twisted.trial import unittest
+from twisted.internet import defer
+
+from lbrynet import conf
+from lbrynet.core.BlobManager import DiskBlobManager
+from lbrynet.core.BlobQuota import BlobQuota, LRUUploadEvictionPolicy
+from lbrynet.core.BlobQuota import LeastAvailableEvictionPolicy, LowestEarningEvictionPolicy
+from lbrynet.core.BlobQuota import get_eviction_policy
+from lbrynet.core.cryptoutils import get_lbry_hash_obj
+from lbrynet.core.server.DHTHashAnnouncer import DHTHashAnnouncer
+
+
+class BlobQuotaTest(unittest.TestCase):
+    def setUp(self):
+        conf.initialize_settings()
+        self.blob_dir = tempfile.mkdtemp()
+        self.db_dir = tempfile.mkdtemp()
+        self.blob_hashes = [self._write_blob(c * 10) for c in 'abc']
+        self.bm = DiskBlobManager(DHTHashAnnouncer(None, None), self.blob_dir, self.db_dir)
+        return self.bm.setup()
+
+    @defer.inlineCallbacks
+    def tearDown(self):
+        yield self.bm.stop()
+        shutil.rmtree(self.blob_dir)
+        shutil.rmtree(self.db_dir)
+        conf.settings = None
+
+    def _write_blob(self, data):
+        h = get_lbry_hash_obj()
+        h.update(data)
+        blob_hash = h.hexdigest()
+        with open(os.path.join(self.blob_dir, blob_hash), 'wb') as f:
+            f.write(data)
+        return blob_hash
+
+    @defer.inlineCallbacks
+    def _upload(self, blob_hash, rate, ts):
+        yield self.bm.db_conn.runQuery(
+            "insert into upload values (null, ?, ?, ?, ?)", (blob_hash, '1.2.3.4', rate, ts))
+
+    @defer.inlineCallbacks
+    def test_stored_blob_lengths_include_blobs_not_in_db(self):
+        lengths = yield self.bm.get_stored_blob_lengths()
+        self.assertEqual(dict((blob_hash, 10) for blob_hash in self.blob_hashes), lengths)
+
+    @defer.inlineCallbacks
+    def test_nothing_is_evicted_within_quota(self):
+        quota = BlobQuota(self.bm, LRUUploadEvictionPolicy(self.bm), max_bytes=30, max_blobs=3)
+        evicted = yield quota.enforce()
+        self.assertEqual([], evicted)
+        self.assertEqual(30, quota.get_status()['stored_bytes'])
+
+    @defer.inlineCallbacks
+    def test_least_recently_uploaded_blobs_are_evicted(self):
+        first, second, third = self.blob_hashes
+        yield self._upload(first, 1.0, 300)
+        yield self._upload(second, 1.0, 100)
+        yield self._upload(third, 1.0, 200)
+        quota = BlobQuota(self.bm, LRUUploadEvictionPolicy(self.bm), max_bytes=15, max_blobs=0)
+        evicted = yield quota.enforce()
+        self.assertEqual([second, third], evicted)
+        self.assertEqual(set([first]), self.bm.verified_blob_hashes)
+        self.assertIn(second, self.bm.blob_hashes_to_delete)
+
+    @defer.inlineCallbacks
+    def test_lowest_earning_blobs_are_evicted(self):
+        first, second, third = self.blob_hashes
+        yield self._upload(first, 1.0, 100)
+        yield self._upload(first, 1.0, 100)
+        yield self._upload(third, 0.5, 100)
+        quota = BlobQuota(self.bm, LowestEarningEvictionPolicy(self.bm), max_bytes=0, max_blobs=1)
+        evicted = yield quota.enforce()
+        self.assertEqual([second, third], evicted)
+
+    @defer.inlineCallbacks
+    def test_least_available_blobs_are_evicted(self):
+        first, second, third = self.blob_hashes
+        tracker = mock.Mock(availability={first: [1, 2], second: [1, 2, 3]})
+        quota = BlobQuota(self.bm, LeastAvailableEvictionPolicy(tracker), max_blobs=2)
+        evicted = yield quota.enforce()
+        self.assertEqual([third], evicted)
+
+    @defer.inlineCallbacks
+    def test_protected_and_busy_blobs_are_not_evicted(self):
+        first, second, third = self.blob_hashes
+        quota = BlobQuota(self.bm, LRUUploadEvictionPolicy(self.bm), max_blobs=1)
+        quota.add_protected_blobs_source(lambda: defer.succeed([first]))
+        blob = yield self.bm.get_blob(second)
+        read_handle = blob.open_for_reading()
+        evicted = yield quota.enforce()
+        blob.close_read_handle(read_handle)
+        self.assertEqual([third], evicted)
+
+    def test_unknown_eviction_policy(self):
+        self.assertRaises(ValueError, get_eviction_policy, 'most_recent', self.bm, None)
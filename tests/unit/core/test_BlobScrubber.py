@@ -0,0 +1,37 @@
+import mock
+from twisted.internet import defer
+from twisted.trial import unittest
+
+from lbrynet.core.BlobScrubber import BlobScrubber
+
+
+class FakeBlobManager(object):
+    def __init__(self, corrupt):
+        self.corrupt = corrupt
+        self.scrubbed = []
+
+    def scrub_blob(self, blob_hash):
+        self.scrubbed.append(blob_hash)
+        return defer.succeed((10, blob_hash in self.corrupt))
+
+
+class BlobScrubberTest(unittest.TestCase):
+    def setUp(self):
+        self.blob_hashes = ['%02i' % i for i in range(10)]
+        self.blob_manager = FakeBlobManager(set(self.blob_hashes[:6]))
+        with mock.patch.object(BlobScrubber, 'MAX_CORRUPT_BLOB_HASHES', 4):
+            self.scrubber = BlobScrubber(self.blob_manager, 1000, 3600)
+        self.scrubber._stopped = False
+        # check the next blob only when told to, instead of from the reactor
+        self.scrubber._schedule = mock.Mock()
+
+    def test_blobs_are_checked_in_order_and_recent_corrupt_hashes_are_kept(self):
+        self.scrubber._set_blobs_to_check(self.blob_hashes)
+        for _ in self.blob_hashes:
+            self.scrubber._check_next_blob()
+        self.assertEqual(self.blob_hashes, self.blob_manager.scrubbed)
+        status = self.scrubber.get_status()
+        self.assertEqual(10, status['blobs_checked'])
+        self.assertEqual(0, status['blobs_remaining'])
+        self.assertEqual(6, status['corrupt_blobs_found'])
+        self.assertEqual(self.blob_hashes[2:6], status['corrupt_blobs'])
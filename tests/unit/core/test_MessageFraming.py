@@ -0,0 +1,50 @@
+import json
+
+from twisted.trial import unittest
+
+from lbrynet.core import MessageFraming
+
+
+class MessageBufferTest(unittest.TestCase):
+    def setUp(self):
+        self.buff = MessageFraming.MessageBuffer()
+
+    def test_unframed_message_in_pieces(self):
+        message = json.dumps({'requested_blobs': ['a' * 96, 'b' * 96], 'nested': {'x': 1}})
+        for i in range(0, len(message), 7):
+            self.assertEqual((None, None), self.buff.get_message())
+            self.buff.write(message[i:i + 7])
+        self.assertEqual(json.loads(message), self.buff.get_message()[0])
+        self.assertEqual(0, len(self.buff))
+
+    def test_unframed_message_followed_by_blob_data(self):
+        self.buff.write('  {"incoming_blob": {"length": 3}}abc')
+        self.assertEqual(({'incoming_blob': {'length': 3}}, 'abc'), self.buff.get_message())
+
+    def test_framed_message_in_pieces(self):
+        self.buff.framed = True
+        message = json.dumps({'available_blobs': ['}' * 10]})
+        data = MessageFraming.frame_message(message) + 'blob data'
+        for i in range(0, len(data) - 9, 3):
+            self.assertEqual((None, None), self.buff.get_message())
+            self.buff.write(data[i:i + 3])
+        self.buff.write(data[len(data) - 9:])
+        self.assertEqual((json.loads(message), 'blob data'), self.buff.get_message())
+        self.assertEqual(0, len(self.buff))
+
+    def test_invalid_framed_message(self):
+        self.buff.framed = True
+        self.buff.write(MessageFraming.frame_message('{"a": '))
+        self.assertRaises(ValueError, self.buff.get_message)
+
+    def test_unframed_braces_in_strings_are_ignored(self):
+        message = json.dumps({'a': '}{"}\\', 'b': {'c': '\\"}'}})
+        for c in message[:-1]:
+            self.buff.write(c)
+            self.assertEqual((None, None), self.buff.get_message())
+        self.buff.write(message[-1] + '{')
+        self.assertEqual((json.loads(message), '{'), self.buff.get_message())
+
+    def test_invalid_unframed_message(self):
+        self.buff.write('{"a": }')
+        self.assertRaises(ValueError, self.buff.get_message)
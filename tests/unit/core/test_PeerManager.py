@@ -0,0 +1,49 @@
+import mock
+
+from twisted.trial import unittest
+
+from lbrynet.core.PeerManager import PeerManager
+
+
+class PeerManagerTest(unittest.TestCase):
+    def setUp(self):
+        self.now = 1000.0
+        patcher = mock.patch('time.time', lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.peer_manager = PeerManager(peer_ttl=600)
+
+    def test_same_peer_for_same_address(self):
+        peer = self.peer_manager.get_peer('1.2.3.4', 3333)
+        self.assertIs(peer, self.peer_manager.get_peer('1.2.3.4', 3333))
+        self.assertIsNot(peer, self.peer_manager.get_peer('1.2.3.4', 3334))
+        self.assertEqual(2, self.peer_manager.get_status()['known_peers'])
+
+    def test_inactive_peers_are_forgotten(self):
+        idle = self.peer_manager.get_peer('1.2.3.4', 3333)
+        active = self.peer_manager.get_peer('1.2.3.5', 3333)
+        down = self.peer_manager.get_peer('1.2.3.6', 3333)
+        self.now += 500
+        active.report_success()
+        self.now += 200
+        # peers being backed off from are kept
+        down.report_down()
+        down.last_active = idle.last_active
+        self.peer_manager.get_peer('1.2.3.7', 3333)
+        self.assertNotIn(('1.2.3.4', 3333), self.peer_manager.peers)
+        self.assertIn(('1.2.3.6', 3333), self.peer_manager.peers)
+        self.assertIs(active, self.peer_manager.get_peer('1.2.3.5', 3333))
+        self.assertIsNot(idle, self.peer_manager.get_peer('1.2.3.4', 3333))
+        self.assertEqual(1, self.peer_manager.get_status()['peers_expired'])
+
+    def test_peer_stats_snapshot(self):
+        good = self.peer_manager.get_peer('1.2.3.4', 3333)
+        self.peer_manager.get_peer('1.2.3.5', 3333)
+        good.update_score(5)
+        good.update_stats('blobs_downloaded', 2)
+        stats = self.peer_manager.get_peer_stats()
+        self.assertEqual(['1.2.3.4', '1.2.3.5'], [s['host'] for s in stats])
+        self.assertEqual({'blobs_downloaded': 2}, stats[0]['stats'])
+        # the snapshot doesn't change with the peer
+        good.update_stats('blobs_downloaded', 1)
+        self.assertEqual({'blobs_downloaded': 2}, stats[0]['stats'])
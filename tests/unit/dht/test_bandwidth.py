@@ -0,0 +1,76 @@
+import unittest
+
+from lbrynet.dht.bandwidth import RateCounter, RecentAddresses, TopTalkers
+from lbrynet.dht.bandwidth import TokenBucket, SourceRateLimiter
+
+
+class RateCounterTest(unittest.TestCase):
+    def test_counts_within_window(self):
+        counter = RateCounter(window=1.0, buckets=10)
+        counter.add(100, 10.0)
+        counter.add(50, 10.55)
+        self.assertEqual((2, 150), counter.totals(10.6))
+        self.assertEqual((1, 50), counter.totals(11.05))
+        self.assertEqual((0, 0), counter.totals(12.0))
+
+    def test_reused_bucket_is_reset(self):
+        counter = RateCounter(window=1.0, buckets=10)
+        counter.add(100, 10.05)
+        counter.add(10, 11.05)
+        self.assertEqual((1, 10), counter.totals(11.06))
+
+
+class RecentAddressesTest(unittest.TestCase):
+    def test_expires_addresses_not_seen_recently(self):
+        recent = RecentAddresses(window=1.0)
+        recent.add(('1.2.3.4', 4444), 10.0)
+        recent.add(('1.2.3.5', 4444), 10.5)
+        recent.add(('1.2.3.4', 4444), 10.6)
+        self.assertEqual(2, recent.count(10.9))
+        self.assertEqual(1, recent.count(11.55))
+        self.assertEqual(0, recent.count(11.6))
+
+
+class TopTalkersTest(unittest.TestCase):
+    def test_tracks_the_largest_peers(self):
+        top = TopTalkers(size=2)
+        top.add('a', 100)
+        top.add('b', 10)
+        top.add('a', 100)
+        top.add('c', 5)
+        self.assertEqual([('a', 200), ('c', 15)], top.top())
+        self.assertEqual([('a', 200)], top.top(1))
+
+    def test_replaces_the_smallest_after_counts_change(self):
+        top = TopTalkers(size=3)
+        for address, size in [('a', 10), ('b', 20), ('c', 30), ('a', 25), ('b', 1)]:
+            top.add(address, size)
+        # b, with 21 bytes, is now the smallest
+        top.add('d', 1)
+        self.assertEqual([('a', 35), ('c', 30), ('d', 22)], top.top())
+        for _ in range(10):
+            top.add('c', 1)
+        self.assertLessEqual(len(top._heap), 2 * top.size)
+        top.add('e', 1)
+        self.assertEqual([('c', 40), ('a', 35), ('e', 23)], top.top())
+
+
+class TokenBucketTest(unittest.TestCase):
+    def test_allows_bursts_then_the_rate(self):
+        bucket = TokenBucket(rate=2, burst=3, now=10.0)
+        self.assertEqual([True, True, True, False], [bucket.consume(10.0) for _ in range(4)])
+        self.assertTrue(bucket.consume(10.5))
+        self.assertFalse(bucket.consume(10.6))
+        # the bucket never holds more than the burst
+        self.assertEqual([True, True, True, False], [bucket.consume(20.0) for _ in range(4)])
+
+
+class SourceRateLimiterTest(unittest.TestCase):
+    def test_limits_each_source_separately(self):
+        limiter = SourceRateLimiter(rate=1, burst=1, size=2)
+        self.assertTrue(limiter.consume('a', 10.0))
+        self.assertFalse(limiter.consume('a', 10.0))
+        self.assertTrue(limiter.consume('b', 10.0))
+        # the least recently seen source is forgotten, and starts over
+        self.assertTrue(limiter.consume('c', 10.0))
+        self.assertTrue(limiter.consume('a', 10.0))
@@ -9,8 +9,14 @@ import time
 import datetime
 import random
 
+import os
+import shutil
+import tempfile
+
+import lbrynet.dht.contact
 import lbrynet.dht.datastore
 import lbrynet.dht.constants
+import lbrynet.dht.node
 
 import hashlib
 
@@ -82,7 +88,76 @@ class DictDataStoreTest(unittest.TestCase):
         self.failIf('val2' in self.ds.getPeersForBlob(h1),  'DataStore failed to delete an expired value! Value %s, publish time %s, current time %s'  % ('val2', str(now - td2), str(now)))
         self.failIf('val3' in self.ds.getPeersForBlob(h2), 'DataStore failed to delete an expired value! Value %s, publish time %s, current time %s'  % ('val3', str(now - td2), str(now)))
         self.failUnless('val4' in self.ds.getPeersForBlob(h2), 'DataStore deleted an unexpired value! Value %s, publish time %s, current time %s'  % ('val4', str(now), str(now)))
-            
+
+    def testReannounceDoesNotDuplicatePeer(self):
+        now = int(time.time())
+        key = hashlib.sha1('dup').digest()
+        for i in range(24):
+            self.ds.addPeerToBlob(key, 'peer1', now - 3600 * (24 - i), now - 3600 * 24, '1')
+        self.ds.addPeerToBlob(key, 'peer2', now, now, '2')
+        self.assertEqual(['peer1', 'peer2'], sorted(self.ds.getPeersForBlob(key)))
+        self.assertEqual(2, len(self.ds._expiryHeap))
+
+    def testReannounceRefreshesExpiry(self):
+        now = int(time.time())
+        key = hashlib.sha1('refresh').digest()
+        old = now - lbrynet.dht.constants.dataExpireTimeout - 100
+        self.ds.addPeerToBlob(key, 'refreshed', old, old, '1')
+        self.ds.addPeerToBlob(key, 'expired', old, old, '2')
+        self.ds.addPeerToBlob(key, 'refreshed', now, now, '1')
+        self.ds.removeExpiredPeers()
+        self.assertEqual(['refreshed'], self.ds.getPeersForBlob(key))
+        self.assertEqual(1, len(self.ds._expiryHeap))
+
+    def testKeyIsRemovedWhenAllPeersExpire(self):
+        old = int(time.time()) - lbrynet.dht.constants.dataExpireTimeout - 100
+        key = hashlib.sha1('gone').digest()
+        self.ds.addPeerToBlob(key, 'val', old, old, '1')
+        self.ds.removeExpiredPeers()
+        self.failIf(self.ds.hasPeersForBlob(key))
+        self.failIf(key in self.ds.keys())
+
+
+class SQLiteDataStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.db_file = os.path.join(self.tmp_dir, 'dht.sqlite')
+        self.key = hashlib.sha1('persisted').digest()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def testPeersAndStateSurviveRestart(self):
+        now = int(time.time())
+        old = now - lbrynet.dht.constants.dataExpireTimeout - 10
+        ds = lbrynet.dht.datastore.SQLiteDataStore(self.db_file)
+        ds.addPeerToBlob(self.key, 'peer1', now, now, 'node1')
+        ds.addPeerToBlob(self.key, 'peer2', old, old, 'node2')
+        ds['nodeState'] = {'id': 'a' * 48, 'closestNodes': [('b' * 48, '1.2.3.4', 4444)]}
+        ds.save()
+
+        restored = lbrynet.dht.datastore.SQLiteDataStore(self.db_file)
+        self.assertEqual(['peer1'], restored.getPeersForBlob(self.key))
+        self.failUnless('nodeState' in restored)
+        self.assertEqual('a' * 48, restored['nodeState']['id'])
+
+    def testNodeRestoresIDAndContacts(self):
+        ds = lbrynet.dht.datastore.SQLiteDataStore(self.db_file)
+        node = lbrynet.dht.node.Node(udpPort=None, dataStore=ds)
+        contact_id = node._generateID()
+        node._routingTable.addContact(
+            lbrynet.dht.contact.Contact(contact_id, '1.2.3.4', 4444, node._protocol))
+        node.stop()
+
+        restored_ds = lbrynet.dht.datastore.SQLiteDataStore(self.db_file)
+        restored = lbrynet.dht.node.Node(udpPort=None, dataStore=restored_ds)
+        self.addCleanup(restored.stop)
+        self.assertEqual(node.id, restored.id)
+        self.assertEqual(contact_id, restored._routingTable.getContact(contact_id).id)
+        self.assertEqual(
+            [contact_id], [c.id for c in restored._routingTable.findCloseNodes(node.id, 8)])
+
+
 #        # First write with fake values
 #        for key, value in self.cases:
 #            except Exception:
@@ -114,6 +189,7 @@ class DictDataStoreTest(unittest.TestCase):
 def suite():
     suite = unittest.TestSuite()
     suite.addTest(unittest.makeSuite(DictDataStoreTest))
+    suite.addTest(unittest.makeSuite(SQLiteDataStoreTest))
     return suite
 
 
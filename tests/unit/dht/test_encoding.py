@@ -37,6 +37,25 @@ class BencodeTest(unittest.TestCase):
         for encodedValue in self.badDecoderCases:
             self.failUnlessRaises(lbrynet.dht.encoding.DecodeError, self.encoding.decode, encodedValue)
 
+    def testNestedDictsAreDecoded(self):
+        """ Tests that values following a dictionary are decoded """
+        value = ['key', {'port': 3333, 'lbryid': 'id'}, 'node', 0]
+        encodedValue = self.encoding.encode(value)
+        self.failUnlessEqual(encodedValue, 'l3:keyd6:lbryid2:id4:porti3333ee4:nodei0ee')
+        self.failUnlessEqual(self.encoding.decode(encodedValue), value)
+
+    def testExtensionsRoundTrip(self):
+        """ Tests the non-standard float and None extensions """
+        value = {'f': 1.5, 'n': None, 'l': (1, True)}
+        encodedValue = self.encoding.encode(value)
+        self.failUnlessEqual(encodedValue, 'd1:ff1.500000e1:lli1ei1ee1:nne')
+        self.failUnlessEqual(self.encoding.decode(encodedValue), {'f': 1.5, 'n': None, 'l': [1, 1]})
+
+    def testTruncatedData(self):
+        """ Tests that truncated data can't be decoded """
+        for encodedValue in ('l4:spami42e', 'i42', '10:spam', 'd3:foo'):
+            self.failUnlessRaises(lbrynet.dht.encoding.DecodeError, self.encoding.decode, encodedValue)
+
 def suite():
     suite = unittest.TestSuite()
     suite.addTest(unittest.makeSuite(BencodeTest))
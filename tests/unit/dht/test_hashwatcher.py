@@ -0,0 +1,33 @@
+import time
+import unittest
+
+from lbrynet.dht.hashwatcher import HashWatcher
+
+
+class HashWatcherTest(unittest.TestCase):
+    def setUp(self):
+        self.watcher = HashWatcher(ttl=600, bucket_width=10)
+        self.now = time.time()
+
+    def test_counts_distinct_requesters(self):
+        self.watcher._add('a', '1.2.3.4', self.now)
+        self.watcher._add('a', '1.2.3.4', self.now)
+        self.watcher._add('a', '1.2.3.5', self.now)
+        self.watcher._add('b', '1.2.3.4', self.now)
+        for ip in ('1.2.3.4', '1.2.3.6', '1.2.3.7'):
+            self.watcher._add('c', ip, self.now)
+        self.assertEqual([('c', 3), ('a', 2)], self.watcher.most_popular_hashes(2))
+
+    def test_expires_old_requests_and_keeps_new_ones(self):
+        self.watcher._add('a', '1.2.3.4', self.now)
+        self.watcher._add('a', '1.2.3.5', self.now)
+        self.watcher._add('b', '1.2.3.4', self.now + 300)
+        # seen again, so this one is kept for another ttl
+        self.watcher._add('a', '1.2.3.5', self.now + 500)
+        self.watcher._remove_old_hashes(self.now + 650)
+        self.assertEqual({'a': 1, 'b': 1}, self.watcher._counts)
+        self.watcher._remove_old_hashes(self.now + 1000)
+        self.assertEqual({'a': 1}, self.watcher._counts)
+        self.watcher._remove_old_hashes(self.now + 1200)
+        self.assertEqual({}, self.watcher._counts)
+        self.assertEqual({}, self.watcher._last_seen)
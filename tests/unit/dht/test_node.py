@@ -0,0 +1,185 @@
+import mock
+
+from twisted.trial import unittest
+from twisted.internet import defer, reactor
+
+from lbrynet.dht import constants
+from lbrynet.dht import encoding
+from lbrynet.dht import msgformat
+from lbrynet.dht import msgtypes
+from lbrynet.dht.contact import Contact
+from lbrynet.dht.msgtypes import ResponseMessage
+from lbrynet.dht.node import Node, _BatchedFindValue, _IterativeFindHelper
+
+
+class FakeNetwork(object):
+    """Answers findNode and findValue RPCs from a table of canned responses"""
+
+    def __init__(self):
+        self.responses = {}  # {(node id, key): response}
+        self.rpcs = []
+
+    def sendRPC(self, contact, method, args, rawResponse=False):
+        key = args[0]
+        self.rpcs.append((contact.id, key))
+        default = {'contacts': []} if method == 'findValue' else []
+        response = self.responses.get((contact.id, key), default)
+        message = ResponseMessage("rpcId", contact.id, response)
+        d = defer.Deferred()
+        reactor.callLater(0, d.callback, (message, (contact.address, contact.port)))
+        return d
+
+
+class IterativeFindNodeTest(unittest.TestCase):
+    def setUp(self):
+        self.network = FakeNetwork()
+        self.node = Node('0' * 48, networkProtocol=self.network)
+
+    def tearDown(self):
+        self.node.next_change_token_call.cancel()
+
+    def _contact(self, c):
+        return Contact(c * 48, '1.2.3.4', 4444, self.network)
+
+    @defer.inlineCallbacks
+    def test_returns_closest_contacts_first_and_contacts_each_once(self):
+        key = '\x01' * 48
+        first, second, third, fourth = [self._contact(c) for c in '9753']
+        self.node.addContact(first)
+        # each contact only knows the next closer one, and the contacts before it
+        self.network.responses[(first.id, key)] = [(second.id, second.address, second.port)]
+        self.network.responses[(second.id, key)] = [
+            (c.id, c.address, c.port) for c in (first, third)]
+        self.network.responses[(third.id, key)] = [
+            (c.id, c.address, c.port) for c in (first, second, fourth)]
+
+        result = yield self.node.iterativeFindNode(key)
+        self.assertEqual([fourth, third, second, first], result)
+        contacted = [contact_id for contact_id, _ in self.network.rpcs]
+        self.assertEqual(sorted(set(contacted)), sorted(contacted))
+
+    @defer.inlineCallbacks
+    def test_uses_the_given_helper_class(self):
+        helpers = []
+
+        def make_helper(*args):
+            helper = _IterativeFindHelper(*args)
+            helpers.append(helper)
+            return helper
+
+        node = Node('1' * 48, networkProtocol=self.network, iterativeFindHelperClass=make_helper)
+        self.addCleanup(node.next_change_token_call.cancel)
+        contact = self._contact('9')
+        node.addContact(contact)
+        result = yield node.iterativeFindNode('\x01' * 48)
+        self.assertEqual([contact], result)
+        self.assertEqual(1, len(helpers))
+        self.assertEqual('\x01' * 48, helpers[0].key)
+
+
+class BatchedLookupTest(unittest.TestCase):
+    def setUp(self):
+        self.network = FakeNetwork()
+        self.node = Node('0' * 48, networkProtocol=self.network)
+        self.first = Contact('1' * 48, '1.2.3.1', 4444, self.network)
+        self.second = Contact('2' * 48, '1.2.3.2', 4444, self.network)
+        self.node.addContact(self.first)
+
+    def tearDown(self):
+        self.node.next_change_token_call.cancel()
+
+    @defer.inlineCallbacks
+    def test_lookups_share_the_nodes_they_find(self):
+        key_a, key_b = 'a' * 48, 'b' * 48
+        peer = '\x01\x02\x03\x04\x0d\x05' + 'c' * 48
+        # only the first lookup learns about the second node from the first one
+        self.network.responses[(self.first.id, key_a)] = {
+            'contacts': [(self.second.id, self.second.address, self.second.port)]}
+        self.network.responses[(self.second.id, key_a)] = {key_a: [peer]}
+        self.network.responses[(self.second.id, key_b)] = {key_b: [peer]}
+
+        with mock.patch.object(constants, 'batchedLookupParallelism', 1):
+            lookups = self.node.getPeersForBlobs([key_b, key_a])
+        peers_a = yield lookups[key_a]
+        peers_b = yield lookups[key_b]
+        self.assertEqual([('1.2.3.4', 3333)], peers_a)
+        self.assertEqual([('1.2.3.4', 3333)], peers_b)
+        self.assertIn((self.second.id, key_b), self.network.rpcs)
+
+    @defer.inlineCallbacks
+    def test_failed_lookup_gives_no_peers(self):
+        lookups = self.node.getPeersForBlobs(['a' * 48])
+        peers = yield lookups['a' * 48]
+        self.assertEqual([], peers)
+
+    @defer.inlineCallbacks
+    def test_failed_lookup_fails(self):
+        with mock.patch.object(self.node, 'iterativeFindValues',
+                               return_value={'a' * 48: defer.fail(ValueError('lookup failed'))}):
+            lookups = self.node.getPeersForBlobs(['a' * 48])
+        with self.assertRaises(ValueError):
+            yield lookups['a' * 48]
+
+    def test_cancelled_keys_are_not_looked_up(self):
+        keys = [chr(ord('a') + i) * 48 for i in range(10)]
+        batch = _BatchedFindValue(self.node, keys, parallelism=2)
+        started = []
+        running = []
+
+        def lookup(key):
+            started.append(key)
+            d = defer.Deferred()
+            running.append(d)
+            return d
+        batch._lookup = lookup
+        batch.start()
+        self.assertEqual(keys[:2], started)
+        for d in batch.results.values():
+            d.addErrback(lambda err: err.trap(defer.CancelledError))
+            d.cancel()
+        for d in running[:]:
+            d.callback({})
+        self.assertEqual(keys[:2], started)
+
+    def test_announcements_share_the_nodes_they_find(self):
+        key_a, key_b = 'a' * 48, 'b' * 48
+        self.network.responses[(self.first.id, key_a)] = [
+            (self.second.id, self.second.address, self.second.port)]
+
+        announcements = self.node.announceHaveBlobs([key_b, key_a], 3333, parallelism=1)
+        self.assertEqual(set([key_a, key_b]), set(announcements))
+        d = defer.DeferredList(announcements.values(), fireOnOneErrback=True)
+        d.addCallback(lambda _: self.assertIn((self.second.id, key_b), self.network.rpcs))
+        return d
+
+
+class RemoteStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.node = Node('0' * 48, externalIP='1.2.3.1')
+        self.node._protocol._send = mock.Mock()
+        self.key = 'a' * 48
+        self.sender = Contact('1' * 48, '1.2.3.4', 4444, None)
+
+    def tearDown(self):
+        self.node.next_change_token_call.cancel()
+
+    def _store(self, token):
+        value = {'port': 3333, 'lbryid': '2' * 48, 'token': token}
+        # the arguments Node.storeToContacts sends, the fourth being the age of the value
+        message = msgtypes.RequestMessage(self.sender.id, 'store',
+                                          [self.key, value, self.sender.id, 0])
+        primitive = msgformat.DefaultFormat().toPrimitive(message)
+        self.node._protocol.datagramReceived(encoding.Bencode().encode(primitive),
+                                             (self.sender.address, self.sender.port))
+        args, _ = self.node._protocol._send.call_args
+        return msgformat.DefaultFormat().fromPrimitive(encoding.Bencode().decode(args[0]))
+
+    def test_store_with_bad_token_is_rejected(self):
+        response = self._store('bogus')
+        self.assertTrue(isinstance(response, msgtypes.ErrorMessage))
+        self.assertFalse(self.node._dataStore.hasPeersForBlob(self.key))
+
+    def test_store_with_valid_token_is_accepted(self):
+        response = self._store(self.node.make_token(self.sender.compact_ip()))
+        self.assertEqual('OK', response.response)
+        self.assertTrue(self.node._dataStore.hasPeersForBlob(self.key))
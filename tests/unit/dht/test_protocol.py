@@ -0,0 +1,123 @@
+import mock
+
+from twisted.trial import unittest
+
+from lbrynet.dht import constants
+from lbrynet.dht import encoding
+from lbrynet.dht import msgformat
+from lbrynet.dht import msgtypes
+from lbrynet.dht.node import rpcmethod
+from lbrynet.dht.protocol import KademliaProtocol, RateLimitError, TimeoutError
+
+
+class FakeNode(object):
+    def __init__(self):
+        self.id = '0' * 48
+        self.contacts = []
+        self.findNodes = 0
+
+    def addContact(self, contact):
+        self.contacts.append(contact)
+
+    @rpcmethod
+    def findNode(self, key, _rpcNodeID=None, _rpcNodeContact=None):
+        self.findNodes += 1
+        return []
+
+    @rpcmethod
+    def findValue(self, key, _rpcNodeID=None, _rpcNodeContact=None):
+        return {'contacts': []}
+
+
+class RateLimitTest(unittest.TestCase):
+    def setUp(self):
+        self.node = FakeNode()
+        self.protocol = KademliaProtocol(self.node)
+        self.protocol._send = mock.Mock()
+
+    def _request(self, method, args, address=('1.2.3.4', 4444)):
+        message = msgtypes.RequestMessage('1' * 48, method, args)
+        primitive = msgformat.DefaultFormat().toPrimitive(message)
+        self.protocol.datagramReceived(encoding.Bencode().encode(primitive), address)
+
+    def _sent(self):
+        decode = encoding.Bencode().decode
+        translator = msgformat.DefaultFormat()
+        return [translator.fromPrimitive(decode(args[0]))
+                for args, _ in self.protocol._send.call_args_list]
+
+    def test_flooding_source_is_dropped(self):
+        for _ in range(constants.rpcBurstPerSource + 10):
+            self._request('findNode', ['a' * 48])
+        self.assertEqual(constants.rpcBurstPerSource, self.node.findNodes)
+        self.assertEqual(constants.rpcBurstPerSource, len(self._sent()))
+        self.assertEqual(constants.rpcBurstPerSource, len(self.node.contacts))
+        self.assertEqual(10, self.protocol.bandwidth_stats['queries_dropped'])
+        self.assertEqual({'findNode': constants.rpcBurstPerSource},
+                         self.protocol.bandwidth_stats['rpcs']['queries_received'])
+        # other sources are still answered
+        self._request('findNode', ['a' * 48], ('1.2.3.5', 4444))
+        self.assertEqual(constants.rpcBurstPerSource + 1, self.node.findNodes)
+
+    def test_requests_over_the_global_cap_get_an_error(self):
+        with mock.patch.object(constants, 'findValueRateLimit', 2):
+            self.protocol = KademliaProtocol(self.node)
+        self.protocol._send = mock.Mock()
+        for i in range(3):
+            self._request('findValue', ['a' * 48], ('1.2.3.%i' % i, 4444))
+        responses = self._sent()
+        self.assertFalse(isinstance(responses[0], msgtypes.ErrorMessage))
+        self.assertFalse(isinstance(responses[1], msgtypes.ErrorMessage))
+        self.assertTrue(isinstance(responses[2], msgtypes.ErrorMessage))
+        self.assertIn(RateLimitError.__name__, responses[2].exceptionType)
+        self.assertEqual(1, self.protocol.bandwidth_stats['queries_rejected'])
+
+
+class MultiPacketMessageTest(unittest.TestCase):
+    def setUp(self):
+        self.node = FakeNode()
+        self.protocol = KademliaProtocol(self.node)
+        self.protocol._send = mock.Mock()
+
+    def _packets(self, data, size, msgID='m' * 48):
+        packets = [data[i:i + size] for i in range(0, len(data), size)]
+        total = len(packets)
+        return ['\x00%s%s%s\x00%s' % (chr(total >> 8) + chr(total & 0xff),
+                                      chr(seq >> 8) + chr(seq & 0xff), msgID, packet)
+                for seq, packet in enumerate(packets)]
+
+    def test_packets_are_reassembled(self):
+        message = msgtypes.RequestMessage('1' * 48, 'findNode', ['a' * 48])
+        data = encoding.Bencode().encode(msgformat.DefaultFormat().toPrimitive(message))
+        for packet in reversed(self._packets(data, 10)):
+            self.protocol.datagramReceived(packet, ('1.2.3.4', 4444))
+        self.assertEqual(1, self.node.findNodes)
+        self.assertEqual(0, len(self.protocol._partialMessages))
+
+    def test_large_messages_are_split_and_reassembled(self):
+        sender = KademliaProtocol(FakeNode())
+        sender._scheduleSendNext = mock.Mock()
+        message = msgtypes.RequestMessage('1' * 48, 'findNode', ['a' * 48 * 400])
+        data = encoding.Bencode().encode(msgformat.DefaultFormat().toPrimitive(message))
+        sender._send(data, message.id, ('1.2.3.5', 4444))
+        packets = [args[0] for args, _ in sender._scheduleSendNext.call_args_list]
+        self.assertEqual(3, len(packets))
+        for packet in packets:
+            self.protocol.datagramReceived(packet, ('1.2.3.4', 4444))
+        self.assertEqual(1, self.node.findNodes)
+
+    def test_timed_out_partial_response_is_abandoned(self):
+        contact = mock.Mock(id='2' * 48, address='1.2.3.4', port=4444)
+        with mock.patch('lbrynet.dht.protocol.reactor') as reactor:
+            d = self.protocol.sendRPC(contact, 'findNode', ['a' * 48])
+            msgID = self.protocol._sentMessages.keys()[0]
+            self.protocol.datagramReceived(self._packets('x' * 30, 10, msgID)[0],
+                                           ('1.2.3.4', 4444))
+            # the first timeout sees progress and waits longer, the second doesn't
+            self.protocol._msgTimeout(msgID)
+            self.protocol._msgTimeout(msgID)
+        # one call for the RPC's timeout, and one for waiting longer
+        self.assertEqual(2, reactor.callLater.call_count)
+        self.assertNotIn(msgID, self.protocol._sentMessages)
+        self.assertEqual(1, self.protocol.bandwidth_stats['partial_messages_expired'])
+        return self.assertFailure(d, TimeoutError)
@@ -0,0 +1,44 @@
+import unittest
+
+from lbrynet.dht.reassembly import PartialMessages
+
+
+class PartialMessagesTest(unittest.TestCase):
+    def test_joins_packets_in_order(self):
+        messages = PartialMessages(maxAge=30, maxBytes=100)
+        self.assertIsNone(messages.add('a', 2, 3, 'ghi', 0))
+        self.assertIsNone(messages.add('a', 0, 3, 'abc', 0))
+        self.assertIsNone(messages.add('a', 0, 3, 'abc', 0))
+        self.assertEqual(2, messages.packetCount('a'))
+        self.assertEqual('abcdefghi', messages.add('a', 1, 3, 'def', 0))
+        self.assertNotIn('a', messages)
+        self.assertEqual(0, messages.size)
+
+    def test_expires_incomplete_messages(self):
+        messages = PartialMessages(maxAge=30, maxBytes=100)
+        messages.add('a', 0, 2, 'abc', 0)
+        messages.add('b', 0, 2, 'abc', 20)
+        messages.add('c', 0, 2, 'abc', 40)
+        self.assertNotIn('a', messages)
+        self.assertIn('b', messages)
+        self.assertEqual(1, messages.expired)
+        self.assertEqual(6, messages.size)
+
+    def test_drops_oldest_messages_over_the_size_limit(self):
+        messages = PartialMessages(maxAge=30, maxBytes=10)
+        messages.add('a', 0, 2, 'abcd', 0)
+        messages.add('b', 0, 2, 'abcd', 1)
+        messages.add('c', 0, 2, 'abcd', 2)
+        self.assertEqual(['b', 'c'], [m for m in 'abc' if m in messages])
+        self.assertEqual(1, messages.dropped)
+        self.assertEqual(8, messages.size)
+
+    def test_drops_inconsistent_packets(self):
+        messages = PartialMessages(maxAge=30, maxBytes=100)
+        messages.add('a', 0, 2, 'abc', 0)
+        self.assertIsNone(messages.add('a', 1, 3, 'def', 0))
+        self.assertNotIn('a', messages)
+        self.assertIsNone(messages.add('b', 5, 2, 'def', 0))
+        self.assertNotIn('b', messages)
+        self.assertEqual(2, messages.dropped)
+        self.assertEqual(0, messages.size)
@@ -1,3 +1,4 @@
+import random
 import unittest
 
 from lbrynet.dht import contact, routingtable, constants
@@ -57,3 +58,38 @@ class KeyErrorFixedTest(unittest.TestCase):
         #     print "Replacement Cache for Bucket " + str(key)
         #     for c in bucket:
         #         print "  contact " + str(c.id)
+
+
+class FindCloseNodesTest(unittest.TestCase):
+    def setUp(self):
+        random.seed(0)
+        self.own_id = self._random_id()
+        self.table = routingtable.OptimizedTreeRoutingTable(self.own_id)
+        for _ in range(500):
+            self.table.addContact(contact.Contact(self._random_id(), '127.0.0.1', 9999, None))
+
+    @staticmethod
+    def _random_id():
+        return ''.join(chr(random.randint(0, 255)) for _ in range(constants.key_bits / 8))
+
+    def _contacts(self):
+        return [c for bucket in self.table._buckets for c in bucket._contacts]
+
+    def testBucketIndex(self):
+        for c in self._contacts():
+            index = self.table._kbucketIndex(c.id)
+            self.assertTrue(self.table._buckets[index].keyInRange(c.id))
+
+    def testClosestByDistance(self):
+        for _ in range(20):
+            key = self._random_id()
+            distance = lambda c: long(c.id.encode('hex'), 16) ^ long(key.encode('hex'), 16)
+            expected = sorted(self._contacts(), key=distance)[:constants.k]
+            self.assertEqual(expected, self.table.findCloseNodes(key, constants.k))
+
+    def testExcludesSender(self):
+        closest = self.table.findCloseNodes(self.own_id, constants.k)
+        sender = closest[0]
+        result = self.table.findCloseNodes(self.own_id, constants.k, sender.id)
+        self.assertNotIn(sender, result)
+        self.assertEqual(closest[1:], result[:constants.k - 1])